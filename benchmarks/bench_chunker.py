@@ -0,0 +1,125 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re
+import time
+from pathlib import Path
+from typing import List, Dict
+from src.data.document_loader import extract_pdf_text
+from src.data.document_store import DocumentStore
+from src.data.preprocessor import DocumentPreprocessor, DocumentChunk
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+STORE_PATH = ROOT_DIR / "data" / "processed" / "documents.parquet"
+DOCS_DIR = ROOT_DIR / "src" / "web" / "static" / "docs"
+
+
+def load_corpus() -> List[Dict]:
+    """The processed documents if ingestion has run, otherwise the text of the PDFs served from the static directory."""
+    if STORE_PATH.exists():
+        return list(DocumentStore(STORE_PATH).iter_documents())
+
+    docs = []
+    for pdf_path in sorted(DOCS_DIR.rglob("*.pdf")):
+        parts = pdf_path.relative_to(DOCS_DIR).parts
+        # Same id scheme as DocumentLoader: course code, document type, file name
+        doc_id = f"{parts[0]}_{parts[1] if len(parts) > 2 else 'unknown'}_{pdf_path.stem}"
+        docs.append({"id": doc_id, "text": extract_pdf_text(str(pdf_path)), "metadata": {"file_path": str(pdf_path)}})
+    return docs
+
+
+def legacy_chunk_texts(text: str, chunk_size: int, chunk_overlap: int) -> List[List[str]]:
+    """The chunker this replaced: clean, split, clean every section again and re-join word lists. Chunks per section."""
+    def clean_text(text):
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'[^a-zA-Z0-9.,;:!?()\[\]{}\'\"\n\- ]+', '', text)
+        return text.strip()
+
+    section_pattern = re.compile(r'^(?:[A-Z][A-Z\s]+|[0-9]+\.[0-9]+(?:\.[0-9]+)?)$', re.MULTILINE)
+    sections = [clean_text(s).strip() for s in re.split(section_pattern, clean_text(text)) if s.strip()]
+    chunked = []
+    for section in sections:
+        words = section.split()
+        if len(words) <= chunk_size:
+            chunked.append([section])
+            continue
+        chunked.append([" ".join(words[i: i + chunk_size]) for i in range(0, len(words), chunk_size - chunk_overlap)])
+    return chunked
+
+
+def legacy_chunk_document(preprocessor: DocumentPreprocessor, doc_data: Dict) -> List[DocumentChunk]:
+    """The legacy chunk_document, building the same chunk objects and metadata."""
+    metadata = preprocessor.extract_metadata_from_doc(doc_data)
+    doc_chunks = []
+    for section_index, section_chunks in enumerate(legacy_chunk_texts(doc_data.get("text", ""), preprocessor.chunk_size, preprocessor.chunk_overlap)):
+        for chunk_index, chunk_text in enumerate(section_chunks):
+            chunk_metadata = metadata.copy()
+            chunk_metadata.update({
+                "section_index": section_index,
+                "chunk_index": chunk_index,
+                "total_chunks_in_section": len(section_chunks),
+                "section_summary": section_chunks[0][:150],
+            })
+            doc_chunks.append(DocumentChunk(
+                chunk_id=f"{metadata['semester']}_{metadata['assignment_type']}_{metadata['assignment']}_section_{section_index}_chunk_{chunk_index}",
+                text=chunk_text,
+                metadata=chunk_metadata,
+            ))
+    return doc_chunks
+
+
+def check_against_legacy(preprocessor: DocumentPreprocessor, docs: List[Dict]) -> int:
+    """
+    Count documents whose chunks differ from the legacy chunker's. The legacy chunker ended a section
+    with chunks wholly contained in the one before; those are not produced any more and are skipped here.
+    """
+    mismatches = 0
+    for doc_data in docs:
+        chunks = preprocessor.chunk_document(doc_data)
+        expected = []
+        for section_chunks in legacy_chunk_texts(doc_data["text"], preprocessor.chunk_size, preprocessor.chunk_overlap):
+            while len(section_chunks) > 1 and section_chunks[-1] in section_chunks[-2]:
+                section_chunks.pop()
+            expected.extend(section_chunks)
+        if [chunk.text for chunk in chunks] != expected:
+            mismatches += 1
+            print(f"[MISMATCH] {doc_data['id']}: {len(chunks)} chunks, legacy chunker made {len(expected)}", file=sys.stderr)
+    return mismatches
+
+
+def bench(chunk_document, docs: List[Dict], repeat: int) -> Dict:
+    """Chunk the whole corpus `repeat` times and return the chunk count and chunks per second."""
+    chunks = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for doc_data in docs:
+            chunks += len(chunk_document(doc_data))
+    elapsed = time.perf_counter() - start
+    return {"chunks": chunks // repeat, "chunks_per_s": chunks / elapsed, "ms_per_pass": elapsed / repeat * 1e3}
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    docs = load_corpus()
+    total_chars = sum(len(doc["text"]) for doc in docs)
+    print(f"Loaded {len(docs)} documents ({total_chars / 1e6:.2f}M characters) in {time.perf_counter() - start:.2f}s")
+    repeat = int(os.getenv("BENCH_REPEAT", "20"))
+
+    words_preprocessor = DocumentPreprocessor()
+    small_preprocessor = DocumentPreprocessor(chunk_size=200, chunk_overlap=20)
+    tokens_preprocessor = DocumentPreprocessor(chunk_size=512, chunk_overlap=64, chunk_unit="tokens")
+
+    mismatches = check_against_legacy(words_preprocessor, docs) + check_against_legacy(small_preprocessor, docs)
+    results = {
+        "legacy (1000/100 words)": bench(lambda doc: legacy_chunk_document(words_preprocessor, doc), docs, repeat),
+        "offsets (1000/100 words)": bench(words_preprocessor.chunk_document, docs, repeat),
+        "legacy (200/20 words)": bench(lambda doc: legacy_chunk_document(small_preprocessor, doc), docs, repeat),
+        "offsets (200/20 words)": bench(small_preprocessor.chunk_document, docs, repeat),
+        "offsets (512/64 tokens)": bench(tokens_preprocessor.chunk_document, docs, repeat),
+    }
+
+    for name, result in results.items():
+        print(f"{name:26s} {result['chunks']:6d} chunks  {result['chunks_per_s']:10.0f} chunks/s  {result['ms_per_pass']:8.2f} ms/pass")
+    print(f"Documents chunked differently from the legacy chunker: {mismatches}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,332 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+sys.path.append(str(BENCH_DIR))
+
+from fake_openai import add_server_arguments, server_settings
+from synthetic_corpus import generate_corpus, SEMESTERS, DOCUMENT_TYPES, HEADINGS, VOCABULARY
+
+
+def reset_peak_rss():
+    """Start a new peak-RSS measurement for this process (Linux only; elsewhere the peak covers the whole run)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process since the last reset_peak_rss(), in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def children_peak_rss_mb() -> float:
+    """Largest peak resident memory of any finished child process, e.g. the PDF extraction workers."""
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentiles(samples: List[float]) -> Dict:
+    samples = np.asarray(samples) * 1e3
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def git_revision() -> Dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def start_fake_openai(args: argparse.Namespace) -> subprocess.Popen:
+    """Run the OpenAI stand-in in its own process, so serving it does not compete with the code being measured."""
+    command = [sys.executable, str(BENCH_DIR / "fake_openai.py"), "--port", str(args.port)]
+    for name, value in vars(args).items():
+        if name in ("embedding_latency_ms", "embedding_item_latency_ms", "first_token_ms", "token_interval_ms",
+                    "completion_tokens", "dimensions"):
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # printed once the server is listening
+    return server
+
+
+def prepare_corpus(args: argparse.Namespace, work_dir: Path) -> Dict:
+    """Generate the corpus, or reuse one generated earlier with the same settings."""
+    corpus_dir = work_dir / f"corpus_{args.documents}_{args.seed}_{args.max_pages}"
+    stats_path = corpus_dir.with_suffix(".json")
+    if stats_path.exists():
+        stats = json.loads(stats_path.read_text())
+    else:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        stats = generate_corpus(corpus_dir, args.documents, seed=args.seed, max_pages=args.max_pages)
+        stats_path.write_text(json.dumps(stats))
+    return {**stats, "path": str(corpus_dir)}
+
+
+def bench_loader(corpus: Dict, run_dir: Path, workers: int) -> Dict:
+    from src.data.document_loader import DocumentLoader
+    loader = DocumentLoader(raw_dir=corpus["path"], processed_dir=str(run_dir / "processed"), docs_dir=str(run_dir / "docs"),
+                            manifest_path=str(run_dir / "ingest_manifest.json"), workers=workers)
+    reset_peak_rss()
+    start = time.perf_counter()
+    docs = loader.load_documents()
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": len(docs),
+        "seconds": elapsed,
+        "documents_per_s": len(docs) / elapsed,
+        "pages_per_s": corpus["pages"] / elapsed,
+        "mb_per_s": corpus["bytes"] / 1e6 / elapsed,
+        "workers": loader.workers,
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_peak_rss_mb": children_peak_rss_mb(),
+    }
+
+
+def bench_preprocessor(run_dir: Path):
+    from src.data.preprocessor import DocumentPreprocessor
+    preprocessor = DocumentPreprocessor(processed_dir=str(run_dir / "processed"))
+    reset_peak_rss()
+    start = time.perf_counter()
+    chunks = preprocessor.process_all_documents()
+    elapsed = time.perf_counter() - start
+    return chunks, {
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "chunks_per_s": len(chunks) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_embeddings(chunks: List, run_dir: Path, vector_store: str):
+    from src.data.tokens import estimate_tokens
+    from src.rag.embeddings import EmbeddingsManager
+    # A fresh data directory, so nothing comes from the embedding cache
+    manager = EmbeddingsManager(vector_store=vector_store, data_dir=str(run_dir / "data"))
+    reset_peak_rss()
+    start = time.perf_counter()
+    manager.embed_chunks(chunks)
+    elapsed = time.perf_counter() - start
+    tokens = sum(estimate_tokens(chunk.text) for chunk in chunks)
+    return manager, {
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "chunks_per_s": len(chunks) / elapsed,
+        "tokens_per_s": tokens / elapsed,
+        "vector_store": manager.vector_store,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def make_queries(count: int, seed: int) -> List[str]:
+    """Distinct student questions about the synthetic corpus, so no answer comes from the retrieval caches."""
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        semester = rng.choice(SEMESTERS).replace("_", " ").lower()
+        document_type = rng.choice(DOCUMENT_TYPES).replace("_", " ").lower()
+        query = (f"What are the {rng.choice(HEADINGS).lower()} of the {semester} {document_type} "
+                 f"about {' and '.join(rng.sample(VOCABULARY, 2))}?")
+        if query not in queries:
+            queries.append(query)
+    return queries
+
+
+def bench_queries(manager, queries: List[str], concurrency: int, warmup: int) -> Dict:
+    from src.rag.retriever import RAGHandler
+    from src.rag.telemetry import get_telemetry
+    rag = RAGHandler(embeddings_manager=manager)
+
+    def ask(index_query):
+        index, query = index_query
+        start = time.perf_counter()
+        first_token = None
+        for token in rag.generate_response(query, [{"role": "user", "content": query}], session_id=f"bench-{index}"):
+            if first_token is None and token:
+                first_token = time.perf_counter() - start
+        return first_token, time.perf_counter() - start
+
+    # Warm-up questions load the indexes and open connections; they are not measured
+    for item in enumerate(queries[:warmup]):
+        ask(item)
+    get_telemetry().reset()
+
+    measured = list(enumerate(queries[warmup:]))
+    reset_peak_rss()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(ask, measured))
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(measured),
+        "concurrency": concurrency,
+        "queries_per_s": len(measured) / elapsed,
+        "first_token": percentiles([first_token for first_token, _ in results if first_token is not None]),
+        "total": percentiles([total for _, total in results]),
+        "stages": get_telemetry().stats(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_batch(manager, queries: List[str]) -> Dict:
+    """The same questions answered with one RAGHandler.answer_batch call, as nightly jobs do."""
+    from src.rag.retriever import RAGHandler
+    rag = RAGHandler(embeddings_manager=manager)
+    manager.results_cache.clear()
+    manager.query_embedding_cache.clear()
+    start = time.perf_counter()
+    answers = rag.answer_batch(queries)
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(queries),
+        "queries_per_s": len(queries) / elapsed,
+        "elapsed_s": elapsed,
+        "errors": sum(answer["error"] is not None for answer in answers),
+    }
+
+
+def check_context_budget(manager, queries: List[str]) -> Dict:
+    """
+    Build the prompts for questions asked deep into a long conversation, which leaves less room than the
+    retrieved chunks take, and count the requests the context was not trimmed to fit.
+    """
+    from src.rag.retriever import RAGHandler, SYSTEM_PROMPT, COMPLETION_OPTIONS
+    from src.rag.context_assembler import MIN_CONTEXT_TOKENS
+    from src.data.tokens import estimate_tokens
+    rag = RAGHandler(embeddings_manager=manager)
+    rng = random.Random(0)
+    history = [{"role": role, "content": " ".join(rng.choices(VOCABULARY, k=250))} for role in ["user", "assistant"] * 3]
+
+    over_budget, budgets, tokens = 0, [], []
+    for query in queries:
+        context, messages = rag.prepare(query, history + [{"role": "user", "content": query}])
+        request_tokens = sum(estimate_tokens(message["content"]) for message in messages) + COMPLETION_OPTIONS["max_tokens"]
+        # The context may only exceed the request budget's share when that share is below the minimum
+        if context.tokens > context.budget or (request_tokens > rag.context_assembler.request_tokens
+                                               and context.budget > MIN_CONTEXT_TOKENS):
+            over_budget += 1
+            print(f"[OVER BUDGET] {query!r}: {context.tokens}/{context.budget} context tokens, "
+                  f"{request_tokens} request tokens", file=sys.stderr)
+        budgets.append(context.budget)
+        tokens.append(context.tokens)
+    return {"queries": len(queries), "over_budget": over_budget, "context_budget_p50": float(np.median(budgets)),
+            "context_tokens_p50": float(np.median(tokens))}
+
+
+def compare(results: Dict, baseline: Dict):
+    """Print the relative change of every number that both result files have."""
+    def flatten(value, prefix=""):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix, value
+
+    before = dict(flatten(baseline["results"]))
+    print(f"\nCompared with {baseline['git']['commit'][:10]}:")
+    for name, value in flatten(results["results"]):
+        if before.get(name):
+            print(f"  {name:50s} {before[name]:12.2f} -> {value:12.2f}  ({(value / before[name] - 1) * 100:+6.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure ingest throughput and query latency offline, against a local OpenAI stand-in")
+    parser.add_argument("--documents", type=int, default=100, help="size of the synthetic corpus (10 to 10000)")
+    parser.add_argument("--max-pages", type=int, default=8, help="pages per document are drawn from 1 to this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="questions asked at the same time")
+    parser.add_argument("--workers", type=int, default=0, help="PDF extraction processes, 0 for one per core")
+    parser.add_argument("--vector-store", default=os.getenv("VECTOR_STORE", "chroma"), choices=["chroma", "numpy"])
+    parser.add_argument("--work-dir", default=str(BENCH_DIR / "work"), help="where corpora and indexes are written")
+    parser.add_argument("--output", help="results file, by default results/pipeline_<commit>_<documents>.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--port", type=int, default=8089, help="port of the OpenAI stand-in")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    from src.rag.telemetry import configure_logging
+    configure_logging(os.getenv("LOG_LEVEL", "WARNING"))
+
+    server = start_fake_openai(args)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    # Offline means offline: no usage events from Chroma either
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    try:
+        work_dir = Path(args.work_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        corpus = prepare_corpus(args, work_dir)
+        print(f"Corpus: {corpus['documents']} documents, {corpus['pages']} pages, {corpus['bytes'] / 1e6:.1f} MB")
+
+        run_dir = work_dir / "run"
+        shutil.rmtree(run_dir, ignore_errors=True)
+        results = {"loader": bench_loader(corpus, run_dir, args.workers)}
+        print(f"DocumentLoader:        {results['loader']['documents_per_s']:10.1f} documents/s")
+        chunks, results["preprocessor"] = bench_preprocessor(run_dir)
+        print(f"DocumentPreprocessor:  {results['preprocessor']['chunks_per_s']:10.1f} chunks/s")
+        manager, results["embeddings"] = bench_embeddings(chunks, run_dir, args.vector_store)
+        print(f"EmbeddingsManager:     {results['embeddings']['chunks_per_s']:10.1f} chunks/s")
+        results["query"] = bench_queries(manager, make_queries(args.queries + args.warmup, args.seed), args.concurrency, args.warmup)
+        print(f"RAGHandler:            {results['query']['total']['p50_ms']:10.1f} ms p50, "
+              f"{results['query']['total']['p99_ms']:.1f} ms p99, first token {results['query']['first_token']['p50_ms']:.1f} ms p50")
+        results["batch"] = bench_batch(manager, make_queries(args.queries, args.seed))
+        print(f"RAGHandler batch:      {results['batch']['queries_per_s']:10.1f} questions/s")
+        results["context_budget"] = check_context_budget(manager, make_queries(args.queries, args.seed))
+        print(f"Context budget:        {results['context_budget']['over_budget']:10d} of "
+              f"{results['context_budget']['queries']} prompts over budget")
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "benchmark": "pipeline",
+        "git": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {**{key: value for key, value in vars(args).items() if key not in ("output", "baseline", "work_dir")},
+                   "server": server_settings(args)},
+        "corpus": {key: value for key, value in corpus.items() if key != "path"},
+        "results": results,
+    }
+    output = Path(args.output or BENCH_DIR / "results" / f"pipeline_{report['git']['commit'][:10]}_{args.documents}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        compare(report, json.loads(Path(args.baseline).read_text()))
@@ -0,0 +1,43 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+from src.rag.query_router import QueryRouter
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "routing_queries.json")
+
+
+def check_routes(router: QueryRouter, corpus) -> int:
+    """Print every query whose route differs from the expected one and return the number of mismatches."""
+    mismatches = 0
+    for case in corpus:
+        filters = router.route(case["query"]) or None
+        if filters != case["filters"]:
+            mismatches += 1
+            print(f"[MISMATCH] {case['query']!r}: expected {case['filters']}, got {filters}")
+    return mismatches
+
+
+def bench(router: QueryRouter, queries, repeat: int = 2000) -> float:
+    """Return the mean time in microseconds to build the where-clause for one query."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            router.where_clause(query)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1e6
+
+
+if __name__ == "__main__":
+    with open(CORPUS_PATH, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    start = time.perf_counter()
+    router = QueryRouter.from_file()
+    print(f"Compiled {len(router.rules)} rules into one regex in {(time.perf_counter() - start) * 1e3:.2f}ms")
+
+    mismatches = check_routes(router, corpus)
+    print(f"{len(corpus) - mismatches}/{len(corpus)} queries routed as expected")
+    print(f"where_clause: {bench(router, [case['query'] for case in corpus]):.2f}us per query")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,176 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+sys.path.append(str(BENCH_DIR))
+
+from bench_pipeline import git_revision, start_fake_openai
+from fake_openai import add_server_arguments
+
+# What streamlit_app.py imports before it can render anything
+APP_IMPORTS = "import streamlit; from src.rag.retriever import RAGHandler; from src.web.pdf_pages import extract_pages; from src.rag.telemetry import configure_logging"
+QUESTION = "What are the weekly goals for the semester 4 group project?"
+
+
+def run_child(warm_up: bool) -> Dict:
+    """One cold start, in this fresh interpreter: import the app, create the handler, then answer a first question."""
+    start = time.perf_counter()
+    exec(APP_IMPORTS, {})
+    from src.rag.retriever import RAGHandler
+    imported = time.perf_counter()
+    rag = RAGHandler()
+    created = time.perf_counter()
+    timings = {"import_s": imported - start, "create_handler_s": created - imported, "first_page_ready_s": created - start}
+
+    if warm_up:
+        rag.start_warm_up().join()
+        timings["warm_up_s"] = time.perf_counter() - created
+
+    question_start = time.perf_counter()
+    answer = "".join(token for token in rag.generate_response(QUESTION, [{"role": "user", "content": QUESTION}]) if token)
+    timings["first_question_s"] = time.perf_counter() - question_start
+    timings["answered"] = bool(answer)
+    return timings
+
+
+def start_cold(env: Dict, warm_up: bool) -> Dict:
+    """Measure one cold start in a new process; the interpreter's own startup counts too."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, "--child", "warm" if warm_up else "cold"],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - start
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process_s"] = total
+    return timings
+
+
+def api_first_page(env: Dict, port: int, timeout: float = 30.0) -> Dict:
+    """Seconds from launching the FastAPI app until it serves the chat page, and until its warm-up has finished."""
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, str(ROOT_DIR / "src" / "web" / "api.py")], env={**env, "PORT": str(port)},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timings = {}
+    try:
+        while time.perf_counter() - start < timeout and "warm_up_s" not in timings:
+            try:
+                if "first_page_s" not in timings:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                        if response.status == 200:
+                            timings["first_page_s"] = time.perf_counter() - start
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as response:
+                    if "warm_up" in json.load(response)["stages"]:
+                        timings["warm_up_s"] = time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def slowest_imports(env: Dict, count: int = 10) -> List[Dict]:
+    """Modules with the largest cumulative import time when the app starts."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", APP_IMPORTS], env=env, cwd=ROOT_DIR,
+                            capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line.split("|")
+            imports.append({"module": name.strip(), "cumulative_ms": int(cumulative) / 1e3})
+    return sorted(imports, key=lambda item: item["cumulative_ms"], reverse=True)[:count]
+
+
+def median_timings(runs: List[Dict]) -> Dict:
+    # A timing missing from any run (say, an API start that timed out) is left out
+    keys = [key for key in runs[0] if isinstance(runs[0][key], float) and all(key in run for run in runs)]
+    return {key: statistics.median(run[key] for run in runs) for key in keys}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile how fast a new app process serves its first page and its first answer")
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts measured per scenario; medians are reported")
+    parser.add_argument("--data-dir", default=str(ROOT_DIR / "data"), help="index to start from; a temporary copy is used")
+    parser.add_argument("--output", help="results file, by default results/startup_<commit>.json")
+    parser.add_argument("--port", type=int, default=8089, help="port of the OpenAI stand-in")
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child == "warm")))
+        sys.exit(0)
+
+    server = start_fake_openai(args)
+    work_dir = Path(tempfile.mkdtemp(prefix="startup-bench-"))
+    try:
+        # Chroma may write to the directory it opens, so the index under test is a copy
+        shutil.copytree(Path(args.data_dir) / "chroma_db", work_dir / "chroma_db")
+        env = {
+            **os.environ,
+            "RAG_DATA_DIR": str(work_dir),
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.port}/v1",
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "offline-benchmark"),
+            "ANONYMIZED_TELEMETRY": "False",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        }
+        results = {
+            # A first question right after start, and one after the background warm-up had finished
+            "cold": median_timings([start_cold(env, warm_up=False) for _ in range(args.repeat)]),
+            "warmed": median_timings([start_cold(env, warm_up=True) for _ in range(args.repeat)]),
+            "api": median_timings([api_first_page(env, free_port()) for _ in range(args.repeat)]),
+            "slowest_imports": slowest_imports(env),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Streamlit app ready to render: {results['cold']['first_page_ready_s'] * 1e3:8.1f} ms "
+          f"({results['cold']['import_s'] * 1e3:.1f} ms imports, {results['cold']['create_handler_s'] * 1e3:.1f} ms handler), "
+          f"{results['cold']['process_s'] * 1e3:.1f} ms in all")
+    print(f"First answer without warm-up:  {results['cold']['first_question_s'] * 1e3:8.1f} ms")
+    print(f"First answer after warm-up:    {results['warmed']['first_question_s'] * 1e3:8.1f} ms "
+          f"(warm-up took {results['warmed']['warm_up_s'] * 1e3:.1f} ms in the background)")
+    print(f"API first page:                {results['api'].get('first_page_s', float('nan')) * 1e3:8.1f} ms after launch, "
+          f"warmed up after {results['api'].get('warm_up_s', float('nan')) * 1e3:.1f} ms")
+    print("Slowest imports:")
+    for item in results["slowest_imports"]:
+        print(f"  {item['cumulative_ms']:8.1f} ms  {item['module']}")
+
+    report = {
+        "benchmark": "startup",
+        "git": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"repeat": args.repeat},
+        "results": results,
+    }
+    output = Path(args.output or BENCH_DIR / "results" / f"startup_{report['git']['commit'][:10]}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
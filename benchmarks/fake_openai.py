@@ -0,0 +1,186 @@
+import json
+import time
+import array
+import base64
+import socket
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Same size as text-embedding-3-small, so vector stores and caches hold as much as in production
+DEFAULT_DIMENSIONS = 1536
+
+WORDS = ("the assignment is due at the end of week and counts towards your final grade so please "
+         "read the course manual carefully before you submit it on canvas").split()
+
+
+def fake_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> array.array:
+    """Deterministic unit-scale vector derived from a hash of the text; the same text always gets the same vector."""
+    digest = hashlib.shake_256(text.encode("utf-8")).digest(dimensions)
+    return array.array("f", [(byte - 127.5) / 127.5 for byte in digest])
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Answers the endpoints the app uses, /v1/embeddings, /v1/chat/completions and /v1/models/<id>,
+    in the shape the openai client expects. Latencies come from the server's settings.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Streamed tokens are tiny writes; send each at once instead of waiting on delayed acknowledgements
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # Model lookups, which the app uses to open connections while it warms up
+        if "/models/" in self.path:
+            self.send_json({"id": self.path.rstrip("/").rsplit("/", 1)[-1], "object": "model", "created": 0, "owned_by": "fake"})
+        else:
+            self.send_json({"error": {"message": f"Unknown endpoint {self.path}"}}, status=404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            self.embeddings(body)
+        elif path.endswith("/chat/completions"):
+            self.chat_completions(body)
+        else:
+            self.send_json({"error": {"message": f"Unknown endpoint {self.path}"}}, status=404)
+
+    def send_json(self, payload, status: int = 200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def embeddings(self, body):
+        settings = self.server.settings
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        time.sleep(settings["embedding_latency"] + settings["embedding_item_latency"] * len(texts))
+
+        dimensions = body.get("dimensions") or settings["dimensions"]
+        data = []
+        for index, text in enumerate(texts):
+            vector = fake_embedding(text, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text.split()) for text in texts)
+        self.send_json({"object": "list", "data": data, "model": body.get("model", "fake"),
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def chat_completions(self, body):
+        settings = self.server.settings
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(settings["completion_tokens"])]
+        created = int(time.time())
+        time.sleep(settings["first_token_latency"])
+
+        if not body.get("stream"):
+            time.sleep(settings["token_interval"] * len(tokens))
+            self.send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens).strip()}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Like the real API: a first chunk with only the role, then one per token, then an empty one with the finish reason
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": token} for token in tokens] + [{}]
+        for index, delta in enumerate(deltas):
+            if index > 1:
+                time.sleep(settings["token_interval"])
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the OpenAI API. Point the app at it with OPENAI_BASE_URL=<url>/v1.
+    Latencies are in seconds: a fixed cost per embedding request plus a cost per text, and
+    the time to the first streamed token plus the interval between tokens.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, embedding_latency: float = 0.02,
+                 embedding_item_latency: float = 0.0, first_token_latency: float = 0.1, token_interval: float = 0.002,
+                 completion_tokens: int = 32, dimensions: int = DEFAULT_DIMENSIONS):
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.settings = {
+            "embedding_latency": embedding_latency,
+            "embedding_item_latency": embedding_item_latency,
+            "first_token_latency": first_token_latency,
+            "token_interval": token_interval,
+            "completion_tokens": completion_tokens,
+            "dimensions": dimensions,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> threading.Thread:
+        """Serve from a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        thread.start()
+        return thread
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0, help="fixed latency of an embeddings request")
+    parser.add_argument("--embedding-item-latency-ms", type=float, default=0.0, help="extra latency per embedded text")
+    parser.add_argument("--first-token-ms", type=float, default=100.0, help="time to the first streamed chat token")
+    parser.add_argument("--token-interval-ms", type=float, default=2.0, help="time between streamed chat tokens")
+    parser.add_argument("--completion-tokens", type=int, default=32, help="tokens in every chat answer")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="size of the embedding vectors")
+
+
+def server_settings(args: argparse.Namespace) -> dict:
+    return {
+        "embedding_latency": args.embedding_latency_ms / 1e3,
+        "embedding_item_latency": args.embedding_item_latency_ms / 1e3,
+        "first_token_latency": args.first_token_ms / 1e3,
+        "token_interval": args.token_interval_ms / 1e3,
+        "completion_tokens": args.completion_tokens,
+        "dimensions": args.dimensions,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI embeddings and chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, **server_settings(args))
+    print(f"Fake OpenAI API listening, use OPENAI_BASE_URL={server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,104 @@
+import random
+import argparse
+from pathlib import Path
+from typing import List, Dict
+
+DOCUMENT_TYPES = ["Group_Project", "Individual_Assignments"]
+SEMESTERS = [f"Semester_{number}" for number in range(1, 7)]
+
+HEADINGS = ["LEARNING OBJECTIVES", "ASSIGNMENT DESCRIPTION", "DELIVERABLES", "ASSESSMENT CRITERIA",
+            "WEEKLY GOALS", "DEADLINES", "SUBMISSION GUIDELINES", "GRADING RUBRIC", "READING LIST"]
+VOCABULARY = """
+students group project individual assignment report presentation deadline week semester course
+research question method analysis data model network simulation agent policy ethics position statement
+grade percentage rubric criteria feedback peer review canvas submission draft final product capstone
+internship credits masters programme literature review hypothesis experiment survey interview sample
+visualisation python statistics regression complexity social science computational theory evidence
+argument structure clarity originality reflection contribution meeting tutor supervisor lecture seminar
+""".split()
+
+LINES_PER_PAGE = 55
+WORDS_PER_LINE = 13
+
+
+def make_pages(rng: random.Random, title: str, page_count: int) -> List[List[str]]:
+    """Lines of text for each page: a title, then uppercase section headings followed by paragraphs."""
+    pages = []
+    for page_number in range(page_count):
+        lines = [title.upper()] if page_number == 0 else []
+        while len(lines) < LINES_PER_PAGE:
+            if rng.random() < 0.08:
+                lines.append(rng.choice(HEADINGS))
+            else:
+                words = rng.choices(VOCABULARY, k=WORDS_PER_LINE)
+                if rng.random() < 0.1:
+                    words.insert(rng.randrange(len(words)), f"{rng.randint(1, 100)}%")
+                lines.append(" ".join(words).capitalize() + ".")
+        pages.append(lines)
+    return pages
+
+
+def escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: List[List[str]]) -> int:
+    """Write a minimal text PDF (one Helvetica font, one content stream per page) and return its size in bytes."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 13 TL 50 790 Td " + " ".join(f"({escape_pdf_text(line)}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(bytes(data))
+    return len(data)
+
+
+def generate_corpus(out_dir: str, documents: int, seed: int = 0, min_pages: int = 1, max_pages: int = 8) -> Dict:
+    """
+    Write `documents` PDFs laid out like the raw course materials, Semester_X/<type>/<name>.pdf.
+    The same arguments always produce the same files. Returns the number of files, pages and bytes written.
+    """
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    pages_written = bytes_written = 0
+    for index in range(documents):
+        semester = SEMESTERS[index % len(SEMESTERS)]
+        document_type = DOCUMENT_TYPES[(index // len(SEMESTERS)) % len(DOCUMENT_TYPES)]
+        topic = "_".join(rng.sample(VOCABULARY, 2))
+        name = f"{topic}_{index:05d}"
+        pages = make_pages(rng, f"{semester.replace('_', ' ')} {document_type.replace('_', ' ')} {topic.replace('_', ' ')}",
+                           rng.randint(min_pages, max_pages))
+        bytes_written += write_pdf(out_dir / semester / document_type / f"{name}.pdf", pages)
+        pages_written += len(pages)
+    return {"documents": documents, "pages": pages_written, "bytes": bytes_written}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus in the raw course materials layout")
+    parser.add_argument("out_dir")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=8)
+    args = parser.parse_args()
+
+    stats = generate_corpus(args.out_dir, args.documents, args.seed, args.min_pages, args.max_pages)
+    print(f"Wrote {stats['documents']} documents ({stats['pages']} pages, {stats['bytes'] / 1e6:.1f} MB) to {args.out_dir}")
@@ -1,19 +1,58 @@
 import os
+import logging
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Tuple
 import PyPDF2
 from docx import Document
-import json
 from datetime import datetime
 import shutil
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from src.data.manifest import FileManifest
+from src.data.document_store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+def extract_pdf_pages(file_path: str) -> List[str]:
+    """Extract the text of each page of a PDF. Kept at module level so process pools can pickle it."""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [page.extract_text() + "\n" for page in pdf_reader.pages]
+
+
+def extract_pdf_text(file_path: str) -> str:
+    """Extract the text of every page of a PDF."""
+    # Join once at the end instead of growing a string page by page
+    return "".join(extract_pdf_pages(file_path))
+
+
+def join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """The full text of a document and the character offset where each of its pages starts."""
+    offsets, position = [], 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page)
+    return "".join(pages), offsets
+
 
 class DocumentLoader:
-    def __init__(self, raw_dir: str = "data/raw", processed_dir: str = "data/processed", docs_dir: str = "src/web/static/docs"):
+    def __init__(self, raw_dir: str = "data/raw", processed_dir: str = "data/processed", docs_dir: str = "src/web/static/docs",
+                 manifest_path: str = "data/ingest_manifest.json", workers: int = 1):
         self.raw_dir = Path(raw_dir)
         self.processed_dir = Path(processed_dir)
         self.processed_dir.mkdir(parents=True, exist_ok=True)
         self.docs_dir = Path(docs_dir)
         self.docs_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = FileManifest(manifest_path)
+        self.store = DocumentStore(self.processed_dir / "documents.parquet")
+        # Number of processes used for PDF extraction, 0 means one per CPU core
+        self.workers = workers or os.cpu_count() or 1
 
     def copy_to_static(self, file_path: Path) -> Path:
         """Copy document to static directory and return new path."""
@@ -23,15 +62,43 @@ class DocumentLoader:
         shutil.copy2(file_path, new_path)
         return new_path
       
-    def process_pdf(self, file_path: Path) -> str:
-        """takes in a file path, extracts the text from the file and returns it as a string"""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-                
-        return text
+    def process_pdf(self, file_path: Path) -> List[str]:
+        """takes in a file path, extracts the text from the file and returns it as a list of page texts"""
+        return extract_pdf_pages(str(file_path))
+
+    def iter_texts(self, pdf_paths: List[Path]) -> Iterator[Tuple[Path, object]]:
+        """
+        Yield (path, pages) for each PDF in order, extracting in parallel when more than one worker is configured.
+        The pages are replaced by the exception raised if extracting that file failed.
+        Only a few files per worker are in flight at once, so memory does not grow with the corpus.
+        """
+        if self.workers <= 1 or len(pdf_paths) <= 1:
+            for pdf_path in pdf_paths:
+                try:
+                    yield pdf_path, self.process_pdf(pdf_path)
+                except Exception as e:
+                    yield pdf_path, e
+            return
+
+        logger.debug("Extracting %s PDFs with %s worker processes", len(pdf_paths), self.workers)
+        # Spawned, not forked: the pool may be started from a thread of the ingest pipeline while embedding
+        # and HTTP threads hold locks, which forked children would inherit locked
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(pdf_paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = deque()
+            paths = iter(pdf_paths)
+            for pdf_path in islice(paths, self.workers * 2):
+                pending.append((pdf_path, executor.submit(extract_pdf_pages, str(pdf_path))))
+            # Collect in submission order so the output does not depend on which worker finishes first
+            while pending:
+                pdf_path, future = pending.popleft()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append((next_path, executor.submit(extract_pdf_pages, str(next_path))))
+                try:
+                    yield pdf_path, future.result()
+                except Exception as e:
+                    yield pdf_path, e
     
     ### NOTE: future implementation for other file types maybe (txt, docx, ppt)
     
@@ -40,9 +107,9 @@ class DocumentLoader:
         get the metadata from the filepath and filename
         return the data as a dictionary
         """
-        print(f"\n[DEBUG] Extracting metadata for file: {file_path}")
+        logger.debug("Extracting metadata for file: %s", file_path)
         parts = file_path.relative_to(self.raw_dir).parts
-        print(f"[DEBUG] File parts: {parts}")
+        logger.debug("File parts: %s", parts)
 
         metadata = {
             "course_code": parts[0] if len(parts) > 1 else "unknown",
@@ -53,63 +120,138 @@ class DocumentLoader:
             "file_path": str(static_path),
             "original_path": str(file_path)
         }
-        print(f"[DEBUG] Generated metadata: {metadata}")
+        logger.debug("Generated metadata: %s", metadata)
         return metadata
         
-    def load_documents(self) -> List[Dict]:
-        """Load and process all documents in the raw directory"""
-        print("\n[DEBUG] Starting document loading process")
-        print(f"[DEBUG] Raw directory: {self.raw_dir}")
-    
-        processed_docs = []
-        
-        for file_path in self.raw_dir.rglob("*"):
-            print(f"\n[DEBUG] Processing file: {file_path}")
-            if not file_path.is_file():
-                print(f"[DEBUG] Skipping non-file: {file_path}")
-                continue
-            
-            try:
-                static_path = self.copy_to_static(file_path)
-                print(f"[DEBUG] Copied to static path: {static_path}")
+    def process_file(self, file_path: Path, pages: List[str] = None) -> Dict:
+        """
+        Copy a raw file to the static directory and, for PDFs, add its text to the document store.
+        The pages are extracted here unless they were already extracted in parallel. Returns None for skipped files.
+        """
+        static_path = self.copy_to_static(file_path)
+        logger.debug("Copied to static path: %s", static_path)
+
+        if file_path.suffix.lower() == ".pdf":
+            logger.debug("Processing PDF file: %s", file_path)
+            if pages is None:
+                pages = self.process_pdf(file_path)
+            text, page_offsets = join_pages(pages)
+            logger.debug("Extracted text length: %s characters from %s pages", len(text), len(pages))
+
+         ### NOTE: future implementation for other file types maybe (txt, docx, ppt)
+        else:
+            logger.debug("Skipping non-PDF file: %s", file_path)
+            return None
+
+        metadata = self.extract_metadata(file_path, static_path)
+        logger.debug("%s", metadata)
 
+        # Add the processed document to the store; it is written out with save()
+        doc_id = f"{metadata['course_code']}_{metadata['document_type']}_{file_path.stem}"
+        logger.debug("Storing processed document: %s", doc_id)
+
+        doc_data = {
+            "id": doc_id,
+            "text": text,
+            "page_offsets": page_offsets,
+            "metadata": metadata
+        }
+        self.store.put(doc_data)
+
+        logger.debug("Processed: %s", file_path.name)
+        return doc_data
+
+    def remove_outputs(self, relative_path: str, doc_id: str = None):
+        """Delete the static copy and processed document of a raw file that no longer exists."""
+        static_path = self.docs_dir / relative_path
+        if static_path.exists():
+            static_path.unlink()
+        if doc_id:
+            self.store.delete(doc_id)
+        logger.debug("Removed outputs of deleted file: %s", relative_path)
+
+    def plan_sync(self) -> Dict:
+        """
+        Compare the raw directory with the manifest and clean up the outputs of deleted files.
+        Returns the files on disk, the new or changed files with their content hashes, the ids of the deleted
+        documents and the ids the changed files were ingested under before (whose chunks are replaced).
+        """
+        logger.debug("Starting incremental document sync")
+        logger.debug("Raw directory: %s", self.raw_dir)
+
+        files = {
+            str(file_path.relative_to(self.raw_dir)): file_path
+            for file_path in sorted(self.raw_dir.rglob("*"))
+            if file_path.is_file()
+        }
+        changed, deleted = self.manifest.diff(files)
+        logger.debug("%s files on disk, %s new or changed, %s deleted", len(files), len(changed), len(deleted))
+
+        deleted_doc_ids = []
+        for relative_path in deleted:
+            entry = self.manifest.remove(relative_path)
+            self.remove_outputs(relative_path, entry.get("doc_id"))
+            if entry.get("doc_id"):
+                deleted_doc_ids.append(entry["doc_id"])
+
+        replaced_doc_ids = sorted({self.manifest.entries[relative_path]["doc_id"] for relative_path in changed
+                                   if self.manifest.entries.get(relative_path, {}).get("doc_id")})
+        return {"files": files, "changed": changed, "deleted": deleted_doc_ids, "replaced": replaced_doc_ids}
+
+    def iter_documents(self, plan: Dict) -> Iterator[Dict]:
+        """
+        Process the new or changed files of a sync plan one at a time, yielding each document as soon as it is ready.
+        The manifest and document store are updated in memory; the caller saves them once the documents have been indexed.
+        """
+        files, changed = plan["files"], plan["changed"]
+        pdf_paths = [files[relative_path] for relative_path in changed if files[relative_path].suffix.lower() == ".pdf"]
+        texts = self.iter_texts(pdf_paths)
+
+        for relative_path, content_hash in changed.items():
+            file_path = files[relative_path]
+            logger.debug("Processing file: %s", file_path)
+            try:
+                pages = None
                 if file_path.suffix.lower() == ".pdf":
-                    print(f"[DEBUG] Processing PDF file: {file_path}")
-                    text = self.process_pdf(file_path)
-                    print(f"[DEBUG] Extracted text length: {len(text) if text else 0} characters")
-
-                 ### NOTE: future implementation for other file types maybe (txt, docx, ppt)
-                else:
-                    print(f"[DEBUG] Skipping non-PDF file: {file_path}")
-                    continue
-                
-                metadata = self.extract_metadata(file_path, static_path)
-                print(metadata)
-                
-                # Save processed document as a json for easy extraction later
-                doc_id = f"{metadata['course_code']}_{metadata['document_type']}_{file_path.stem}"
-                processed_path = self.processed_dir / f"{doc_id}.json"
-                print(f"[DEBUG] Saving processed document to: {processed_path}")
-                
-                doc_data = {
-                    "id": doc_id,
-                    "text": text,
-                    "metadata": metadata
-                }
-                
-                with open(processed_path, 'w', encoding='utf-8') as f:
-                    json.dump(doc_data, f, ensure_ascii=False, indent=2)
-                
-                processed_docs.append(doc_data)
-                print(f"Processed: {file_path.name}")
-                
+                    _, pages = next(texts)
+                    if isinstance(pages, Exception):
+                        raise pages
+                doc_data = self.process_file(file_path, pages)
             except Exception as e:
-                print(f"Error processing {file_path}: {str(e)}")
-                
-        return processed_docs
+                logger.error("Error processing %s: %s", file_path, e)
+                continue
+
+            self.manifest.update(relative_path, file_path, content_hash, doc_data["id"] if doc_data else None)
+            if doc_data:
+                yield doc_data
+
+    def sync_documents(self) -> Dict:
+        """
+        Process only the raw files that are new or changed since the last run and clean up deleted ones.
+        Returns the updated documents and the ids of the deleted documents.
+        """
+        plan = self.plan_sync()
+        updated_docs = list(self.iter_documents(plan))
+        self.save()
+        return {"updated": updated_docs, "deleted": plan["deleted"]}
+
+    def save(self):
+        """Write the document store, then record the files as ingested."""
+        self.store.save()
+        self.manifest.save()
+
+    def load_documents(self, incremental: bool = True) -> List[Dict]:
+        """Load and process the documents in the raw directory, by default only those that changed since the last run"""
+        logger.debug("Starting document loading process")
+        if not incremental:
+            # Forget what was ingested before so every file is processed again
+            self.manifest.entries = {}
+        return self.sync_documents()["updated"]
             
             
 if __name__ == "__main__":
-    loader = DocumentLoader()
+    from src.rag.telemetry import configure_logging
+    configure_logging()
+    loader = DocumentLoader(workers=0)
     processed_docs = loader.load_documents()
     print(f"Successfully processed {len(processed_docs)} documents")
\ No newline at end of file
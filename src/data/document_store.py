@@ -0,0 +1,219 @@
+import os
+import logging
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import json
+import heapq
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Iterable, Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("text", pa.large_string()),
+    ("page_offsets", pa.list_(pa.int64())),  # character offset in text where each page starts
+    ("metadata", pa.string()),  # JSON, so documents with different metadata fields share one schema
+])
+
+# Rows are sorted by id and kept in small row groups, so reading a few ids only decodes the groups holding them
+ROW_GROUP_SIZE = 64
+
+# Buffered documents are spilled to a sorted segment file once there are this many, or this much text,
+# so ingesting a large corpus does not hold every document in memory until save()
+SPILL_DOCUMENTS = ROW_GROUP_SIZE * 4
+SPILL_CHARS = 64 * 1024 * 1024
+# Segments are written in small row groups, and merged into one once there are this many,
+# so merging decodes only a few documents per file at a time
+SEGMENT_ROW_GROUP_SIZE = 8
+MAX_SEGMENTS = 8
+
+
+class DocumentStore:
+    """
+    All processed documents in one Parquet file: text, page boundaries and metadata per row.
+
+    Reads memory-map the file and, when only some documents are needed, skip every row
+    group whose id range cannot contain them. Writes are buffered, spilled to sorted segment
+    files as the buffer fills, and applied with save(), which merges the segments into the
+    store file and replaces it atomically, so readers always see a complete store.
+    """
+
+    def __init__(self, store_path: str = "data/processed/documents.parquet"):
+        self.store_path = Path(store_path)
+        self.pending: Dict[str, Dict] = {}  # documents put since the last spill
+        self.pending_chars = 0
+        self.deleted = set()  # ids deleted since the last save
+        self.segments: List[Path] = []  # spilled documents, one sorted Parquet file per spill
+        self.spilled: Dict[str, int] = {}  # id -> segment holding its latest version
+        self._segment_dir = None
+        self._segment_count = 0
+
+    @staticmethod
+    def _to_row(doc_data: Dict) -> Dict:
+        return {
+            "id": doc_data["id"],
+            "text": doc_data.get("text", ""),
+            "page_offsets": doc_data.get("page_offsets") or [0],
+            "metadata": json.dumps(doc_data.get("metadata", {}), ensure_ascii=False),
+        }
+
+    @staticmethod
+    def _from_row(row: Dict) -> Dict:
+        return {
+            "id": row["id"],
+            "text": row["text"],
+            "page_offsets": row["page_offsets"],
+            "metadata": json.loads(row["metadata"]),
+        }
+
+    def put(self, doc_data: Dict):
+        self.deleted.discard(doc_data["id"])
+        self.pending[doc_data["id"]] = doc_data
+        self.pending_chars += len(doc_data.get("text", ""))
+        if len(self.pending) >= SPILL_DOCUMENTS or self.pending_chars >= SPILL_CHARS:
+            self._spill()
+
+    def delete(self, doc_id: str):
+        self.pending.pop(doc_id, None)
+        self.spilled.pop(doc_id, None)
+        self.deleted.add(doc_id)
+
+    def _spill(self):
+        """Write the buffered documents to a new segment file, sorted by id, and free them."""
+        if not self.pending:
+            return
+        if self._segment_dir is None:
+            self._segment_dir = Path(tempfile.mkdtemp(prefix="document-store-"))
+        segment_path = self._segment_dir / f"segment-{self._segment_count:05d}.parquet"
+        self._segment_count += 1
+        rows = [self._to_row(self.pending[doc_id]) for doc_id in sorted(self.pending)]
+        pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), segment_path, row_group_size=SEGMENT_ROW_GROUP_SIZE)
+        for doc_id in self.pending:
+            self.spilled[doc_id] = len(self.segments)
+        self.segments.append(segment_path)
+        logger.debug("Spilled %s documents to %s", len(self.pending), segment_path)
+        self.pending = {}
+        self.pending_chars = 0
+
+        if len(self.segments) >= MAX_SEGMENTS:
+            merged_path = self._segment_dir / f"segment-{self._segment_count:05d}.parquet"
+            self._segment_count += 1
+            self._merge([self._iter_rows(path, segment, SEGMENT_ROW_GROUP_SIZE) for segment, path in enumerate(self.segments)],
+                        merged_path, SEGMENT_ROW_GROUP_SIZE)
+            for path in self.segments:
+                path.unlink()
+            self.segments = [merged_path]
+            self.spilled = dict.fromkeys(self.spilled, 0)
+
+    @staticmethod
+    def _merge(sources: List[Iterator[Dict]], path: Path, row_group_size: int) -> int:
+        """Write the rows of sources that are each sorted by id to one sorted file. Returns the number of rows."""
+        written = 0
+        with pq.ParquetWriter(path, SCHEMA) as writer:
+            rows = []
+            for row in heapq.merge(*sources, key=lambda row: row["id"]):
+                rows.append(row)
+                if len(rows) == row_group_size:
+                    writer.write_table(pa.Table.from_pylist(rows, schema=SCHEMA))
+                    written += len(rows)
+                    rows = []
+            if rows:
+                writer.write_table(pa.Table.from_pylist(rows, schema=SCHEMA))
+                written += len(rows)
+        return written
+
+    def _is_current(self, row_id: str, segment: int = None) -> bool:
+        """Whether a row read from the store file (segment None) or a segment is the latest version of its document."""
+        if row_id in self.pending or row_id in self.deleted:
+            return False
+        return self.spilled.get(row_id) == segment
+
+    def _read(self, doc_ids: List[str] = None, columns: List[str] = None, path: Path = None) -> pa.Table:
+        path = path or self.store_path
+        if not path.exists():
+            return SCHEMA.empty_table().select(columns) if columns else SCHEMA.empty_table()
+        filters = [("id", "in", list(doc_ids))] if doc_ids is not None else None
+        return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+    def ids(self) -> List[str]:
+        """Ids of the stored documents, reading only the id column."""
+        stored = [doc_id for doc_id in self._read(columns=["id"]).column("id").to_pylist() if doc_id not in self.deleted]
+        return sorted(set(stored) | set(self.spilled) | set(self.pending))
+
+    def get(self, doc_ids: Iterable[str]) -> List[Dict]:
+        """The requested documents that exist, in the order asked for."""
+        doc_ids = list(doc_ids)
+        wanted = [doc_id for doc_id in doc_ids if self._is_current(doc_id)]
+        found = {row["id"]: self._from_row(row) for row in self._read(wanted).to_pylist()} if wanted else {}
+        for segment, segment_path in enumerate(self.segments):
+            in_segment = [doc_id for doc_id in doc_ids if self._is_current(doc_id, segment)]
+            if in_segment:
+                found.update((row["id"], self._from_row(row)) for row in self._read(in_segment, path=segment_path).to_pylist())
+        found.update((doc_id, self.pending[doc_id]) for doc_id in doc_ids if doc_id in self.pending)
+        return [found[doc_id] for doc_id in doc_ids if doc_id in found]
+
+    def _iter_rows(self, path: Path, segment: int = None, batch_size: int = ROW_GROUP_SIZE) -> Iterator[Dict]:
+        """Rows of the store file or a segment, in id order, that hold the latest version of their document."""
+        if path.exists():
+            parquet_file = pq.ParquetFile(path, memory_map=True)
+            for batch in parquet_file.iter_batches(batch_size=batch_size):
+                for row in batch.to_pylist():
+                    if self._is_current(row["id"], segment):
+                        yield row
+
+    def iter_documents(self, batch_size: int = ROW_GROUP_SIZE) -> Iterator[Dict]:
+        """Stream every stored document, one record batch in memory at a time."""
+        for segment, path in [(None, self.store_path)] + list(enumerate(self.segments)):
+            for row in self._iter_rows(path, segment, batch_size):
+                yield self._from_row(row)
+        yield from self.pending.values()
+
+    def save(self):
+        """
+        Apply the buffered puts and deletes, atomically replacing the store file. The store file and the
+        segments are all sorted by id, so they are merged a row group at a time and memory stays flat.
+        """
+        if not self.pending and not self.deleted and not self.segments:
+            return
+        self._spill()
+        sources = [self._iter_rows(self.store_path, None, SEGMENT_ROW_GROUP_SIZE)]
+        sources += [self._iter_rows(path, segment, SEGMENT_ROW_GROUP_SIZE) for segment, path in enumerate(self.segments)]
+
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.store_path.with_suffix(".tmp")
+        written = self._merge(sources, tmp_path, ROW_GROUP_SIZE)
+        os.replace(tmp_path, self.store_path)
+        logger.debug("Saved %s documents to %s (%s written, %s removed)", written, self.store_path, len(self.spilled), len(self.deleted))
+
+        if self._segment_dir is not None:
+            shutil.rmtree(self._segment_dir, ignore_errors=True)
+        self._segment_dir = None
+        self._segment_count = 0
+        self.segments = []
+        self.spilled = {}
+        self.deleted = set()
+
+    def import_json(self, processed_dir: str) -> int:
+        """Move processed documents saved as one JSON file each (the previous format) into the store."""
+        count = 0
+        for doc_path in sorted(Path(processed_dir).glob("*.json")):
+            with open(doc_path, 'r', encoding='utf-8') as f:
+                doc_data = json.load(f)
+            doc_data["id"] = doc_path.stem
+            self.put(doc_data)
+            count += 1
+        self.save()
+        return count
+
+
+if __name__ == "__main__":
+    # Convert a processed directory from the one-JSON-per-document format
+    store = DocumentStore()
+    imported = store.import_json(store.store_path.parent)
+    print(f"Imported {imported} documents, the store now holds {len(store.ids())}")
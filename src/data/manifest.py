@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class FileManifest:
+    """Record of the raw files that have been ingested, keyed by their path relative to the raw directory.
+
+    Each entry holds the content hash, mtime and size of the file plus the id of the
+    processed document it produced, so a later run can tell new, changed and deleted files apart.
+    """
+
+    def __init__(self, manifest_path: str = "data/ingest_manifest.json"):
+        self.manifest_path = Path(manifest_path)
+        self.entries: Dict[str, Dict] = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def hash_file(file_path: Path) -> str:
+        """Return the sha256 of a file's contents."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def diff(self, files: Dict[str, Path]) -> Tuple[Dict[str, str], List[str]]:
+        """
+        Compare the files currently on disk with the manifest.
+        Returns the new or changed files (relative path -> content hash) and the relative paths that were deleted.
+        """
+        changed = {}
+        for relative_path, file_path in files.items():
+            stat = file_path.stat()
+            entry = self.entries.get(relative_path)
+            # Unchanged mtime and size means the file was not touched, so skip hashing it
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+            content_hash = self.hash_file(file_path)
+            if entry and entry["sha256"] == content_hash:
+                # Touched but identical, only refresh the stat fields
+                entry.update({"mtime": stat.st_mtime, "size": stat.st_size})
+                continue
+            changed[relative_path] = content_hash
+
+        deleted = [relative_path for relative_path in self.entries if relative_path not in files]
+        return changed, deleted
+
+    def update(self, relative_path: str, file_path: Path, content_hash: str, doc_id: str = None):
+        stat = file_path.stat()
+        self.entries[relative_path] = {
+            "sha256": content_hash,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "doc_id": doc_id,
+        }
+
+    def remove(self, relative_path: str) -> Dict:
+        return self.entries.pop(relative_path, None)
+
+    def save(self):
+        """Atomically write the manifest to disk."""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
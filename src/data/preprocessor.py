@@ -1,10 +1,26 @@
 import json
+import logging
 import re
 import os
+import sys
+from bisect import bisect_right
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
 import numpy as np
 from pydantic import BaseModel
+from src.data.tokens import estimate_tokens, WORD_PIECE_CHARS
+from src.data.document_store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+# Compiled once at import instead of on every call
+UNUSUAL_CHARS_PATTERN = re.compile(r'[^a-zA-Z0-9.,;:!?()\[\]{}\'\"\n\- ]+')
+SECTION_PATTERN = re.compile(r'^(?:[A-Z][A-Z\s]+|[0-9]+\.[0-9]+(?:\.[0-9]+)?)$', re.MULTILINE)
+
+# Units chunk_size and chunk_overlap can be given in
+CHUNK_UNITS = ("words", "tokens")
 
 class DocumentChunk(BaseModel):
     chunk_id: str
@@ -12,37 +28,83 @@ class DocumentChunk(BaseModel):
     metadata: Dict
     
 class DocumentPreprocessor:
-    def __init__(self, processed_dir: str = "data/processed", chunk_size: int = 1000, chunk_overlap: int = 100):
+    def __init__(self, processed_dir: str = "data/processed", chunk_size: int = 1000, chunk_overlap: int = 100,
+                 chunk_unit: str = "words"):
+        if chunk_unit not in CHUNK_UNITS:
+            raise ValueError(f"chunk_unit must be one of {CHUNK_UNITS}, got {chunk_unit!r}")
         self.processed_dir = Path(processed_dir)
+        self.store = DocumentStore(self.processed_dir / "documents.parquet")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        # Whether chunk_size and chunk_overlap count words or (estimated) model tokens
+        self.chunk_unit = chunk_unit
         
     def clean_text(self, text: str) -> str:
-        """Normalize text by removing irrelevant symbols or content."""
-        text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
-        text = re.sub(r'[^a-zA-Z0-9.,;:!?()\[\]{}\'\"\n\- ]+', '', text)  # Remove unusual characters
-        return text.strip()
+        """Normalize text by removing irrelevant symbols or content. Words end up separated by single spaces."""
+        text = " ".join(text.split())  # Replace multiple spaces with a single space
+        text = UNUSUAL_CHARS_PATTERN.sub('', text)  # Remove unusual characters
+        # Removing characters can leave double spaces behind, collapse those too
+        return " ".join(text.split())
+
+    def clean_pages(self, text: str, page_offsets: List[int] = None) -> Tuple[str, List[int], List[int]]:
+        """
+        Clean a document page by page. Returns the cleaned text, which equals clean_text of the whole
+        document, with the offset where each non-empty page starts in it and that page's 1-based number.
+        """
+        if not page_offsets or len(page_offsets) < 2:
+            cleaned = self.clean_text(text)
+            return cleaned, [0], [1]
+        cleaned_pages, page_starts, page_numbers = [], [], []
+        position = 0
+        for page_index, page_start in enumerate(page_offsets):
+            page_end = page_offsets[page_index + 1] if page_index + 1 < len(page_offsets) else len(text)
+            page = self.clean_text(text[page_start:page_end])
+            if not page:
+                continue
+            if cleaned_pages:
+                position += 1  # the space joining it to the previous page
+            page_starts.append(position)
+            page_numbers.append(page_index + 1)
+            cleaned_pages.append(page)
+            position += len(page)
+        return " ".join(cleaned_pages), page_starts or [0], page_numbers or [1]
+
+    @staticmethod
+    def page_range(page_starts: List[int], page_numbers: List[int], start: int, end: int) -> Tuple[int, int]:
+        """First and last page number of the cleaned text between two offsets."""
+        first = page_numbers[bisect_right(page_starts, start) - 1]
+        last = page_numbers[bisect_right(page_starts, max(start, end - 1)) - 1]
+        return first, last
+
+    def section_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character offsets of the sections of a cleaned text, split on headings and subheadings."""
+        spans = []
+        start = 0
+        for heading in [*SECTION_PATTERN.finditer(text), None]:
+            end = heading.start() if heading else len(text)
+            # Trim the spaces around the section without copying it
+            while start < end and text[start] == " ":
+                start += 1
+            while end > start and text[end - 1] == " ":
+                end -= 1
+            if start < end:
+                spans.append((start, end))
+            if heading:
+                start = heading.end()
+        return spans
 
     def split_by_sections(self, text: str) -> List[str]:
         """Split text by sections using headings and subheadings."""
-        section_pattern = re.compile(r'^(?:[A-Z][A-Z\s]+|[0-9]+\.[0-9]+(?:\.[0-9]+)?)$', re.MULTILINE)
-        sections = re.split(section_pattern, text)
-        sections = [self.clean_text(s).strip() for s in sections if s.strip()]
-        return sections
+        text = self.clean_text(text)
+        return [text[start:end] for start, end in self.section_spans(text)]
     
     @staticmethod
-    def extract_metadata_from_path(file_path: str) -> Dict:
-        processed_path = Path(file_path)
-                
-        # Read the JSON to get original path structure
-        with open(processed_path, 'r') as f:
-            doc_data = json.load(f)
-        
+    def extract_metadata_from_doc(doc_data: Dict) -> Dict:
+        """Build the chunk metadata from a processed document, whose id encodes the original path structure."""
         static_path = doc_data["metadata"]["file_path"]
         
-        # Extract components from filename
-        filename = processed_path.stem  # Get filename without extension
-        parts = filename.split('_')
+        # Extract components from the document id (also the processed filename without extension)
+        parts = doc_data["id"].split('_')
             
         metadata = {
             "semester": f"{parts[0]}_{parts[1]}",  # Example: Semester_4
@@ -53,81 +115,143 @@ class DocumentPreprocessor:
         }
         return metadata
 
-    def chunk_text(self, text: str) -> List[str]:
-        """Split the text into overlapping chunks, preserving semantic coherence."""
-        print(f"\n[DEBUG] Chunking text of length: {len(text)}")
-        words = text.split()
-        chunks = []
+    @staticmethod
+    def extract_metadata_from_path(file_path: str) -> Dict:
+        processed_path = Path(file_path)
+                
+        # Read the JSON to get original path structure
+        with open(processed_path, 'r') as f:
+            doc_data = json.load(f)
+        
+        doc_data["id"] = processed_path.stem
+        return DocumentPreprocessor.extract_metadata_from_doc(doc_data)
 
-        if len(words) <= self.chunk_size:
-            print("[DEBUG] Text fits in single chunk")
-            return [text]
+    def word_sizes(self, words: List[str]) -> np.ndarray:
+        """Size of each word in the configured chunk unit."""
+        if self.chunk_unit == "tokens":
+            # Plain alphanumeric words are a single regex match, so their estimate needs no regex
+            return np.fromiter(
+                (1 + (len(word) - 1) // WORD_PIECE_CHARS if word.isalnum() else estimate_tokens(word) for word in words),
+                dtype=np.int64, count=len(words))
+        return np.ones(len(words), dtype=np.int64)
 
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk = " ".join(words[i: i + self.chunk_size])
-            chunks.append(chunk)
-            
-        print(f"[DEBUG] Created {len(chunks)} chunks")
+    def chunk_spans(self, text: str, start: int = 0, end: int = None) -> List[Tuple[int, int]]:
+        """
+        Character offsets of overlapping chunks covering text[start:end], which must be single-spaced
+        as clean_text leaves it. Each chunk holds at most chunk_size words or tokens (but at least
+        one word) and repeats chunk_overlap of them from the previous chunk.
+        """
+        end = len(text) if end is None else end
+        if start >= end:
+            return []
+
+        # Word offsets follow from the word lengths, since exactly one space separates the words
+        words = text[start:end].split(" ")
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        word_starts = start + np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+        word_ends = word_starts + lengths
+        # sizes[i] is the size of the first i words, so sizes[j] - sizes[i] is the size of words i..j-1
+        sizes = np.concatenate(([0], np.cumsum(self.word_sizes(words))))
+
+        if sizes[-1] <= self.chunk_size:
+            return [(start, end)]
+
+        spans = []
+        first = 0
+        while first < len(words):
+            last = max(first + 1, int(np.searchsorted(sizes, sizes[first] + self.chunk_size, side="right")) - 1)
+            spans.append((int(word_starts[first]), int(word_ends[last - 1])))
+            if last == len(words):
+                break
+            # Start the next chunk far enough back to repeat chunk_overlap of this one
+            first = max(first + 1, int(np.searchsorted(sizes, sizes[last] - self.chunk_overlap, side="left")))
+        return spans
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split the text into overlapping chunks, preserving semantic coherence."""
+        logger.debug("Chunking text of length: %s", len(text))
+        text = " ".join(text.split())
+        chunks = [text[start:end] for start, end in self.chunk_spans(text)]
+        logger.debug("Created %s chunks", len(chunks))
         return chunks
 
     def process_document(self, doc_path: Path) -> List[DocumentChunk]:
-        """Process a document into enriched chunks."""
-        print(f"\n[DEBUG] Processing document: {doc_path}")
+        """Process a document saved as a single JSON file into enriched chunks."""
+        logger.debug("Processing document: %s", doc_path)
         with open(doc_path, 'r', encoding="utf-8") as f:
             doc_data = json.load(f)
 
-        print("[DEBUG] Loaded JSON data")
-        raw_text = self.clean_text(doc_data.get("text", ""))
-        sections = self.split_by_sections(raw_text)
-        metadata = self.extract_metadata_from_path(doc_path)
-        print(f"[DEBUG] Extracted metadata: {metadata}")
+        logger.debug("Loaded JSON data")
+        doc_data["id"] = Path(doc_path).stem
+        return self.chunk_document(doc_data)
+
+    def chunk_document(self, doc_data: Dict) -> List[DocumentChunk]:
+        """Split an already loaded document into enriched chunks."""
+        # Clean once; sections and chunks are offsets into this text, sliced only when a chunk is built.
+        # Cleaning page by page keeps track of which page every offset falls on.
+        text, page_starts, page_numbers = self.clean_pages(doc_data.get("text", ""), doc_data.get("page_offsets"))
+        sections = self.section_spans(text)
+        metadata = self.extract_metadata_from_doc(doc_data)
+        logger.debug("Extracted metadata: %s", metadata)
 
         doc_chunks = []
-        print(f"[DEBUG] Processing {len(sections)} sections")
+        logger.debug("Processing %s sections", len(sections))
 
-        for section_index, section in enumerate(sections):
-            print(f"[DEBUG] Processing section {section_index}")
-            section_chunks = self.chunk_text(section)
-            for chunk_index, chunk_text in enumerate(section_chunks):
+        for section_index, (section_start, section_end) in enumerate(sections):
+            chunk_spans = self.chunk_spans(text, section_start, section_end)
+            for chunk_index, (chunk_start, chunk_end) in enumerate(chunk_spans):
                 chunk_id = f"{metadata['semester']}_{metadata['assignment_type']}_{metadata['assignment']}_section_{section_index}_chunk_{chunk_index}"
+                page_start, page_end = self.page_range(page_starts, page_numbers, chunk_start, chunk_end)
                 chunk_metadata = metadata.copy()
                 chunk_metadata.update({
                     "section_index": section_index,
                     "chunk_index": chunk_index,
-                    "total_chunks_in_section": len(section_chunks),
-                    "section_summary": section[:150],
+                    "total_chunks_in_section": len(chunk_spans),
+                    "section_summary": text[section_start:min(section_end, section_start + 150)],
+                    # Offsets of the chunk in the cleaned document text
+                    "char_start": chunk_start,
+                    "char_end": chunk_end,
+                    # Pages of the source PDF the chunk was taken from, 1-based and inclusive
+                    "page_start": page_start,
+                    "page_end": page_end,
                 })
                 doc_chunks.append(
                     DocumentChunk(
                         chunk_id=chunk_id,
-                        text=chunk_text,
+                        text=text[chunk_start:chunk_end],
                         metadata=chunk_metadata
                     )
                 )
-        print(f"[DEBUG] Created {len(doc_chunks)} chunks for document")
+        logger.debug("Created %s chunks for document", len(doc_chunks))
         return doc_chunks
 
-    def process_all_documents(self) -> List[DocumentChunk]:
-        """Process all documents in the processed directory."""
-        print("\n[DEBUG] Starting processing of all documents")
-        print(f"[DEBUG] Processing directory: {self.processed_dir}")
-        all_chunks = []
-
-        for doc_path in self.processed_dir.glob("*.json"):
+    def iter_chunks(self, docs: Iterable[Dict]) -> Iterator[DocumentChunk]:
+        """Chunk a stream of loaded documents, yielding the chunks of one document at a time."""
+        for doc_data in docs:
             try:
-                print(f"\n[DEBUG] Processing file: {doc_path}")
-                doc_chunks = self.process_document(doc_path)
-                all_chunks.extend(doc_chunks)
-                print(f"[DEBUG] Total chunks so far: {len(all_chunks)}")
-
+                doc_chunks = self.chunk_document(doc_data)
             except Exception as e:
-                print(f"[ERROR] Error processing {doc_path}: {str(e)}")
-                
-        print(f"\n[DEBUG] Finished processing all documents")
-        print(f"[DEBUG] Total chunks created: {len(all_chunks)}")
+                logger.error("Error processing %s: %s", doc_data.get('id'), e)
+                continue
+            yield from doc_chunks
+
+    def process_documents(self, doc_ids: List[str]) -> List[DocumentChunk]:
+        """Process only the given documents from the document store."""
+        logger.debug("Processing %s selected documents", len(doc_ids))
+        return list(self.iter_chunks(self.store.get(doc_ids)))
+
+    def process_all_documents(self) -> List[DocumentChunk]:
+        """Process all documents in the document store."""
+        logger.debug("Starting processing of all documents")
+        logger.debug("Document store: %s", self.store.store_path)
+        all_chunks = list(self.iter_chunks(self.store.iter_documents()))
+        logger.debug("Finished processing all documents")
+        logger.debug("Total chunks created: %s", len(all_chunks))
         return all_chunks
     
 if __name__ == "__main__":
+    from src.rag.telemetry import configure_logging
+    configure_logging()
     preprocessor = DocumentPreprocessor()
     chunks = preprocessor.process_all_documents()
     print(f"Created {len(chunks)} total chunks from all documents")
\ No newline at end of file
@@ -0,0 +1,18 @@
+import re
+
+# Words, numbers and single punctuation marks, roughly how BPE tokenizers split text
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Characters after which a word is assumed to spill over into another token
+WORD_PIECE_CHARS = 6
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of model tokens in a text without loading a tokenizer.
+
+    Short words count as one token, long words are split every few characters.
+    The estimate errs on the high side so budgets built on it stay safe.
+    """
+    if not text:
+        return 0
+    return sum(1 + (len(match) - 1) // WORD_PIECE_CHARS for match in TOKEN_PATTERN.findall(text))
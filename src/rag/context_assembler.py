@@ -0,0 +1,138 @@
+import os
+from typing import List, Dict, Tuple
+from pydantic import BaseModel
+from src.data.tokens import estimate_tokens
+
+# Chunks retrieved per question
+RETRIEVED_CHUNKS = 3
+
+# Tokens one request may use in all: system prompt, conversation, course material and the answer.
+# gpt-4o-mini takes 128k, but prompt size drives cost and latency, so a request is held to a small share of
+# that: about three full chunks (at the preprocessor's 1000 words, ~1700 tokens each) when there is no history
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "6000"))
+
+# Course material gets what the request budget leaves once the rest of the prompt and the answer are counted,
+# but at least MIN_CONTEXT_TOKENS, so a long conversation cannot crowd it out, and at most CONTEXT_TOKEN_BUDGET
+MIN_CONTEXT_TOKENS = 1000
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKEN_BUDGET", str(REQUEST_TOKEN_BUDGET)))
+
+# A truncated chunk shorter than this is not worth including
+MIN_PARTIAL_TOKENS = 50
+
+CHUNK_SEPARATOR = "\n\n"
+
+
+class AssembledContext(BaseModel):
+    text: str
+    tokens: int  # estimated tokens of text
+    budget: int
+    contexts: List[Dict]  # the retrieved contexts that were (at least partly) included, in rank order
+    dropped: int  # contexts left out because the budget was used up
+    overlap_words_removed: int
+
+
+def find_overlap(first: List[str], second: List[str]) -> int:
+    """Length of the longest run of words that ends `first` and starts `second`."""
+    if not first or not second:
+        return 0
+    start = max(0, len(first) - len(second))
+    for i in range(start, len(first)):
+        # Only positions holding the first word of `second` can start an overlap
+        if first[i] == second[0] and first[i:] == second[:len(first) - i]:
+            return len(first) - i
+    return 0
+
+
+class ContextAssembler:
+    """
+    Builds the course-material part of a prompt from ranked contexts.
+
+    Neighbouring chunks of the same section repeat the chunk overlap, so when both are
+    included the repeated words are dropped from one of them. Contexts are then packed
+    in rank order until the token budget is spent; the last one may be truncated.
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_CONTEXT_TOKENS, request_tokens: int = REQUEST_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+        self.request_tokens = request_tokens
+
+    def budget(self, *prompt_parts: str, answer_tokens: int = 0) -> int:
+        """Tokens left for course material in a request whose prompt is otherwise prompt_parts."""
+        remaining = self.request_tokens - answer_tokens - sum(estimate_tokens(part) for part in prompt_parts)
+        return min(self.max_tokens, max(MIN_CONTEXT_TOKENS, remaining))
+
+    @staticmethod
+    def chunk_position(context: Dict) -> Tuple:
+        """(document, section, chunk) of a context, or None if its metadata does not say."""
+        metadata = context.get("metadata") or {}
+        if metadata.get("section_index") is None or metadata.get("chunk_index") is None:
+            return None
+        document = metadata.get("filter_key") or metadata.get("file_path")
+        return document, int(metadata["section_index"]), int(metadata["chunk_index"])
+
+    def assemble(self, contexts: List[Dict], max_tokens: int = None) -> AssembledContext:
+        """Pack the contexts into max_tokens, by default the assembler's whole context budget."""
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        selected = {}  # position -> words of the chunks included so far
+        pieces, included = [], []
+        used_tokens, dropped, removed_words = 0, 0, 0
+        separator_tokens = estimate_tokens(CHUNK_SEPARATOR)
+
+        for context in contexts:
+            words = context["text"].split()
+            position = self.chunk_position(context)
+            if position is not None:
+                document, section, chunk = position
+                # Drop the words this chunk shares with an adjacent chunk that is already included
+                previous_words = selected.get((document, section, chunk - 1))
+                if previous_words:
+                    overlap = find_overlap(previous_words, words)
+                    words = words[overlap:]
+                    removed_words += overlap
+                next_words = selected.get((document, section, chunk + 1))
+                if next_words:
+                    overlap = find_overlap(words, next_words)
+                    words = words[:len(words) - overlap]
+                    removed_words += overlap
+            if not words:
+                continue
+
+            text = " ".join(words)
+            tokens = estimate_tokens(text)
+            cost = tokens + (separator_tokens if pieces else 0)
+            remaining = max_tokens - used_tokens
+            if cost > remaining:
+                text, tokens = self._truncate(words, remaining - (separator_tokens if pieces else 0))
+                if tokens < MIN_PARTIAL_TOKENS:
+                    dropped += 1
+                    continue
+                cost = tokens + (separator_tokens if pieces else 0)
+                words = text.split()
+
+            if position is not None:
+                selected[position] = words
+            pieces.append(text)
+            included.append(context)
+            used_tokens += cost
+
+        return AssembledContext(
+            text=CHUNK_SEPARATOR.join(pieces),
+            tokens=used_tokens,
+            budget=max_tokens,
+            contexts=included,
+            dropped=dropped,
+            overlap_words_removed=removed_words,
+        )
+
+    @staticmethod
+    def _truncate(words: List[str], max_tokens: int) -> Tuple[str, int]:
+        """The longest prefix of the words that fits in max_tokens, with its token count."""
+        kept, tokens = [], 0
+        for word in words:
+            word_tokens = estimate_tokens(word)
+            if tokens + word_tokens > max_tokens:
+                break
+            kept.append(word)
+            tokens += word_tokens
+        text = " ".join(kept)
+        return text, estimate_tokens(text)
@@ -0,0 +1,99 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+# Recent messages that are always sent verbatim (the current question included)
+DEFAULT_WINDOW_MESSAGES = int(os.getenv("MEMORY_WINDOW_MESSAGES", "6"))
+
+# Older messages still waiting to be summarized that may be sent verbatim in the meantime
+MAX_UNSUMMARIZED_MESSAGES = 4
+
+# Summaries are written off the request path, shared by every conversation in the process
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+def format_messages(messages: List[Dict]) -> str:
+    return "\n".join(
+        f"{'Student' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+        for msg in messages
+    )
+
+
+def recent_messages(messages: List[Dict], window_messages: int = DEFAULT_WINDOW_MESSAGES) -> List[Dict]:
+    """The verbatim window alone, for conversations without a session and so without a memory."""
+    return messages[-window_messages:] if window_messages else []
+
+
+class ConversationMemory:
+    """
+    Bounded view of one conversation: a sliding window of recent messages plus a rolling
+    summary of everything older.
+
+    Messages that fall out of the window are folded into the summary in the background,
+    one batch at a time, so the summary is extended rather than rewritten every turn and
+    a request never waits for it. Until a batch is folded in, up to MAX_UNSUMMARIZED_MESSAGES
+    of it stay in the window, which keeps the prompt size bounded either way.
+    """
+
+    def __init__(self, summarize: Callable[[str, List[Dict]], str], window_messages: int = DEFAULT_WINDOW_MESSAGES):
+        self.summarize = summarize
+        self.window_messages = window_messages
+        self.summary = ""
+        self.summarized_upto = 0  # number of leading messages already folded into the summary
+        self._pending: Future = None
+        self._generation = 0  # bumped on reset, so a summary of a discarded conversation is ignored
+        # Reentrant, since a summary that finishes immediately applies itself from inside recall
+        self._lock = threading.RLock()
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.summarized_upto = 0
+            self._pending = None
+            self._generation += 1
+
+    def recall(self, messages: List[Dict]) -> Tuple[str, List[Dict]]:
+        """
+        Return the summary of the older messages and the recent messages to include verbatim,
+        and schedule folding the messages that left the window into the summary.
+        """
+        if len(messages) < self.summarized_upto:
+            # The conversation was restarted
+            self.reset()
+
+        with self._lock:
+            window_start = max(0, len(messages) - self.window_messages)
+            start = max(self.summarized_upto, window_start - MAX_UNSUMMARIZED_MESSAGES)
+            summary = self.summary
+            if self._pending is None and window_start > self.summarized_upto:
+                self._schedule(messages[self.summarized_upto:window_start], window_start)
+
+        return summary, messages[start:]
+
+    def _schedule(self, new_messages: List[Dict], upto: int):
+        summary, generation = self.summary, self._generation
+        logger.debug("Summarizing %s older messages in the background", len(new_messages))
+        self._pending = _summary_executor.submit(self.summarize, summary, new_messages)
+        self._pending.add_done_callback(lambda future: self._apply(future, upto, generation))
+
+    def _apply(self, future: Future, upto: int, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._pending = None
+            try:
+                self.summary = future.result()
+                self.summarized_upto = upto
+            except Exception as e:
+                # Keep the previous summary; the same messages are retried on the next turn
+                logger.error("Error summarizing conversation: %s", e)
+
+    def wait(self, timeout: float = None):
+        """Block until a running summary update finishes. Only needed by tests and scripts."""
+        pending = self._pending
+        if pending is not None:
+            pending.exception(timeout=timeout)
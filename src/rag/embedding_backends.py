@@ -0,0 +1,251 @@
+import os
+import logging
+import re
+import time
+import httpx
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from openai import OpenAI
+from src.data.tokens import estimate_tokens
+from src.rag.embedding_cache import EmbeddingCache
+from src.rag.scheduler import get_scheduler, current_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class EmbeddingBackend(ABC):
+    """
+    Base class for embedding functions usable by EmbeddingsManager and Chroma.
+    Subclasses implement embed_uncached; calls go through the optional on-disk cache first.
+    """
+
+    def __init__(self, model: str, cache: EmbeddingCache = None):
+        self.model = model
+        self.cache = cache
+
+    @property
+    def collection_name(self) -> str:
+        """Vector-store collection holding this backend's vectors, so different embedding spaces never mix."""
+        return f"course_materials_{re.sub(r'[^A-Za-z0-9._-]+', '-', self.model.split('/')[-1])}"
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        if not input or self.cache is None:
+            return self.embed_uncached(input)
+
+        # Only texts that are not cached yet go to the backend
+        embeddings = self.cache.get_many(input)
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        if missing:
+            missing_texts = [input[i] for i in missing]
+            vectors = self.embed_uncached(missing_texts)
+            self.cache.put_many(missing_texts, vectors)
+            for position, vector in zip(missing, vectors):
+                embeddings[position] = vector
+        logger.debug("Embedding cache: %s hits, %s misses", len(input) - len(missing), len(missing))
+        return embeddings
+
+    @abstractmethod
+    def embed_uncached(self, input: List[str]) -> List[List[float]]:
+        """Embed the texts with the backend itself, bypassing the cache."""
+
+    def warm_up(self):
+        """Prepare for the first query, e.g. open connections. Backends that load everything up front do nothing."""
+
+
+class OpenAIEmbedding(EmbeddingBackend):
+    """Embeddings from the OpenAI API, sent in concurrent token- and count-limited batches."""
+    def __init__(self, model: str = "text-embedding-3-small", max_batch_size: int = 256,
+                 max_batch_tokens: int = 60000, max_concurrency: int = 4, cache: EmbeddingCache = None):
+        super().__init__(model, cache)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        # One pooled HTTP client shared by all worker threads so batches reuse connections
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+        self.last_run_stats = {}
+
+    def warm_up(self):
+        try:
+            # A cheap authenticated request leaves a connection in the pool for the first query embedding
+            self.client.models.retrieve(self.model)
+        except Exception as e:
+            logger.debug("Could not open a connection to the embeddings API: %s", e)
+
+    def make_batches(self, input: List[str]) -> List[List[int]]:
+        """Group input positions into batches limited by item count and estimated tokens."""
+        batches = []
+        current, current_tokens = [], 0
+        for index, text in enumerate(input):
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= self.max_batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch(self, texts: List[str], session_id: str = None) -> Tuple[List[List[float]], float]:
+        """Embed one batch with a single API request and return the vectors with the request latency."""
+        # The process-wide scheduler caps concurrent embedding requests; latency excludes the time queued
+        with get_scheduler().slot("embedding", session_id):
+            start = time.perf_counter()
+            response = self.client.embeddings.create(
+                model=self.model,
+                input=[text if text.strip() else " " for text in texts]  # the API rejects empty strings
+            )
+            latency = time.perf_counter() - start
+        # The API may return items out of order, so sort on their index
+        vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        return vectors, latency
+
+    def embed_uncached(self, input: List[str]) -> List[List[float]]:
+        if not input:
+            return []
+
+        batches = self.make_batches(input)
+        embeddings = [None] * len(input)
+        batch_stats = []
+        start = time.perf_counter()
+
+        # Worker threads do not inherit the caller's session, so pass it along explicitly
+        session_id = current_session.get()
+        if len(batches) == 1:
+            # Single queries skip the thread pool entirely
+            results = [self._embed_batch(list(input), session_id)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch([input[i] for i in batch], session_id), batches))
+
+        for batch_index, (batch, (vectors, latency)) in enumerate(zip(batches, results)):
+            # Put every vector back at the position of its input text
+            for position, vector in zip(batch, vectors):
+                embeddings[position] = vector
+            batch_stats.append({
+                "batch": batch_index,
+                "size": len(batch),
+                "tokens": sum(estimate_tokens(input[i]) for i in batch),
+                "latency_s": latency,
+            })
+
+        elapsed = time.perf_counter() - start
+        total_tokens = sum(stat["tokens"] for stat in batch_stats)
+        self.last_run_stats = {
+            "texts": len(input),
+            "batches": batch_stats,
+            "elapsed_s": elapsed,
+            "texts_per_s": len(input) / elapsed if elapsed else 0.0,
+            "tokens_per_s": total_tokens / elapsed if elapsed else 0.0,
+        }
+        if len(batches) > 1:
+            self.log_batch_performance()
+        return embeddings
+
+    def log_batch_performance(self):
+        """Log per-batch latency and overall throughput of the last embedding call."""
+        stats = self.last_run_stats
+        for stat in stats["batches"]:
+            logger.info("Embedding batch %s: %s texts, ~%s tokens in %.3fs", stat['batch'], stat['size'], stat['tokens'], stat['latency_s'])
+        logger.info("Embedded %s texts in %.3fs (%.1f texts/s, ~%.0f tokens/s, concurrency %s)", stats['texts'], stats['elapsed_s'], stats['texts_per_s'], stats['tokens_per_s'], self.max_concurrency)
+
+    @property
+    def collection_name(self) -> str:
+        # The original collection, built before other backends existed
+        return "course_materials"
+
+
+class LocalEmbedding(EmbeddingBackend):
+    """
+    CPU embeddings from a local sentence-transformers model, with no network round-trip.
+    If onnx_path points to an exported ONNX model it is run with onnxruntime instead of torch.
+    num_threads sizes the onnxruntime session. torch's thread count is process-wide, so it is only
+    changed when torch_threads asks for it.
+    """
+
+    def __init__(self, model: str = DEFAULT_LOCAL_MODEL, batch_size: int = 64, onnx_path: str = None,
+                 num_threads: int = None, torch_threads: int = None, cache: EmbeddingCache = None):
+        super().__init__(model, cache)
+        self.batch_size = batch_size
+        self.onnx_path = onnx_path
+        self.num_threads = num_threads
+
+        if onnx_path:
+            import onnxruntime
+            from transformers import AutoTokenizer
+
+            options = onnxruntime.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+                options.inter_op_num_threads = 1
+            self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+            self.session_inputs = {session_input.name for session_input in self.session.get_inputs()}
+            self.tokenizer = AutoTokenizer.from_pretrained(model)
+        else:
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            if torch_threads:
+                torch.set_num_threads(torch_threads)
+            self.encoder = SentenceTransformer(model, device="cpu")
+
+    def _embed_onnx(self, texts: List[str]):
+        import numpy as np
+
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=512, return_tensors="np")
+        feeds = {name: encoded[name].astype(np.int64) for name in encoded if name in self.session_inputs}
+        token_embeddings = self.session.run(None, feeds)[0]
+        # Mean pooling over the real tokens, then L2 normalisation, as sentence-transformers does
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_uncached(self, input: List[str]) -> List[List[float]]:
+        if not input:
+            return []
+        start = time.perf_counter()
+        if self.onnx_path:
+            vectors = []
+            for i in range(0, len(input), self.batch_size):
+                vectors.extend(self._embed_onnx(input[i:i + self.batch_size]).tolist())
+        else:
+            vectors = self.encoder.encode(input, batch_size=self.batch_size, normalize_embeddings=True,
+                                          convert_to_numpy=True, show_progress_bar=False).tolist()
+        elapsed = time.perf_counter() - start
+        if len(input) > 1:
+            logger.info("Embedded %s texts locally in %.3fs (%.1f texts/s)", len(input), elapsed, len(input) / elapsed if elapsed else 0.0)
+        return vectors
+
+
+def get_embedding_backend(name: str = None, cache_dir: str = None) -> EmbeddingBackend:
+    """
+    Build the embedding backend selected by name or by the EMBEDDING_BACKEND environment variable:
+    "openai" (default), "local" (sentence-transformers) or "onnx" (local model exported to ONNX_MODEL_PATH).
+    LOCAL_EMBEDDING_MODEL configures the local backends, EMBEDDING_THREADS the onnxruntime session and
+    EMBEDDING_TORCH_THREADS torch's process-wide thread count (left alone when unset).
+    """
+    name = (name or os.getenv("EMBEDDING_BACKEND", "openai")).lower()
+    if name == "openai":
+        model = "text-embedding-3-small"
+    elif name in ("local", "onnx"):
+        model = os.getenv("LOCAL_EMBEDDING_MODEL", DEFAULT_LOCAL_MODEL)
+    else:
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+    cache = EmbeddingCache(cache_dir, model=model) if cache_dir else None
+    if name == "openai":
+        return OpenAIEmbedding(model=model, cache=cache)
+
+    num_threads = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+    torch_threads = int(os.getenv("EMBEDDING_TORCH_THREADS", "0")) or None
+    onnx_path = os.getenv("ONNX_MODEL_PATH") if name == "onnx" else None
+    if name == "onnx" and not onnx_path:
+        raise ValueError("The onnx embedding backend needs ONNX_MODEL_PATH to point to an exported model")
+    return LocalEmbedding(model=model, onnx_path=onnx_path, num_threads=num_threads, torch_threads=torch_threads,
+                          cache=cache)
@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by the hash of (model, normalized text).
+
+    Vectors live in a memory-mapped float32 matrix (one row per slot) and a small
+    JSON index maps each key to its slot and last-use tick. Writes append their
+    changes to a journal that is folded into the index once it grows large, and
+    every read or write first replays what other processes appended, under a file
+    lock, so processes sharing the cache never hand out the same slot. When the
+    store reaches max_bytes the least recently used entries are evicted and their
+    slots reused.
+    """
+
+    INITIAL_SLOTS = 1024
+    EVICT_FRACTION = 0.1
+    COMPACT_JOURNAL_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, cache_dir: str, model: str, max_bytes: int = 256 * 1024 * 1024):
+        self.model = model
+        self.max_bytes = max_bytes
+        # One store per model, since different models produce vectors of different sizes
+        self.cache_dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / "index.json"
+        self.journal_path = self.cache_dir / "index.log"
+        self.lock_path = self.cache_dir / "index.lock"
+        self.vectors_path = self.cache_dir / "vectors.f32"
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._ops = []
+        with self._locked():
+            self._read_index()
+            self._sync()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse whitespace so formatting-only differences share a cache entry."""
+        return " ".join(text.split())
+
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock shared by this process's threads and the cache directory's file lock."""
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reset(self):
+        self.dim = None
+        self.capacity = 0
+        self.tick = 0
+        self.entries = {}  # key -> (slot, last_used_tick)
+        self.free_slots = []
+        self.next_slot = 0
+        self._vectors = None
+
+    def _read_index(self):
+        """Load the index as of the last compaction; the whole journal is replayed on top of it."""
+        self._reset()
+        self._index_stat = self._stat(self.index_path)
+        self._journal_offset = 0
+        if self._index_stat is None:
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.dim = index["dim"]
+        self.capacity = index["capacity"]
+        self.tick = index["tick"]
+        self.entries = {key: tuple(value) for key, value in index["entries"].items()}
+        self.free_slots = index["free_slots"]
+        self.next_slot = index["next_slot"]
+
+    def _replay(self) -> bool:
+        """Apply the journal records appended since the last read. False if the journal is damaged."""
+        if not self.journal_path.exists():
+            return True
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            for line in f:
+                # Records are appended whole under the lock, so a partial one means a writer crashed
+                if not line.endswith(b"\n"):
+                    return False
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    return False
+                self._journal_offset += len(line)
+        return True
+
+    def _apply(self, record: Dict):
+        """Repeat one put_many of another process: its evictions and slot assignments, in order."""
+        self.dim = record["dim"]
+        self.capacity = record["capacity"]
+        self.next_slot = record["next_slot"]
+        for op in record["ops"]:
+            if len(op) == 1:
+                slot, _ = self.entries.pop(op[0])
+                self.free_slots.append(slot)
+                continue
+            key, slot, tick = op
+            if key not in self.entries and self.free_slots:
+                self.free_slots.pop()
+            self.entries[key] = (slot, tick)
+            self.tick = max(self.tick, tick)
+
+    def _map(self) -> bool:
+        """Memory-map the vectors file at the current capacity. False if the file is missing or short."""
+        if not self.dim or not self.capacity:
+            self._vectors = None
+            return True
+        if self._vectors is not None and self._vectors.shape == (self.capacity, self.dim):
+            return True
+        size = self._stat(self.vectors_path)
+        if size is None or size[2] < self.capacity * self.dim * 4:
+            return False
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        return True
+
+    def _sync(self):
+        """Catch up with what other processes persisted. Called with the file lock held."""
+        if self._stat(self.index_path) != self._index_stat:
+            # Another process compacted the journal into a new index
+            self._read_index()
+        if not (self._replay() and self._map()):
+            logger.warning("Embedding cache in %s is incomplete, starting it empty", self.cache_dir)
+            self._reset()
+            self._compact()
+
+    def save(self):
+        """Fold the journal into a freshly written index."""
+        with self._locked():
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        if self._vectors is not None:
+            self._vectors.flush()
+        index = {
+            "model": self.model,
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "tick": self.tick,
+            "entries": self.entries,
+            "free_slots": self.free_slots,
+            "next_slot": self.next_slot,
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        # Only now that the index holds them can the journal's records go
+        open(self.journal_path, "wb").close()
+        self._index_stat = self._stat(self.index_path)
+        self._journal_offset = 0
+
+    def _append(self, record: Dict):
+        """Journal one put_many; cheap compared to rewriting the index, which happens once the journal is large."""
+        with open(self.journal_path, "ab") as f:
+            f.write((json.dumps(record) + "\n").encode("utf-8"))
+            self._journal_offset = f.tell()
+        if self._journal_offset >= self.COMPACT_JOURNAL_BYTES:
+            self._compact()
+
+    @property
+    def max_slots(self) -> int:
+        return max(1, self.max_bytes // (self.dim * 4)) if self.dim else 0
+
+    def _grow(self):
+        """Enlarge the backing file, doubling the slot count up to the size limit."""
+        new_capacity = min(self.max_slots, max(self.INITIAL_SLOTS, self.capacity * 2))
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.capacity = new_capacity
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+
+    def _evict(self):
+        """Drop the least recently used entries to free slots."""
+        count = max(1, int(len(self.entries) * self.EVICT_FRACTION))
+        oldest = sorted(self.entries.items(), key=lambda item: item[1][1])[:count]
+        for key, (slot, _) in oldest:
+            del self.entries[key]
+            self.free_slots.append(slot)
+            self._ops.append([key])
+        self.evictions += len(oldest)
+
+    def _allocate_slot(self) -> int:
+        if self.free_slots:
+            return self.free_slots.pop()
+        if self.next_slot >= self.capacity:
+            if self.capacity < self.max_slots:
+                self._grow()
+            else:
+                self._evict()
+                return self.free_slots.pop()
+        slot = self.next_slot
+        self.next_slot += 1
+        return slot
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector for each text, or None where there is no entry."""
+        results = []
+        with self._locked():
+            self._sync()
+            for text in texts:
+                key = self.make_key(text)
+                entry = self.entries.get(key)
+                if entry is None or self._vectors is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self.tick += 1
+                self.entries[key] = (entry[0], self.tick)
+                results.append(self._vectors[entry[0]].tolist())
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """Store vectors for the given texts and journal the new entries."""
+        if not texts:
+            return
+        with self._locked():
+            self._sync()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+            self._ops = []
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(text)
+                entry = self.entries.get(key)
+                slot = entry[0] if entry else self._allocate_slot()
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self.tick += 1
+                self.entries[key] = (slot, self.tick)
+                self._ops.append([key, slot, self.tick])
+            self._vectors.flush()
+            self._append({"dim": self.dim, "capacity": self.capacity, "next_slot": self.next_slot, "ops": self._ops})
+            self._ops = []
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.capacity * (self.dim or 0) * 4,
+        }
@@ -1,206 +1,442 @@
 import os
+import logging
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-import re
-from openai import OpenAI
-import chromadb
-from chromadb.config import Settings
+import json
 from typing import List, Dict
 from src.data.preprocessor import DocumentChunk
+from src.rag.embedding_backends import EmbeddingBackend, get_embedding_backend
+from src.rag.query_cache import QueryCache
+from src.rag.query_router import QueryRouter
+from src.rag.lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+from src.rag.vector_store import NumpyVectorStore
+from src.rag.sharded_store import ShardedVectorStore, ChromaShards, NumpyShards
+from src.rag.telemetry import get_telemetry
 from dotenv import load_dotenv
 
 load_dotenv()
 
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+logger = logging.getLogger(__name__)
 
-class OpenAIEmbedding:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    def __call__(self, input: List[str]) -> List[List[float]]:
-        embeddings = []
-        for text in input:
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            embeddings.append(response.data[0].embedding)
-        return embeddings
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 class EmbeddingsManager:
-    def __init__(self):
-        print(f"\n[DEBUG] Initializing EmbeddingsManager with OpenAI embeddings")
-        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        self.persist_directory = os.path.join(root_dir, "data", "chroma_db")
+    # Keyword queries with at most this many content terms may be answered from the lexical index alone
+    LEXICAL_FAST_PATH_MAX_TERMS = 3
+    # ...and only when every term is this discriminative: an IDF of 2 means the term is in at most about
+    # 1 in 8 chunks. Common words ("deadline", "group project") are in most chunks and need the dense ranking.
+    LEXICAL_FAST_PATH_MIN_IDF = 2.0
+    # Chunks written to a staging shard per upsert call
+    SHARD_UPSERT_BATCH = 1000
+
+    def __init__(self, search_mode: str = "hybrid", backend: EmbeddingBackend = None, vector_store: str = None,
+                 data_dir: str = None, shard_key: str = None):
+        # Vector store, lexical index and embedding cache all live under data_dir: RAG_DATA_DIR, or the repository's data directory
+        data_dir = data_dir or os.getenv("RAG_DATA_DIR") or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data")
+        # "chroma" (default) or "numpy" for the memory-mapped flat index, also settable with VECTOR_STORE
+        self.vector_store = (vector_store or os.getenv("VECTOR_STORE", "chroma")).lower()
+        self.persist_directory = os.path.join(data_dir, "chroma_db" if self.vector_store == "chroma" else "vector_store")
         
-        print(f"[DEBUG] Using persist directory: {self.persist_directory}")
+        logger.debug("Using persist directory: %s", self.persist_directory)
         if not os.path.exists(self.persist_directory):
-            print("[DEBUG] Creating persist directory")
+            logger.debug("Creating persist directory")
             os.makedirs(self.persist_directory)
         
-        print("[DEBUG] Initializing embedding function")
-        self.embedding_function = OpenAIEmbedding()
-        
-        print("[DEBUG] Creating ChromaDB client")
-        self.chroma_client = chromadb.PersistentClient(
-            path=self.persist_directory
-        )
+        logger.debug("Initializing embedding function")
+        self.embedding_function = backend or get_embedding_backend(cache_dir=os.path.join(data_dir, "embedding_cache"))
+        self.embedding_cache = self.embedding_function.cache
+        # Each backend gets its own collection since vectors from different models are not comparable
+        self.collection_name = self.embedding_function.collection_name
+        logger.debug("Initialized EmbeddingsManager with %s (%s)", type(self.embedding_function).__name__, self.embedding_function.model)
         
-        print("[DEBUG] Getting or creating collection")
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="course_materials",
-            embedding_function=self.embedding_function
-        )
+        # In-process caches for repeat questions. Retrieval results are keyed on the collection version,
+        # which every write bumps, here or persisted by another process (see refresh), so stale results are never served.
+        self.collection_version = 0
+        self.query_embedding_cache = QueryCache(maxsize=4096, ttl=24 * 3600)
+        self.results_cache = QueryCache(maxsize=1024, ttl=600)
+        self.router = QueryRouter.from_file()
+        self.telemetry = get_telemetry()
+        # Metadata key to split the vector store on, e.g. "semester" (one collection per semester); also settable
+        # with VECTOR_SHARD_KEY. Unset keeps everything in a single collection.
+        self.shard_key = (shard_key if shard_key is not None else os.getenv("VECTOR_SHARD_KEY", "")) or None
+
+        if self.vector_store == "numpy" and self.shard_key:
+            logger.debug("Opening NumPy vector store sharded by %s", self.shard_key)
+            self.collection = ShardedVectorStore(
+                NumpyShards(self.persist_directory, self.embedding_function), self.collection_name, self.shard_key)
+        elif self.vector_store == "numpy":
+            logger.debug("Opening NumPy vector store")
+            self.collection = NumpyVectorStore(
+                os.path.join(self.persist_directory, self.collection_name),
+                embedding_function=self.embedding_function
+            )
+        else:
+            logger.debug("Creating ChromaDB client")
+            import chromadb  # only needed for the Chroma store, and slow to import
+            self.chroma_client = chromadb.PersistentClient(
+                path=self.persist_directory
+            )
+            
+            if self.shard_key:
+                logger.debug("Opening collections sharded by %s", self.shard_key)
+                self.collection = ShardedVectorStore(
+                    ChromaShards(self.chroma_client, os.path.join(self.persist_directory, "shards"),
+                                 self.embedding_function), self.collection_name, self.shard_key)
+            else:
+                logger.debug("Getting or creating collection")
+                self.collection = self.chroma_client.get_or_create_collection(
+                    name=self.collection_name,
+                    embedding_function=self.embedding_function
+                )
+
+        # search_mode is "dense", "hybrid" (dense + BM25 with rank fusion) or "lexical"
+        self.search_mode = search_mode
+        self.lexical_index = BM25Index(os.path.join(data_dir, "bm25", f"{self.collection_name}.json"))
+        if not len(self.lexical_index) and self.collection.count():
+            logger.debug("Building lexical index from the existing collection")
+            existing = self.collection.get(include=["documents", "metadatas"])
+            self.lexical_index.upsert(existing["ids"], existing["documents"], existing["metadatas"])
+            self.lexical_index.save()
+        self._persisted = self._persisted_state()
+
+    def _persisted_state(self) -> tuple:
+        """
+        mtime and size of the files every persisted write replaces: the lexical index, which persist() always
+        writes, and the NumPy store's manifest.
+        """
+        paths = [self.lexical_index.index_path]
+        if isinstance(self.collection, NumpyVectorStore):
+            paths.append(self.collection.manifest_path)
+        state = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def refresh(self):
+        """
+        Pick up writes persisted by another process, such as `python src/rag/indexer.py` or another API worker:
+        reload the lexical index and stop serving cached results. Cheap when nothing changed (a couple of stats).
+        """
+        state = self._persisted_state()
+        if state == self._persisted:
+            return
+        self._persisted = state
+        if self.lexical_index.dirty:
+            # Unpersisted writes of this process would be lost; they are saved, and win, on the next persist()
+            logger.warning("Lexical index changed on disk while this process has unsaved changes")
+        else:
+            logger.info("Index changed on disk, reloading the lexical index")
+            # A new object, so searches running meanwhile keep a complete index
+            self.lexical_index = BM25Index(self.lexical_index.index_path)
+        if isinstance(self.collection, ShardedVectorStore):
+            self.collection.refresh()
+        self.bump_collection_version()
         
+    def warm_up(self):
+        """Load the vector index into memory with one query for a stored vector, and open the embedding API connections."""
+        sample = self.collection.get(limit=1, include=["embeddings"])
+        if len(sample["ids"]):
+            self.collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1)
+        self.embedding_function.warm_up()
+
     def reset_collection(self):
         """Reset the collection by deleting and recreating it."""
-        print("[DEBUG] Resetting collection")
+        logger.debug("Resetting collection")
+        if self.vector_store == "numpy" or self.shard_key:
+            self.collection.reset()
+            self.lexical_index.clear()
+            self.lexical_index.save()
+            self.bump_collection_version()
+            return
+
         try:
-            self.chroma_client.delete_collection("course_materials")
-            print("[DEBUG] Deleted existing collection")
+            self.chroma_client.delete_collection(self.collection_name)
+            logger.debug("Deleted existing collection")
         except Exception as e:
-            print(f"[DEBUG] No existing collection to delete: {e}")
+            logger.debug("No existing collection to delete: %s", e)
         
-        print("[DEBUG] Creating new collection")
+        logger.debug("Creating new collection")
         self.collection = self.chroma_client.create_collection(
-            name="course_materials",
+            name=self.collection_name,
             embedding_function=self.embedding_function
         )
+        self.lexical_index.clear()
+        self.lexical_index.save()
+        self.bump_collection_version()
+
+    def bump_collection_version(self):
+        """Mark the collection as changed so cached retrieval results are no longer used."""
+        self.collection_version += 1
         
-    def filter_chunks(self, query: str) -> List[str]:
+    def filter_chunks(self, query: str) -> Dict:
         """Filter chunks based on metadata inferred from the query."""
-        print(f"\n[DEBUG] Filtering chunks for query: {query}")
-        query_lower = query.lower()
-        
-        # Skip filtering for non-assignment queries
-        if any(keyword in query_lower for keyword in ["internship", "masters", "master's", "career"]):
-            print("[DEBUG] Skipping filters for general query")
-            return None
-            
-        # Build filter based on semester and assignment
-        print("[DEBUG] Building metadata filters")
-        filters = {}
-        
-        # Assignment type filtering (do this first as it's more specific)
-        print("[DEBUG] Determining assignment type")
-        assignment_keywords = {
-            "cme": ["cme", "continuous monitoring", "monitoring evaluation"],
-            "re": ["re", "requirements engineering", "requirements elicitation"],
-            "ssh": ["ssh", "system security", "security hardening"],
-            "de": ["de", "data engineering", "data pipeline"]
-        }
-        
-        # Special case for capstone/final product
-        if "capstone" in query_lower or "final product" in query_lower:
-            filters['assignment_type'] = "Group_Project"
-            filters['assignment'] = "final_product"
-            print("[DEBUG] Detected capstone/final product")
-        else:
-            for assignment_type, keywords in assignment_keywords.items():
-                if any(kw in query_lower for kw in keywords):
-                    filters['assignment_type'] = "Individual_Assignments"
-                    filters['assignment'] = assignment_type.upper()
-                    print(f"[DEBUG] Detected assignment type: {assignment_type.upper()}")
-                    break
-        
-        # Group project filtering
-        if "group" in query_lower:
-            if "individual" in query_lower or "contribution" in query_lower:
-                filters['assignment_type'] = "Group_Project"
-                filters['assignment'] = "individual_contribution"
-            else:
-                filters['assignment_type'] = "Group_Project"
-                filters['assignment'] = "Group_project"
-            print(f"[DEBUG] Detected group project type: {filters['assignment']}")
-        
-        # Semester filtering
-        if "semester 6" in query_lower or "capstone" in query_lower:
-            print("[DEBUG] Detected Semester 6 filter")
-            filters['semester'] = "Semester_6"
-        elif "semester" in query_lower:
-            semester_match = re.search(r"semester (\d+)", query_lower)
-            if semester_match:
-                semester_num = semester_match.group(1)
-                filters['semester'] = f"Semester_{semester_num}"
-                print(f"[DEBUG] Detected semester: {filters['semester']}")
-
-        # If we have filters, construct the filter conditions
-        if filters:
-            print(f"[DEBUG] Final filter value: {filters}")
-            
-            # Build the filter conditions based on the metadata structure
-            where_conditions = []
-            
-            # Add exact match for the complete filter key
-            filter_key = "_".join(filters.values())
-            where_conditions.append({"filter_key": filter_key})
-            
-            # Add individual field matches
-            if 'semester' in filters:
-                where_conditions.append({"semester": filters['semester']})
-            if 'assignment_type' in filters:
-                where_conditions.append({"assignment_type": filters['assignment_type']})
-            if 'assignment' in filters:
-                where_conditions.append({"assignment": filters['assignment']})
-            
-            # Return the combined filter conditions
-            return {"$or": where_conditions}
-        
-        print("[DEBUG] No filters applied")
-        return None
+        logger.debug("Filtering chunks for query: %s", query)
+        with self.telemetry.span("route"):
+            where_filters = self.router.where_clause(query)
+        logger.debug("Routed filters: %s", where_filters)
+        return where_filters
     
-    def embed_chunks(self, chunks: List[DocumentChunk]):
-        print(f"\n[DEBUG] Embedding {len(chunks) if chunks else 0} chunks")
+    def embed_chunks(self, chunks: List[DocumentChunk], embeddings: List[List[float]] = None, persist: bool = True):
+        logger.debug("Embedding %s chunks", len(chunks) if chunks else 0)
         if not chunks:
-            print("[DEBUG] No chunks to embed")
+            logger.debug("No chunks to embed")
             return
             
         texts = [chunk.text for chunk in chunks]
         ids = [chunk.chunk_id for chunk in chunks]
         metadatas = [chunk.metadata for chunk in chunks]
-        print(f"[DEBUG] Preparing to add {len(texts)} documents to collection")
+        logger.debug("Preparing to upsert %s documents to collection", len(texts))
   
-        self.collection.add(
+        # Upsert so that re-running an ingest updates chunks instead of failing on existing ids.
+        # Precomputed embeddings (from the streaming ingest) skip the embedding function.
+        self.collection.upsert(
             documents=texts,
             ids=ids,
-            metadatas=metadatas
+            metadatas=metadatas,
+            embeddings=embeddings
         )
-        print("[DEBUG] Successfully added chunks to collection")
+        self.lexical_index.upsert(ids, texts, metadatas)
+        if persist:
+            self.persist()
+        self.bump_collection_version()
+        logger.debug("Successfully upserted chunks to collection")
+        if self.embedding_cache:
+            logger.info("Embedding cache stats: %s", self.embedding_cache.stats())
         
-    def query_similar(self, query: str, n_results: int = 3) -> List[Dict]:
-        """Query the collection after filtering based on metadata."""
-        print(f"\n[DEBUG] Processing query: {query}")
+    def delete_documents(self, doc_ids: List[str], persist: bool = True):
+        """Remove every chunk belonging to the given documents from the collection."""
+        if not doc_ids:
+            return
+        logger.debug("Deleting chunks of %s documents", len(doc_ids))
+        where = {"filter_key": {"$in": list(doc_ids)}}
+        self.collection.delete(where=where)
+        self.lexical_index.delete(where)
+        if persist:
+            self.persist()
+        self.bump_collection_version()
+
+    def persist(self):
+        """Write the lexical index (and the NumPy store) to disk. Bulk ingests defer this until all batches are stored."""
+        self.lexical_index.save()
+        if self.vector_store == "numpy" or self.shard_key:
+            self.collection.flush()
+        self._persisted = self._persisted_state()
+
+    def replace_shard(self, value, chunks: List[DocumentChunk], embeddings: List[List[float]] = None):
+        """
+        Replace every chunk of one shard (say, Semester_7) with the given chunks. They are written to a
+        staging shard which is then swapped in, so searches never see a half-built shard and other shards are untouched.
+        """
+        if not self.shard_key:
+            raise ValueError("replace_shard needs a sharded vector store, set VECTOR_SHARD_KEY")
+        stray = [chunk.chunk_id for chunk in chunks if chunk.metadata.get(self.shard_key) != value]
+        if stray:
+            raise ValueError(f"{len(stray)} chunks do not have {self.shard_key}={value}, e.g. {stray[0]}")
+
+        logger.info("Rebuilding shard %s=%s with %s chunks", self.shard_key, value, len(chunks))
+        staging = self.collection.stage(value)
+        for start in range(0, len(chunks), self.SHARD_UPSERT_BATCH):
+            batch = chunks[start:start + self.SHARD_UPSERT_BATCH]
+            staging.upsert(
+                documents=[chunk.text for chunk in batch],
+                ids=[chunk.chunk_id for chunk in batch],
+                metadatas=[chunk.metadata for chunk in batch],
+                embeddings=embeddings[start:start + self.SHARD_UPSERT_BATCH] if embeddings is not None else None
+            )
+        self.collection.swap_in(value)
+
+        self.lexical_index.delete({self.shard_key: value})
+        self.lexical_index.upsert([chunk.chunk_id for chunk in chunks], [chunk.text for chunk in chunks],
+                                  [chunk.metadata for chunk in chunks])
+        self.persist()
+        self.bump_collection_version()
+
+    def sync_documents(self, chunks: List[DocumentChunk], deleted_doc_ids: List[str] = None,
+                       updated_doc_ids: List[str] = None):
+        """
+        Bring the collection in line with an incremental ingest run.
+        Old chunks of the updated documents are dropped before the new ones are upserted, so documents
+        that got shorter, or now yield no chunks at all, do not leave stale chunks behind.
+        Without updated_doc_ids, the documents are taken from the chunks.
+        """
+        if updated_doc_ids is None:
+            updated_doc_ids = {chunk.metadata["filter_key"] for chunk in chunks}
+        self.delete_documents(sorted(updated_doc_ids) + list(deleted_doc_ids or []))
+        self.embed_chunks(chunks)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the vector of an earlier identical question when possible."""
+        return self.embed_queries([query])[0]
+
+    def query_similar(self, query: str, n_results: int = 3, semester: str = None, mode: str = None) -> List[Dict]:
+        """
+        Query the collection after filtering based on metadata.
+        When a semester scope is given, course-specific queries only match chunks of that semester.
+        The mode ("dense", "hybrid" or "lexical") defaults to the manager's search_mode.
+        """
+        return self.query_similar_batch([query], n_results=n_results, semesters=[semester], mode=mode)[0]
+
+    def _scoped_filters(self, query: str, semester: str = None) -> Dict:
+        """The routed filters of a query, narrowed to the semester scope when one is given."""
         where_filters = self.filter_chunks(query)
-        print(f"[DEBUG] Using filters: {where_filters}")
+        if semester and where_filters:
+            # A semester implied by the query itself (e.g. capstone) wins over the session scope
+            implied = [condition["semester"] for condition in where_filters["$or"] if "semester" in condition]
+            if not implied or semester in implied:
+                where_filters = {"$and": [{"semester": semester}, where_filters]}
+        return where_filters
 
-        # Increase initial results when filtering to ensure we get enough relevant matches
-        actual_n_results = n_results * 2 if where_filters else n_results
-        
-        print(f"[DEBUG] Querying collection for {actual_n_results} results")
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=actual_n_results,
-            where=where_filters if where_filters else None
-        )
-        
-        # If we got too many results, trim them down
-        if len(results['documents'][0]) > n_results:
-            for key in results.keys():
-                if isinstance(results[key], list):
-                    results[key] = [results[key][0][:n_results]]
-        
-        print(f"[DEBUG] Found {len(results['documents'][0])} matching documents")
+    def query_similar_batch(self, queries: List[str], n_results: int = 3, semesters: List[str] = None,
+                            mode: str = None) -> List[Dict]:
+        """
+        query_similar for many queries at once, with results in the same order. Queries that need a
+        dense search are embedded together, and those with the same filters share one vector store query.
+        """
+        self.refresh()
+        mode = mode or self.search_mode
+        semesters = semesters or [None] * len(queries)
+        results = [None] * len(queries)
+        pending = {}  # (filters, n_results) -> positions that need a dense search with them
+        lexical_hits = {}
+
+        for position, (query, semester) in enumerate(zip(queries, semesters)):
+            logger.debug("Processing query: %s", query)
+            where_filters = self._scoped_filters(query, semester)
+            logger.debug("Using filters: %s", where_filters)
+
+            cache_key = (self.collection_version, QueryCache.normalize(query),
+                         json.dumps(where_filters, sort_keys=True), n_results, mode)
+            cached = self.results_cache.get(cache_key)
+            if cached is not None:
+                logger.debug("Returning cached retrieval results")
+                results[position] = cached
+                continue
+
+            # Increase initial results when filtering to ensure we get enough relevant matches
+            actual_n_results = n_results * 2 if where_filters else n_results
+
+            if mode in ("hybrid", "lexical") and len(self.lexical_index):
+                with self.telemetry.span("lexical_search"):
+                    lexical_hits[position] = self.lexical_index.search(query, n_results=actual_n_results, where=where_filters)
+                if mode == "lexical" or self._is_confident_lexical_match(query, lexical_hits[position], n_results):
+                    logger.debug("Answering from the lexical index without embedding the query")
+                    results[position] = self._lexical_results(lexical_hits[position][:n_results])
+                    self.log_query_performance(query, results[position], where_filters)
+                    self.results_cache.put(cache_key, results[position])
+                    continue
+
+            group = pending.setdefault((json.dumps(where_filters, sort_keys=True), actual_n_results), [])
+            group.append((position, where_filters, cache_key))
+
+        if not pending:
+            return results
+
+        positions = [position for group in pending.values() for position, _, _ in group]
+        query_embeddings = dict(zip(positions, self.embed_queries([queries[position] for position in positions])))
+
+        for (_, actual_n_results), group in pending.items():
+            where_filters = group[0][1]
+            logger.debug("Querying collection for %s results for %s queries", actual_n_results, len(group))
+            with self.telemetry.span("vector_search", n_results=actual_n_results, queries=len(group)):
+                dense_results = self.collection.query(
+                    query_embeddings=[query_embeddings[position] for position, _, _ in group],
+                    n_results=actual_n_results,
+                    where=where_filters if where_filters else None
+                )
+
+            for index, (position, _, cache_key) in enumerate(group):
+                result = {key: [dense_results[key][index]] for key in ("ids", "documents", "metadatas", "distances")}
+                if lexical_hits.get(position):
+                    result = self._fuse_results(result, lexical_hits[position], n_results)
+
+                # If we got too many results, trim them down
+                if len(result['documents'][0]) > n_results:
+                    for key in result.keys():
+                        result[key] = [result[key][0][:n_results]]
+
+                self.log_query_performance(queries[position], result, where_filters)
+                self.results_cache.put(cache_key, result)
+                results[position] = result
+        return results
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed many queries, reusing cached vectors and sending the rest to the embedding API together."""
+        keys = [QueryCache.normalize(query) for query in queries]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        missing = {}  # normalized query -> one of the queries it stands for
+        for key, query, embedding in zip(keys, queries, embeddings):
+            if embedding is None:
+                missing.setdefault(key, query)
+        if missing:
+            with self.telemetry.span("embed_query", queries=len(missing)):
+                vectors = dict(zip(missing, self.embedding_function(list(missing.values()))))
+            for key, vector in vectors.items():
+                self.query_embedding_cache.put(key, vector)
+            embeddings = [vectors[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return embeddings
+
+    def _is_confident_lexical_match(self, query: str, lexical_hits: List, n_results: int) -> bool:
+        """
+        A short keyword query of rare terms, every one of which occurs in each of the top lexical hits,
+        needs no dense search.
+        """
+        terms = tokenize(query)
+        if not terms or len(terms) > self.LEXICAL_FAST_PATH_MAX_TERMS or len(lexical_hits) < n_results:
+            return False
+        if any(self.lexical_index.idf(term) < self.LEXICAL_FAST_PATH_MIN_IDF for term in terms):
+            return False
+        return all(self.lexical_index.covers(query, chunk_id) for chunk_id, _ in lexical_hits[:n_results])
+
+    def _lexical_results(self, lexical_hits: List) -> Dict:
+        """Shape BM25 hits like a Chroma query result. Distances are 1 / (1 + score), so lower is better."""
+        docs = [self.lexical_index.docs[chunk_id] for chunk_id, _ in lexical_hits]
+        return {
+            "ids": [[chunk_id for chunk_id, _ in lexical_hits]],
+            "documents": [[doc["text"] for doc in docs]],
+            "metadatas": [[doc["metadata"] for doc in docs]],
+            "distances": [[1.0 / (1.0 + score) for _, score in lexical_hits]],
+        }
+
+    def _fuse_results(self, dense_results: Dict, lexical_hits: List, n_results: int) -> Dict:
+        """Merge dense and lexical rankings with reciprocal rank fusion."""
+        dense = {
+            chunk_id: (document, metadata, distance)
+            for chunk_id, document, metadata, distance in zip(
+                dense_results["ids"][0], dense_results["documents"][0],
+                dense_results["metadatas"][0], dense_results["distances"][0])
+        }
+        fused = reciprocal_rank_fusion([dense_results["ids"][0], [chunk_id for chunk_id, _ in lexical_hits]])[:n_results]
+
+        results = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]], "scores": [[]]}
+        for chunk_id, score in fused:
+            if chunk_id in dense:
+                document, metadata, distance = dense[chunk_id]
+            else:
+                doc = self.lexical_index.docs[chunk_id]
+                document, metadata, distance = doc["text"], doc["metadata"], None
+            results["ids"][0].append(chunk_id)
+            results["documents"][0].append(document)
+            results["metadatas"][0].append(metadata)
+            results["distances"][0].append(distance)
+            results["scores"][0].append(score)
         return results
     
     def log_query_performance(self, query: str, results: Dict, filters_used: Dict):
         """Log query performance for monitoring and improvement."""
-        print(f"\n[PERFORMANCE] Query: {query}")
-        print(f"[PERFORMANCE] Filters used: {filters_used}")
-        print(f"[PERFORMANCE] Results found: {len(results['documents'][0])}")
-        print(f"[PERFORMANCE] Top match scores: {results['distances'][0]}")
+        logger.debug("Query: %s", query)
+        logger.debug("Filters used: %s", filters_used)
+        logger.debug("Results found: %s", len(results['documents'][0]))
+        logger.debug("Top match scores: %s", results['distances'][0])
     
 if __name__ == "__main__":
+    from src.rag.telemetry import configure_logging
+    configure_logging()
     print("\n[DEBUG] Starting embeddings pipeline test")
 
     import sys
@@ -0,0 +1,167 @@
+import os
+import logging
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import time
+import queue
+import threading
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+from src.data.document_loader import DocumentLoader
+from src.data.preprocessor import DocumentPreprocessor, DocumentChunk
+from src.rag.embeddings import EmbeddingsManager
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def buffered(items: Iterable, maxsize: int) -> Iterator:
+    """
+    Run an iterator in a background thread and yield its items through a bounded queue.
+    The producer blocks once maxsize items are waiting, so a fast stage can run ahead of
+    a slow one without holding the whole corpus in memory.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_END)
+        except Exception as e:
+            put(_StageError(e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # Lets the producer exit if the consumer stops early
+        stopped.set()
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class IngestPipeline:
+    """
+    Streaming ingest: loader -> preprocessor -> embedder -> vector store.
+    Every stage runs in its own thread with a bounded queue in between, so PDF extraction
+    keeps going while earlier chunks are embedded and peak memory stays flat as the corpus grows.
+    """
+
+    def __init__(self, loader: DocumentLoader, preprocessor: DocumentPreprocessor, embeddings_manager: EmbeddingsManager,
+                 queue_size: int = 4, batch_size: int = 128):
+        self.loader = loader
+        self.preprocessor = preprocessor
+        self.embeddings_manager = embeddings_manager
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+    def embed_batches(self, chunks: Iterable[DocumentChunk]) -> Iterator[Tuple[List[DocumentChunk], List[List[float]]]]:
+        embedding_function = self.embeddings_manager.embedding_function
+        for batch in batched(chunks, self.batch_size):
+            yield batch, embedding_function([chunk.text for chunk in batch])
+
+    def run(self) -> Dict:
+        start = time.perf_counter()
+        plan = self.loader.plan_sync()
+        # Old chunks of changed files go up front, so a file that now yields no chunks leaves none behind
+        cleared_doc_ids = set(plan["replaced"])
+        self.embeddings_manager.delete_documents(plan["deleted"] + plan["replaced"])
+
+        updated_doc_ids = []
+
+        def track(docs: Iterable[Dict]) -> Iterator[Dict]:
+            for doc in docs:
+                updated_doc_ids.append(doc["id"])
+                yield doc
+
+        docs = buffered(track(self.loader.iter_documents(plan)), self.queue_size)
+        chunks = buffered(self.preprocessor.iter_chunks(docs), self.queue_size * self.batch_size)
+        embedded = buffered(self.embed_batches(chunks), self.queue_size)
+
+        chunk_count = 0
+        for batch, embeddings in embedded:
+            # A document the manifest did not know may still have chunks indexed under its id; drop
+            # them the first time any of its new chunks arrive
+            new_doc_ids = sorted({chunk.metadata["filter_key"] for chunk in batch} - cleared_doc_ids)
+            self.embeddings_manager.delete_documents(new_doc_ids, persist=False)
+            cleared_doc_ids.update(new_doc_ids)
+
+            self.embeddings_manager.embed_chunks(batch, embeddings, persist=False)
+            chunk_count += len(batch)
+
+        # Only record the files as ingested once their chunks are in the vector store
+        self.embeddings_manager.persist()
+        self.loader.save()
+        elapsed = time.perf_counter() - start
+        logger.info("Streamed %s documents (%s chunks) in %.2fs", len(updated_doc_ids), chunk_count, elapsed)
+        return {"updated": sorted(updated_doc_ids), "deleted": plan["deleted"], "chunks": chunk_count, "elapsed_s": elapsed}
+
+
+def update_index(loader: DocumentLoader, preprocessor: DocumentPreprocessor, embeddings_manager: EmbeddingsManager) -> Dict:
+    """Re-index only the raw documents that were added, changed or deleted since the last run."""
+    changes = loader.sync_documents()
+    updated_ids = [doc["id"] for doc in changes["updated"]]
+    logger.debug("%s documents to re-index, %s to remove", len(updated_ids), len(changes['deleted']))
+
+    chunks = preprocessor.process_documents(updated_ids)
+    embeddings_manager.sync_documents(chunks, changes["deleted"], updated_ids)
+    return {"updated": updated_ids, "deleted": changes["deleted"], "chunks": len(chunks)}
+
+
+def rebuild_shard(preprocessor: DocumentPreprocessor, embeddings_manager: EmbeddingsManager, value: str) -> Dict:
+    """Re-index the processed documents of one shard (e.g. a new semester) into a staging shard and swap it in."""
+    key = embeddings_manager.shard_key
+    docs = (doc for doc in preprocessor.store.iter_documents()
+            if preprocessor.extract_metadata_from_doc(doc).get(key) == value)
+    chunks = list(preprocessor.iter_chunks(docs))
+    embeddings_manager.replace_shard(value, chunks)
+    return {"documents": len({chunk.metadata["filter_key"] for chunk in chunks}), "chunks": len(chunks)}
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.rag.telemetry import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Bring the vector store up to date with the raw documents")
+    parser.add_argument("--rebuild-shard", metavar="VALUE",
+                        help="rebuild one shard of a sharded store (VECTOR_SHARD_KEY) from the processed documents, e.g. Semester_7")
+    args = parser.parse_args()
+
+    if args.rebuild_shard:
+        summary = rebuild_shard(DocumentPreprocessor(), EmbeddingsManager(), args.rebuild_shard)
+        print(f"Swapped in shard {args.rebuild_shard} with {summary['documents']} documents ({summary['chunks']} chunks)")
+        sys.exit(0)
+
+    pipeline = IngestPipeline(DocumentLoader(workers=0), DocumentPreprocessor(), EmbeddingsManager())
+    summary = pipeline.run()
+    print(f"Re-indexed {len(summary['updated'])} documents ({summary['chunks']} chunks), "
+          f"removed {len(summary['deleted'])} documents")
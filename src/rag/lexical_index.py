@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple
+from src.rag.metadata_filter import matches_where
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that carry no signal for keyword lookups
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "in", "is", "it", "me", "my", "of", "on", "or", "the", "to", "what", "when", "where", "which",
+    "who", "why", "with", "you", "tell", "show", "give", "there",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over document chunks, persisted as JSON."""
+
+    def __init__(self, index_path: str, k1: float = 1.5, b: float = 0.75):
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, Dict] = {}  # chunk id -> {"text", "metadata", "length"}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> {chunk id: term frequency}
+        self.total_length = 0
+        self.dirty = False
+        if os.path.exists(index_path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _index(self, chunk_id: str, text: str, metadata: Dict):
+        terms = tokenize(text)
+        for term, frequency in Counter(terms).items():
+            self.postings[term][chunk_id] = frequency
+        self.docs[chunk_id] = {"text": text, "metadata": metadata, "length": len(terms)}
+        self.total_length += len(terms)
+
+    def _unindex(self, chunk_id: str):
+        doc = self.docs.pop(chunk_id)
+        for term in set(tokenize(doc["text"])):
+            postings = self.postings[term]
+            postings.pop(chunk_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= doc["length"]
+
+    def upsert(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            if chunk_id in self.docs:
+                self._unindex(chunk_id)
+            self._index(chunk_id, text, metadata)
+        self.dirty = True
+
+    def delete(self, where: Dict):
+        """Remove every chunk whose metadata matches the where-clause."""
+        for chunk_id in [chunk_id for chunk_id, doc in self.docs.items() if matches_where(doc["metadata"], where)]:
+            self._unindex(chunk_id)
+        self.dirty = True
+
+    def clear(self):
+        self.docs = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+        self.dirty = True
+
+    def search(self, query: str, n_results: int = 3, where: Dict = None) -> List[Tuple[str, float]]:
+        """Return (chunk id, BM25 score) pairs for the best matching chunks, best first."""
+        terms = tokenize(query)
+        if not terms or not self.docs:
+            return []
+
+        avg_length = self.total_length / len(self.docs) or 1.0
+        scores = defaultdict(float)
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for chunk_id, frequency in postings.items():
+                length = self.docs[chunk_id]["length"]
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (
+                    frequency + self.k1 * (1 - self.b + self.b * length / avg_length))
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if where:
+            ranked = [item for item in ranked if matches_where(self.docs[item[0]]["metadata"], where)]
+        return ranked[:n_results]
+
+    def idf(self, term: str) -> float:
+        """BM25 inverse document frequency of a term: high for rare terms, near zero for terms in most chunks."""
+        frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.docs) - frequency + 0.5) / (frequency + 0.5))
+
+    def covers(self, query: str, chunk_id: str) -> bool:
+        """Whether a chunk contains every content term of the query."""
+        return all(chunk_id in self.postings.get(term, {}) for term in tokenize(query))
+
+    def save(self):
+        """Atomically write the index to disk if it changed."""
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b,
+                       "docs": {chunk_id: {"text": doc["text"], "metadata": doc["metadata"]} for chunk_id, doc in self.docs.items()}}, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+
+    def load(self):
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.k1, self.b = data["k1"], data["b"]
+        self.clear()
+        # Postings are rebuilt on load, which is cheap and keeps the file small
+        for chunk_id, doc in data["docs"].items():
+            self._index(chunk_id, doc["text"], doc["metadata"])
+        self.dirty = False
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge several rankings of ids into one, scoring each id by the sum of 1 / (k + rank)."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
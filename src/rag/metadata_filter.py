@@ -0,0 +1,31 @@
+from typing import Dict
+
+
+def matches_where(metadata: Dict, where: Dict) -> bool:
+    """
+    Evaluate a Chroma-style where-clause against one chunk's metadata.
+    Supports $and, $or, plain equality and the $eq, $ne, $in and $nin operators.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
@@ -0,0 +1,46 @@
+import threading
+from typing import Any, Dict, Hashable
+from cachetools import TTLCache
+
+
+class QueryCache:
+    """Thread-safe in-process LRU cache whose entries also expire after a time-to-live."""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Case- and whitespace-insensitive form of a query, so trivially different repeats share an entry."""
+        return " ".join(query.lower().split())
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._cache.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._cache[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,97 @@
+import re
+import json
+from pathlib import Path
+from typing import Dict, List
+
+DEFAULT_RULES_PATH = Path(__file__).with_name("routing_rules.json")
+
+# Metadata fields a query can be routed on, in the order they make up a chunk's filter_key
+ROUTED_FIELDS = ["semester", "assignment_type", "assignment"]
+
+
+class QueryRouter:
+    """
+    Maps a query to metadata filters using a declarative rule table.
+    All phrases and patterns of the table are compiled once into a single word-boundary
+    regex, so routing a query is one scan of the text no matter how many rules there are.
+    """
+
+    def __init__(self, rules: List[Dict]):
+        self.rules = rules
+        self.terms = []  # every distinct phrase or pattern, indexed by its group number in the regex
+        term_index = {}
+
+        def add_term(term: str, is_pattern: bool) -> int:
+            key = (term.lower(), is_pattern)
+            if key not in term_index:
+                term_index[key] = len(self.terms)
+                self.terms.append({"text": term, "pattern": re.compile(term, re.IGNORECASE) if is_pattern else None})
+            return term_index[key]
+
+        self.compiled_rules = []
+        for rule in rules:
+            if "pattern" in rule:
+                term_ids = [add_term(rule["pattern"], True)]
+            else:
+                term_ids = [add_term(phrase, False) for phrase in rule["phrases"]]
+            self.compiled_rules.append({
+                "name": rule["name"],
+                "terms": term_ids,
+                "with_any": [add_term(phrase, False) for phrase in rule.get("with_any", [])],
+                "priority": rule.get("priority", 0),
+                "skip": rule.get("skip", False),
+                "set": rule.get("set", {}),
+            })
+
+        # Longest alternatives first so a longer phrase wins over a shorter one starting at the same position.
+        # The word boundaries are factored out of the alternation and queries are lowercased up front
+        # (patterns are written in lowercase), which keeps the scan several times faster than
+        # per-alternative boundaries with IGNORECASE.
+        alternatives = sorted(range(len(self.terms)), key=lambda i: -len(self.terms[i]["text"]))
+        self.regex = re.compile(r"\b(?:" + "|".join(
+            rf"(?P<t{i}>{self.terms[i]['text'] if self.terms[i]['pattern'] else re.escape(self.terms[i]['text'].lower())})"
+            for i in alternatives
+        ) + r")\b")
+
+    @classmethod
+    def from_file(cls, rules_path: str = DEFAULT_RULES_PATH) -> "QueryRouter":
+        with open(rules_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)["rules"])
+
+    def route(self, query: str) -> Dict:
+        """Return the metadata filters inferred from a query, or None if it should not be filtered."""
+        matches = {}
+        for match in self.regex.finditer(query.lower()):
+            matches.setdefault(int(match.lastgroup[1:]), match.group())
+
+        filters, priorities = {}, {}
+        for rule in self.compiled_rules:
+            matched = [term for term in rule["terms"] if term in matches]
+            if not matched:
+                continue
+            if rule["with_any"] and not any(term in matches for term in rule["with_any"]):
+                continue
+            if rule["skip"]:
+                return None
+
+            pattern = self.terms[matched[0]]["pattern"]
+            groups = pattern.fullmatch(matches[matched[0]]).groups() if pattern else ()
+            for field, value in rule["set"].items():
+                # Strictly higher priority overrides, so among equal priorities the first rule listed wins
+                if field not in priorities or rule["priority"] > priorities[field]:
+                    filters[field] = value.format(matches[matched[0]], *groups)
+                    priorities[field] = rule["priority"]
+
+        return filters
+
+    def where_clause(self, query: str) -> Dict:
+        """Build the Chroma where-clause for a query, or None if no filters apply."""
+        filters = self.route(query)
+        if not filters:
+            return None
+
+        # Exact match for the complete filter key, plus a match on each individual field
+        values = [filters[field] for field in ROUTED_FIELDS if field in filters]
+        where_conditions = [{"filter_key": "_".join(values)}]
+        where_conditions.extend({field: filters[field]} for field in ROUTED_FIELDS if field in filters)
+        return {"$or": where_conditions}
@@ -1,38 +1,167 @@
 import os
+import logging
 import sys
 import re
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from typing import List, Dict
-from openai import OpenAI
-from src.rag.embeddings import EmbeddingsManager
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, AsyncIterator, Tuple, TYPE_CHECKING
+from src.rag.scheduler import get_scheduler, request_key, current_session
+from src.rag.context_assembler import ContextAssembler, AssembledContext, RETRIEVED_CHUNKS
+from src.rag.conversation_memory import ConversationMemory, format_messages, recent_messages
+from src.rag.telemetry import get_telemetry
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
+if TYPE_CHECKING:
+    # Imported when first needed: chromadb and openai take most of a second to import
+    from openai import OpenAI, AsyncOpenAI
+    from src.rag.embeddings import EmbeddingsManager
+
+logger = logging.getLogger(__name__)
+
+SEMESTER_PATTERN = re.compile(r"semester (\d+)")
+
+SYSTEM_PROMPT = "You Jonathan, are a helpful Computational Social Science (CSSci) course assistant that helps students understand course materials."
+COMPLETION_OPTIONS = {"model": "gpt-4o-mini", "temperature": 0.7, "max_tokens": 500, "stream": True}
+# Batch answers are read whole, so they are not streamed
+BATCH_COMPLETION_OPTIONS = {**COMPLETION_OPTIONS, "stream": False}
+# Session that batch jobs queue under in the scheduler, next to the live chat sessions
+BATCH_SESSION = "batch"
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a student and Jonathan, the CSSci course assistant.
+Keep the facts that later questions may refer back to: the semester, assignments and topics discussed, and what was answered.
+Reply with the updated summary only, in at most 150 words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+SUMMARY_OPTIONS = {"model": "gpt-4o-mini", "temperature": 0, "max_tokens": 250}
+
+# Connection pool of the shared async client, sized for many concurrent streaming chats
+ASYNC_MAX_CONNECTIONS = 200
+ASYNC_MAX_KEEPALIVE = 50
+
+class RAGResponse:
+    """A streamed answer together with the contexts that were retrieved to generate it.
+    Iterate it with `for` when it wraps a sync stream, or `async for` when it came from agenerate_response."""
+    def __init__(self, stream, contexts: List[Dict], context_tokens: int = None):
+        self.contexts = contexts
+        self.context_tokens = context_tokens
+        self._stream = stream
+
+    def __iter__(self) -> Iterator[str]:
+        return self._stream
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._stream
+
+    async def aclose(self):
+        """Stop an async stream that will not be read to the end, so the upstream completion is cancelled."""
+        await self._stream.aclose()
+
 class RAGHandler:
-    def __init__(self):
-        self.embeddings_manager = EmbeddingsManager()
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    """
+    Answers questions with retrieval-augmented generation. Creating one is cheap: the vector
+    store and the OpenAI clients are set up on first use, or ahead of time by start_warm_up().
+    """
+    def __init__(self, embeddings_manager: "EmbeddingsManager" = None):
+        self._embeddings_manager = embeddings_manager
+        self._client = None
+        self._async_client = None
+        self._init_lock = threading.Lock()
+        self.scheduler = get_scheduler()
+        self.context_assembler = ContextAssembler()
+        self.telemetry = get_telemetry()
+        # Conversation memories of the active sessions; idle ones expire
+        self.memories = TTLCache(maxsize=1024, ttl=3600)
+        self._memories_lock = threading.Lock()
+
+    @property
+    def embeddings_manager(self) -> "EmbeddingsManager":
+        """The vector store and lexical index, opened on first use."""
+        if self._embeddings_manager is None:
+            with self._init_lock:
+                if self._embeddings_manager is None:
+                    from src.rag.embeddings import EmbeddingsManager
+                    self._embeddings_manager = EmbeddingsManager()
+        return self._embeddings_manager
+
+    @property
+    def client(self) -> "OpenAI":
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    @property
+    def async_client(self) -> "AsyncOpenAI":
+        """AsyncOpenAI client over a pooled httpx.AsyncClient, created on first use inside the running event loop."""
+        if self._async_client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_KEEPALIVE),
+                timeout=httpx.Timeout(60.0, connect=10.0),
+            )
+            self._async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+        return self._async_client
+
+    def warm_up(self):
+        """
+        Do the work a first question would otherwise wait for: import and open the vector store,
+        load its index into memory and open the connections to the OpenAI API.
+        """
+        with self.telemetry.span("warm_up"):
+            self.embeddings_manager.warm_up()
+            try:
+                # Any cheap authenticated request leaves a connection in the client's pool
+                self.client.models.retrieve(COMPLETION_OPTIONS["model"])
+            except Exception as e:
+                logger.debug("Could not open a connection to the chat API: %s", e)
+
+    def start_warm_up(self) -> threading.Thread:
+        """Run warm_up() in a background thread, so the app can serve its first page meanwhile."""
+        thread = threading.Thread(target=self._warm_up_in_background, name="rag-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up_in_background(self):
+        try:
+            self.warm_up()
+        except Exception:
+            # The first question sets up whatever is missing and reports the error to the student
+            logger.exception("Warm-up failed")
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
     
-    def _create_prompt(self, query: str, contexts: List[Dict], conversation_history: List[Dict]) -> str:
+    def _create_prompt(self, query: str, context: AssembledContext, conversation_history: List[Dict], summary: str = "") -> str:
         """Create a prompt to ask the the llm using the context retrieved"""
         
-        # Format conversation history
-        formatted_history = "\n".join([
-            f"{'Student' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
-            for msg in conversation_history[:-1]  # Exclude current query
-        ])
+        # Format conversation history: the summary of older turns followed by the recent ones
+        formatted_history = format_messages(conversation_history[:-1])  # Exclude current query
+        if summary:
+            formatted_history = f"Summary of the earlier conversation: {summary}\n{formatted_history}"
         
         # Get the current semester from the query's context
         current_semester = ""
-        for ctx in contexts:
+        for ctx in context.contexts:
             if "metadata" in ctx and "semester" in ctx["metadata"]:
                 current_semester = ctx["metadata"]["semester"]
                 break
         
-        context_texts = [ctx["text"] for ctx in contexts]
         prompt = f"""As Jonathan, the CSSci course assistant, use the following {current_semester} course material to answer the student's question. For capstone semester questions, consider the interconnected 
         nature of all deliverables. If the answer cannot be found in the context, say so clearly.
     
@@ -40,19 +169,43 @@ class RAGHandler:
         {formatted_history}
         
         Relevant course material:
-        {' '.join(context_texts)}
+        {context.text}
         
         Student question: {query}
         Assistant response:"""
         
         return prompt
     
-    def _get_relevant_context(self, query: str, n_results: int = 3) -> List[Dict]:
+    def _context_budget(self, query: str, contexts: List[Dict], conversation_history: List[Dict], summary: str = "") -> int:
+        """Tokens of course material that fit in the request along with everything else in its prompt and the answer"""
+        # The prompt without the material, but naming the same semester, which comes from the top context
+        empty = AssembledContext(text="", tokens=0, budget=0, contexts=contexts, dropped=0, overlap_words_removed=0)
+        prompt = self._create_prompt(query, empty, conversation_history, summary)
+        return self.context_assembler.budget(SYSTEM_PROMPT, prompt, answer_tokens=COMPLETION_OPTIONS["max_tokens"])
+
+    @staticmethod
+    def _resolve_semester_scope(query: str, conversation_history: List[Dict]) -> str:
+        """
+        Find the semester a query is about: the one it names, otherwise the one the student
+        named most recently earlier in the conversation. Returns None if no semester was mentioned.
+        """
+        for text in [query] + [msg["content"] for msg in reversed(conversation_history) if msg["role"] == "user"]:
+            semester_match = SEMESTER_PATTERN.search(text.lower())
+            if semester_match:
+                return f"Semester_{semester_match.group(1)}"
+        return None
+
+    def _get_relevant_context(self, query: str, n_results: int = RETRIEVED_CHUNKS, semester: str = None) -> List[Dict]:
         """Get the relevant context from the vector store"""
-        results = self.embeddings_manager.query_similar(query, n_results=n_results)
+        results = self.embeddings_manager.query_similar(query, n_results=n_results, semester=semester)
+        return self._documents(results)
+
+    @staticmethod
+    def _documents(results: Dict) -> List[Dict]:
+        """The retrieved chunks of a query result, as context documents"""
         documents = []
-        print("\nDebug - Raw results from ChromaDB:")
-        print(f"Metadatas: {results['metadatas']}")
+        logger.debug("Raw results from ChromaDB:")
+        logger.debug("Metadatas: %s", results['metadatas'])
         
         for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
             documents.append({
@@ -60,49 +213,163 @@ class RAGHandler:
                 "metadata": metadata,
                 "file_path": metadata.get('file_path') if metadata else None
             }) 
-            print(f"Created document with file_path: {metadata.get('file_path')}")
+            logger.debug("Created document with file_path: %s", metadata.get('file_path'))
         return documents
     
     def reset_collection(self):
         """Reset the embeddings collection."""
         self.embeddings_manager.reset_collection()
     
-    def generate_response(self, query: str, conversation_history: List[Dict]) -> str:
-        """Generate the llm's response using RAG"""
-        # Check if we need to reset the collection based on the query
-        if "semester" in query.lower() and conversation_history:
-            # If switching semesters, reset the collection
-            last_query = conversation_history[-1]["content"]
-            if "semester" in last_query.lower():
-                last_semester = re.search(r"semester (\d+)", last_query.lower())
-                current_semester = re.search(r"semester (\d+)", query.lower())
-                if last_semester and current_semester and last_semester.group(1) != current_semester.group(1):
-                    print("[DEBUG] Detected semester switch, resetting collection")
-                    self.reset_collection()
+    def _memory(self, session_id: str) -> ConversationMemory:
+        with self._memories_lock:
+            memory = self.memories.get(session_id)
+            if memory is None:
+                memory = ConversationMemory(self._summarizer(session_id))
+                self.memories[session_id] = memory
+            return memory
+
+    def _summarizer(self, session_id: str):
+        """Summary function for a session's memory; its llm calls count against the session like its questions do."""
+        def summarize(summary: str, messages: List[Dict]) -> str:
+            prompt = SUMMARY_PROMPT.format(summary=summary or "(none yet)", messages=format_messages(messages))
+            with self.scheduler.slot("llm", session_id):
+                response = self.client.chat.completions.create(messages=[{"role": "user", "content": prompt}], **SUMMARY_OPTIONS)
+            return response.choices[0].message.content.strip()
+        return summarize
+
+    def prepare(self, query: str, conversation_history: List[Dict], session_id: str = None) -> Tuple[AssembledContext, List[Dict]]:
+        """Retrieve the context for a query and build the chat messages to send to the llm"""
+        # Scope retrieval to the semester under discussion instead of touching the index
+        semester = self._resolve_semester_scope(query, conversation_history)
         
         # get the relevant context
-        context = self._get_relevant_context(query)
-        
-        # create the prompt using the context
-        prompt = self._create_prompt(query, context, conversation_history)
+        with self.telemetry.span("retrieval"):
+            contexts = self._get_relevant_context(query, semester=semester)
         
-        # generate response using llm
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You Jonathan, are a helpful Computational Social Science (CSSci) course assistant that helps students understand course materials."},
+        with self.telemetry.span("prompt_assembly"):
+            # keep the conversation part of the prompt bounded: recent messages plus a rolling summary.
+            # Only an explicit session has a memory; without one, callers would share each other's summaries
+            if session_id:
+                summary, recent_history = self._memory(session_id).recall(conversation_history)
+            else:
+                summary, recent_history = "", recent_messages(conversation_history)
+            
+            # fit the retrieved chunks into what the request's token budget leaves, without the text neighbouring chunks repeat
+            context = self.context_assembler.assemble(contexts, self._context_budget(query, contexts, recent_history, summary))
+            logger.debug("Context: %s/%s tokens from %s chunks (%s dropped, %s overlapping words removed)", context.tokens, context.budget, len(context.contexts), context.dropped, context.overlap_words_removed)
+            
+            # create the prompt using the context
+            prompt = self._create_prompt(query, context, recent_history, summary)
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens = 500,
-            stream=True
+            ]
+        return context, messages
+
+    def generate_response(self, query: str, conversation_history: List[Dict], session_id: str = None) -> RAGResponse:
+        """Generate the llm's response using RAG. Iterate the result for the tokens; its contexts hold the retrieved chunks"""
+        session_token = current_session.set(session_id) if session_id else None
+        try:
+            context, messages = self.prepare(query, conversation_history, session_id)
+        finally:
+            if session_token:
+                current_session.reset(session_token)
+        
+        # generate response using llm, through the shared scheduler so identical concurrent requests share one stream
+        stream = self.scheduler.stream(
+            request_key(messages=messages, **COMPLETION_OPTIONS),
+            lambda: self._stream_tokens(self.client.chat.completions.create(messages=messages, **COMPLETION_OPTIONS)),
+            session_id=session_id,
         )
         
+        return RAGResponse(self.telemetry.timed_stream(stream, "llm"), context.contexts, context.tokens)
+
+    async def agenerate_response(self, query: str, conversation_history: List[Dict], session_id: str = None) -> RAGResponse:
+        """Async version of generate_response. Iterate the result with `async for`"""
+        if session_id:
+            current_session.set(session_id)
+        # The vector store is an in-process index (Chroma PersistentClient or the mmap NumPy store),
+        # so retrieval runs on the default thread pool to keep the event loop free
+        context, messages = await asyncio.to_thread(self.prepare, query, conversation_history, session_id)
+        
+        async def create_stream():
+            response = await self.async_client.chat.completions.create(messages=messages, **COMPLETION_OPTIONS)
+            return self._astream_tokens(response)
+        
+        stream = await self.scheduler.astream(request_key(messages=messages, **COMPLETION_OPTIONS), create_stream,
+                                              session_id=session_id)
+        
+        return RAGResponse(self.telemetry.atimed_stream(stream, "llm"), context.contexts, context.tokens)
+
+    @staticmethod
+    def _stream_tokens(response) -> Iterator[str]:
         for chunk in response:
-            delta = chunk.choices[0].delta
-            content = getattr(delta, "content", "")
-            yield content
+            # The first chunk carries only the role, and the last one may carry only usage
+            content = getattr(chunk.choices[0].delta, "content", None) if chunk.choices else None
+            if content:
+                yield content
+
+    @staticmethod
+    async def _astream_tokens(response) -> AsyncIterator[str]:
+        try:
+            async for chunk in response:
+                content = getattr(chunk.choices[0].delta, "content", None) if chunk.choices else None
+                if content:
+                    yield content
+        finally:
+            # Also when cancelled midway: closing the response ends the upstream completion
+            await response.close()
     
+    def answer_batch(self, questions: List[str], session_id: str = BATCH_SESSION, max_workers: int = None) -> List[Dict]:
+        """
+        Answer many independent questions at once, e.g. a nightly run over the FAQ or regression questions.
+        The questions are embedded together and retrieved with one vector store query per routed filter, then
+        answered concurrently: each completion holds an llm slot of the shared scheduler, under session_id,
+        so a batch takes its fair share next to the live chats. Identical questions are answered once.
+        Returns one dict per question, in input order, with the answer, its contexts and the error if it failed.
+        """
+        semesters = [self._resolve_semester_scope(question, []) for question in questions]
+        with self.telemetry.span("retrieval", queries=len(questions)):
+            batch_results = self.embeddings_manager.query_similar_batch(questions, semesters=semesters)
+
+        with self.telemetry.span("prompt_assembly", queries=len(questions)):
+            documents = [self._documents(results) for results in batch_results]
+            contexts = [self.context_assembler.assemble(context, self._context_budget(question, context, []))
+                        for question, context in zip(questions, documents)]
+            messages = [
+                [{"role": "system", "content": SYSTEM_PROMPT},
+                 {"role": "user", "content": self._create_prompt(question, context, [])}]
+                for question, context in zip(questions, contexts)
+            ]
+
+        keys = [request_key(messages=request, **BATCH_COMPLETION_OPTIONS) for request in messages]
+        requests = dict(zip(keys, messages))
+        # More threads than llm slots would only wait in the scheduler's queue
+        max_workers = max_workers or self.scheduler.limiters["llm"].limit
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests)))) as executor:
+            futures = {key: executor.submit(self._complete, request, session_id) for key, request in requests.items()}
+
+        answers = []
+        for question, context, key in zip(questions, contexts, keys):
+            error = futures[key].exception()
+            if error:
+                logger.error("Could not answer %r: %s", question, error)
+            answers.append({
+                "question": question,
+                "answer": None if error else futures[key].result(),
+                "contexts": context.contexts,
+                "context_tokens": context.tokens,
+                "error": str(error) if error else None,
+            })
+        return answers
+
+    def _complete(self, messages: List[Dict], session_id: str) -> str:
+        """One non-streamed completion, holding an llm slot of the scheduler"""
+        with self.scheduler.slot("llm", session_id):
+            with self.telemetry.span("llm.complete"):
+                response = self.client.chat.completions.create(messages=messages, **BATCH_COMPLETION_OPTIONS)
+        return response.choices[0].message.content
+
     def chat(self, query: str) -> str:
         """Simple chat interface"""
         try:
@@ -112,6 +379,8 @@ class RAGHandler:
             return f"Error generating response: {str(e)}"
         
 if __name__ == "__main__":
+    from src.rag.telemetry import configure_logging
+    configure_logging()
     # Test the RAG system
     rag = RAGHandler()
     
@@ -123,6 +392,6 @@ if __name__ == "__main__":
     ]
     
     print("Testing RAG system with sample questions:\n")
-    for question in test_questions:
-        print(f"Q: {question}")
-        print(f"A: {rag.chat(question)}\n")
\ No newline at end of file
+    for result in rag.answer_batch(test_questions):
+        print(f"Q: {result['question']}")
+        print(f"A: {result['answer'] if result['error'] is None else 'Error generating response: ' + result['error']}\n")
\ No newline at end of file
@@ -0,0 +1,331 @@
+import os
+import logging
+import json
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Callable, Iterator, AsyncIterator, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on concurrent upstream calls of each kind, across every session in the process
+DEFAULT_LIMITS = {
+    "llm": int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    "embedding": int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+}
+
+DEFAULT_SESSION = "default"
+
+# Session the current call is made on behalf of. Copied into asyncio.to_thread calls,
+# so embeddings made during retrieval are queued under the session that asked the question.
+current_session = contextvars.ContextVar("current_session", default=DEFAULT_SESSION)
+
+
+def request_key(**request) -> str:
+    """Stable key of an upstream request, used to coalesce identical concurrent requests."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _Waiter:
+    """A call waiting for a slot. Woken through a threading.Event, or a future on its event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _Limiter:
+    """Counting semaphore whose waiters are served round-robin across sessions, FIFO within a session."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def try_acquire(self, session_id: str, waiter: _Waiter) -> bool:
+        """Take a slot right away if one is free and nobody is queued, otherwise queue the waiter."""
+        with self._lock:
+            if self.in_flight < self.limit and not self.queues:
+                self.in_flight += 1
+                return True
+            self.queues.setdefault(session_id, deque()).append(waiter)
+            return False
+
+    def release(self):
+        with self._lock:
+            if not self.queues:
+                self.in_flight -= 1
+                return
+            # Hand the slot straight to the next session in turn, which then moves to the back
+            session_id, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.queues.move_to_end(session_id)
+            else:
+                del self.queues[session_id]
+            waiter.grant()
+
+    def cancel(self, session_id: str, waiter: _Waiter):
+        """Withdraw a waiter that gave up. Passes the slot on if it had been granted in the meantime."""
+        with self._lock:
+            if not waiter.granted:
+                queue = self.queues.get(session_id)
+                queue.remove(waiter)
+                if not queue:
+                    del self.queues[session_id]
+                return
+        self.release()
+
+
+class _Flight:
+    """
+    Output of one upstream stream, shared by every request that was coalesced onto it.
+    Tokens are buffered so late subscribers replay from the start; both threads and
+    coroutines can subscribe.
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 1
+        self.producer = None  # task running the upstream stream of an async flight
+        self._condition = threading.Condition()
+        self._wakers = []  # (loop, asyncio.Event) of coroutines waiting for the next token
+
+    def _wake(self):
+        for loop, event in self._wakers:
+            loop.call_soon_threadsafe(event.set)
+        self._wakers = []
+
+    def publish(self, token: str):
+        with self._condition:
+            self.tokens.append(token)
+            self._condition.notify_all()
+            self._wake()
+
+    def finish(self, error: Exception = None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+            self._wake()
+
+    def __iter__(self) -> Iterator[str]:
+        position = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self.tokens) > position or self.done)
+                tokens = self.tokens[position:]
+                done, error = self.done, self.error
+            position += len(tokens)
+            yield from tokens
+            if done:
+                if error:
+                    raise error
+                return
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        position = 0
+        while True:
+            event = None
+            with self._condition:
+                tokens = self.tokens[position:]
+                done, error = self.done, self.error
+                if not tokens and not done:
+                    event = asyncio.Event()
+                    self._wakers.append((loop, event))
+            position += len(tokens)
+            for token in tokens:
+                yield token
+            if event is not None:
+                await event.wait()
+            elif done:
+                if error:
+                    raise error
+                return
+
+
+class RequestScheduler:
+    """
+    Process-wide gate in front of the LLM and embedding APIs.
+
+    Each kind of call has a concurrency limit; calls over the limit queue per session and
+    are admitted round-robin, so one busy session cannot starve the others. Identical
+    concurrent streamed requests are coalesced: one upstream stream is started and its
+    tokens are fanned out to every waiter.
+    """
+
+    def __init__(self, limits: Dict[str, int] = None):
+        self.limiters = {kind: _Limiter(limit) for kind, limit in (limits or DEFAULT_LIMITS).items()}
+        self.flights: Dict[str, _Flight] = {}
+        self.coalesced = 0
+        self._flights_lock = threading.Lock()
+        self._tasks = set()
+
+    @contextmanager
+    def slot(self, kind: str, session_id: str = None):
+        """Hold one slot of the given kind for the duration of a blocking call."""
+        limiter = self.limiters[kind]
+        session_id = session_id or current_session.get()
+        waiter = _Waiter()
+        if not limiter.try_acquire(session_id, waiter):
+            waiter.event.wait()
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    @asynccontextmanager
+    async def aslot(self, kind: str, session_id: str = None):
+        """Hold one slot of the given kind for the duration of an async call."""
+        limiter = self.limiters[kind]
+        session_id = session_id or current_session.get()
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not limiter.try_acquire(session_id, waiter):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                limiter.cancel(session_id, waiter)
+                raise
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def _join(self, key: str):
+        """Return (flight, True) for a new flight this caller must start, or (flight, False) to join a running one."""
+        with self._flights_lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                self.coalesced += 1
+                logger.debug("Coalesced request onto running stream (%s waiters)", flight.subscribers)
+                return flight, False
+            flight = _Flight()
+            self.flights[key] = flight
+            return flight, True
+
+    def _land(self, key: str, flight: _Flight, error: Exception = None):
+        # Unregister before finishing, so a request arriving afterwards starts a fresh call
+        with self._flights_lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.finish(error)
+
+    def _leave(self, key: str, flight: _Flight) -> bool:
+        """Drop one subscriber. True if it was the last one of an unfinished flight, which nobody reads any more."""
+        with self._flights_lock:
+            flight.subscribers -= 1
+            if flight.subscribers or flight.done:
+                return False
+            # Unregistered under the same lock as _join, so no request can join a flight about to be cancelled
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            return True
+
+    async def _asubscribe(self, key: str, flight: _Flight) -> AsyncIterator[str]:
+        try:
+            async for token in flight:
+                yield token
+        finally:
+            if self._leave(key, flight) and flight.producer is not None:
+                logger.debug("Every subscriber left, cancelling the upstream stream")
+                flight.producer.cancel()
+
+    def stream(self, key: str, create_stream: Callable[[], Iterator[str]], kind: str = "llm",
+               session_id: str = None) -> Iterator[str]:
+        """
+        Tokens of the stream made by create_stream, shared with any identical request (same key) in flight.
+        The upstream call runs on a background thread, so it completes for the other waiters even if
+        this caller stops reading.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            session_id = session_id or current_session.get()
+
+            def produce():
+                error = None
+                try:
+                    with self.slot(kind, session_id):
+                        for token in create_stream():
+                            flight.publish(token)
+                except Exception as e:
+                    error = e
+                self._land(key, flight, error)
+
+            threading.Thread(target=produce, daemon=True).start()
+        return iter(flight)
+
+    async def astream(self, key: str, create_stream: Callable[[], Awaitable[AsyncIterator[str]]], kind: str = "llm",
+                      session_id: str = None) -> AsyncIterator[str]:
+        """
+        Async version of stream. create_stream is a coroutine function returning an async iterator of tokens.
+        Unlike stream, the upstream call is cancelled, releasing its slot, once every subscriber has stopped
+        reading: closed the returned iterator or been cancelled.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            session_id = session_id or current_session.get()
+
+            async def produce():
+                error = None
+                try:
+                    async with self.aslot(kind, session_id):
+                        async for token in await create_stream():
+                            flight.publish(token)
+                except Exception as e:
+                    error = e
+                finally:
+                    self._land(key, flight, error)
+
+            flight.producer = asyncio.get_running_loop().create_task(produce())
+            self._tasks.add(flight.producer)
+            flight.producer.add_done_callback(self._tasks.discard)
+        return self._asubscribe(key, flight)
+
+    def stats(self) -> Dict:
+        return {
+            "limits": {kind: limiter.limit for kind, limiter in self.limiters.items()},
+            "in_flight": {kind: limiter.in_flight for kind, limiter in self.limiters.items()},
+            "queued": {kind: limiter.queued for kind, limiter in self.limiters.items()},
+            "streams": len(self.flights),
+            "coalesced": self.coalesced,
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """The scheduler shared by everything in this process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,448 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Callable, Optional, Union
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.rag.metadata_filter import matches_where
+from src.rag.telemetry import get_telemetry
+from src.rag.vector_store import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Shards are searched in parallel on this pool, shared by every store in the process
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", "8"))
+_search_executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+
+# How often to look for shards added or swapped by other processes, in seconds
+SHARD_REFRESH_SECONDS = float(os.getenv("SHARD_REFRESH_SECONDS", "60"))
+
+MAX_NAME_LENGTH = 63  # Chroma's limit on collection names
+VERSION_SUFFIX_LENGTH = 8  # room left in a shard name for its version suffix, e.g. ".v123456"
+
+
+def specialize_where(where: Optional[Dict], key: str, value) -> Union[Dict, bool]:
+    """
+    Simplify a where-clause for a shard in which every chunk has metadata[key] == value.
+    Returns False if no chunk of the shard can match, True if every chunk matches,
+    otherwise the clause that is left once the conditions on the shard key are decided.
+    """
+    if not where:
+        return True
+    shard_metadata = {} if value is None else {key: value}
+    parts = []
+    for field, condition in where.items():
+        if field == "$and":
+            children = [specialize_where(clause, key, value) for clause in condition]
+            if any(child is False for child in children):
+                return False
+            rest = [child for child in children if child is not True]
+            if rest:
+                parts.append(rest[0] if len(rest) == 1 else {"$and": rest})
+        elif field == "$or":
+            children = [specialize_where(clause, key, value) for clause in condition]
+            if any(child is True for child in children):
+                continue
+            rest = [child for child in children if child is not False]
+            if not rest:
+                return False
+            parts.append(rest[0] if len(rest) == 1 else {"$or": rest})
+        elif field == key:
+            if not matches_where(shard_metadata, {field: condition}):
+                return False
+        else:
+            parts.append({field: condition})
+    if not parts:
+        return True
+    return parts[0] if len(parts) == 1 else {"$and": parts}
+
+
+class PublishedShards(ABC):
+    """
+    Shards published through pointer files, <name>.shard.json in pointer_dir, each holding the shard's key
+    value and the versioned collection (<name><separator><version>) to read. Rebuilding a shard writes a new
+    version and replaces the pointer atomically, so readers in other processes see either the old or the new
+    version, never a missing or half-written one. The version before the published one is kept for readers
+    that have not refreshed since; older ones are dropped.
+    """
+
+    separator = "@"
+
+    def __init__(self, pointer_dir: str, embedding_function: Callable):
+        self.pointer_dir = Path(pointer_dir)
+        self.embedding_function = embedding_function
+
+    def _pointer_path(self, name: str) -> Path:
+        return self.pointer_dir / f"{name}.shard.json"
+
+    def _read_pointer(self, name: str) -> Dict:
+        with open(self._pointer_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_pointer(self, name: str, value, version_name: str):
+        self.pointer_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._pointer_path(name).with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"value": value, "version": version_name}, f)
+        os.replace(tmp_path, self._pointer_path(name))
+
+    def _version_name(self, name: str, version: int) -> str:
+        return f"{name}{self.separator}{version}"
+
+    def _versions(self, name: str) -> List[int]:
+        prefix = name + self.separator
+        return sorted(int(version_name[len(prefix):]) for version_name in self._version_names()
+                      if version_name.startswith(prefix) and version_name[len(prefix):].isdigit())
+
+    @abstractmethod
+    def _version_names(self) -> List[str]:
+        """Every version of every shard, published or not."""
+
+    @abstractmethod
+    def _create_version(self, version_name: str, value):
+        """An empty version of a shard, not yet published."""
+
+    @abstractmethod
+    def _open_version(self, version_name: str):
+        """An existing version of a shard."""
+
+    @abstractmethod
+    def _drop_version(self, version_name: str):
+        """Delete one version of a shard."""
+
+    @abstractmethod
+    def _collection_name(self, collection) -> str:
+        """The version name of a collection opened by this backend."""
+
+    def names(self) -> List[str]:
+        if not self.pointer_dir.exists():
+            return []
+        return [path.name[:-len(".shard.json")] for path in self.pointer_dir.glob("*.shard.json")]
+
+    def open(self, name: str, value=None):
+        """The shard for value, created and published empty if it does not exist yet."""
+        if self._pointer_path(name).exists():
+            return self.reopen(None, name)
+        return self.publish(name, value, self.stage(name, value))
+
+    def reopen(self, collection, name: str):
+        """The published version of a shard; collection is reused while it is that version."""
+        version_name = self._read_pointer(name)["version"]
+        if collection is not None and self._collection_name(collection) == version_name:
+            return collection
+        return self._open_version(version_name)
+
+    def drop(self, name: str):
+        # Unpublish first, so no reader opens a version that is being deleted
+        self._pointer_path(name).unlink(missing_ok=True)
+        for version in self._versions(name):
+            self._drop_version(self._version_name(name, version))
+
+    def stage(self, name: str, value):
+        """A new, empty and unpublished version of the shard."""
+        version = (self._versions(name) or [0])[-1] + 1
+        return self._create_version(self._version_name(name, version), value)
+
+    def publish(self, name: str, value, staged):
+        if hasattr(staged, "flush"):
+            staged.flush()
+        version_name = self._collection_name(staged)
+        published = int(version_name[len(name + self.separator):])
+        self._write_pointer(name, value, version_name)
+        for version in self._versions(name):
+            if version < published - 1:
+                self._drop_version(self._version_name(name, version))
+        return staged
+
+
+class ChromaShards(PublishedShards):
+    """
+    Shards as collections of one Chroma client, named <name>.v<version>, with their pointer files in
+    pointer_dir. The shard's key value is also kept in the collection metadata.
+    """
+
+    separator = ".v"  # Chroma collection names allow only letters, digits, ".", "_" and "-"
+
+    def __init__(self, client, pointer_dir: str, embedding_function: Callable):
+        super().__init__(pointer_dir, embedding_function)
+        self.client = client
+
+    def _version_names(self) -> List[str]:
+        # Chroma 0.6 lists names, earlier versions list collection objects
+        return [collection if isinstance(collection, str) else collection.name for collection in self.client.list_collections()]
+
+    def _create_version(self, version_name: str, value):
+        return self.client.get_or_create_collection(
+            name=version_name,
+            embedding_function=self.embedding_function,
+            metadata={"shard_value": value} if value is not None else None,
+        )
+
+    def _open_version(self, version_name: str):
+        return self.client.get_collection(name=version_name, embedding_function=self.embedding_function)
+
+    def _drop_version(self, version_name: str):
+        try:
+            self.client.delete_collection(version_name)
+        except Exception as e:
+            logger.debug("Shard collection %s is already gone: %s", version_name, e)
+
+    def _collection_name(self, collection) -> str:
+        return collection.name
+
+    def value(self, collection):
+        return (collection.metadata or {}).get("shard_value")
+
+
+class NumpyShards(PublishedShards):
+    """Shards as NumPy store directories (<name>@<version>) side by side, next to their pointer files."""
+
+    def _version_names(self) -> List[str]:
+        return [path.name for path in self.pointer_dir.glob("*@*") if path.is_dir()] if self.pointer_dir.exists() else []
+
+    def _create_version(self, version_name: str, value) -> NumpyVectorStore:
+        return NumpyVectorStore(self.pointer_dir / version_name, embedding_function=self.embedding_function)
+
+    def _open_version(self, version_name: str) -> NumpyVectorStore:
+        # The store picks up new generations by itself, so reopen() reuses it while its version is published
+        return NumpyVectorStore(self.pointer_dir / version_name, embedding_function=self.embedding_function)
+
+    def _drop_version(self, version_name: str):
+        shutil.rmtree(self.pointer_dir / version_name, ignore_errors=True)
+
+    def _collection_name(self, collection: NumpyVectorStore) -> str:
+        return collection.store_dir.name
+
+    def value(self, collection: NumpyVectorStore):
+        return self._read_pointer(collection.store_dir.name.rsplit(self.separator, 1)[0])["value"]
+
+
+class ShardedVectorStore:
+    """
+    A vector store split into one collection per value of a metadata key (the semester, by default),
+    usable in place of a single collection by EmbeddingsManager.
+
+    Every query's where-clause is specialized per shard: conditions on the shard key are decided
+    up front, so shards that cannot match are skipped and the others are searched with what is left
+    (often no filter at all). A query scoped to one value goes straight to that shard; otherwise the
+    remaining shards are searched in parallel and their results merged into one top-k. Results are
+    the same as from one collection holding everything.
+
+    A shard can be rebuilt without touching the others: stage() returns an empty staging shard
+    and swap_in() replaces the live shard with it.
+    """
+
+    def __init__(self, backend: PublishedShards, base_name: str, shard_key: str):
+        self.backend = backend
+        self.base_name = base_name
+        self.shard_key = shard_key
+        self.embedding_function = backend.embedding_function
+        self.prefix = f"{base_name}.{shard_key}."
+        self.shards: Dict = {}  # shard key value -> collection
+        self.staging: Dict = {}
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+        self.telemetry = get_telemetry()
+        self.refresh()
+
+    def shard_name(self, value) -> str:
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "-", str(value)).strip("-_") if value is not None else ""
+        name = self.prefix + (slug or "none")
+        if len(name) + VERSION_SUFFIX_LENGTH > MAX_NAME_LENGTH:
+            digest = hashlib.sha1(str(value).encode("utf-8")).hexdigest()[:8]
+            name = f"{name[:MAX_NAME_LENGTH - VERSION_SUFFIX_LENGTH - 9]}-{digest}"
+        return name
+
+    def refresh(self):
+        """Open the shards on disk, including ones added or swapped by other processes."""
+        with self._lock:
+            current = {self.shard_name(value): collection for value, collection in self.shards.items()}
+        shards = {}
+        for name in self.backend.names():
+            if not name.startswith(self.prefix):
+                continue
+            try:
+                collection = self.backend.reopen(current.get(name), name)
+            except Exception as e:
+                # Dropped by another process since it was listed
+                logger.debug("Shard %s is gone: %s", name, e)
+                continue
+            shards[self.backend.value(collection)] = collection
+        with self._lock:
+            self.shards = shards
+            self._last_refresh = time.monotonic()
+        logger.debug("Opened %s shards by %s: %s", len(shards), self.shard_key, sorted(map(str, shards)))
+
+    def _snapshot(self) -> Dict:
+        if time.monotonic() - self._last_refresh > SHARD_REFRESH_SECONDS:
+            self.refresh()
+        with self._lock:
+            return dict(self.shards)
+
+    def _shard(self, value):
+        with self._lock:
+            collection = self.shards.get(value)
+            if collection is None:
+                collection = self.shards[value] = self.backend.open(self.shard_name(value), value)
+            return collection
+
+    def _targets(self, where: Optional[Dict]) -> List:
+        """(shard value, collection, where-clause for that shard) for every shard the clause can match in."""
+        targets = []
+        for value, collection in self._snapshot().items():
+            shard_where = specialize_where(where, self.shard_key, value)
+            if shard_where is not False:
+                targets.append((value, collection, None if shard_where is True else shard_where))
+        return targets
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in self._snapshot().values())
+
+    def _query_shard(self, value, collection, query_embeddings, n_results: int, where: Optional[Dict]) -> Dict:
+        with self.telemetry.span("shard_search", shard=str(value)):
+            return collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+
+    def query(self, query_embeddings: List[List[float]] = None, query_texts: List[str] = None,
+              n_results: int = 10, where: Dict = None, include: List[str] = None) -> Dict:
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        targets = [target for target in self._targets(where) if target[1].count()]
+        logger.debug("Searching %s shards", len(targets))
+
+        if len(targets) == 1:
+            # Routed to a single shard: no thread hop, no merge
+            value, collection, shard_where = targets[0]
+            return self._query_shard(value, collection, query_embeddings, n_results, shard_where)
+
+        futures = [_search_executor.submit(self._query_shard, value, collection, query_embeddings, n_results, shard_where)
+                   for value, collection, shard_where in targets]
+        shard_results = [future.result() for future in futures]
+
+        # Distances from every shard are in the same space, so the global top-k is the k smallest
+        merged = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_index in range(len(query_embeddings)):
+            hits = sorted(
+                (
+                    (distance, chunk_id, document, metadata)
+                    for results in shard_results
+                    for chunk_id, document, metadata, distance in zip(
+                        results["ids"][query_index], results["documents"][query_index],
+                        results["metadatas"][query_index], results["distances"][query_index])
+                ),
+                key=lambda hit: hit[0],
+            )[:n_results]
+            merged["distances"].append([hit[0] for hit in hits])
+            merged["ids"].append([hit[1] for hit in hits])
+            merged["documents"].append([hit[2] for hit in hits])
+            merged["metadatas"].append([hit[3] for hit in hits])
+        return merged
+
+    def get(self, ids: List[str] = None, where: Dict = None, include: List[str] = None, limit: int = None) -> Dict:
+        merged = {"ids": [], "documents": [], "metadatas": []}
+        if include and "embeddings" in include:
+            merged["embeddings"] = []
+        for _, collection, shard_where in self._targets(where):
+            if limit is not None and len(merged["ids"]) >= limit:
+                break
+            kwargs = {"ids": ids, "where": shard_where}
+            if include is not None:
+                kwargs["include"] = include
+            if limit is not None:
+                kwargs["limit"] = limit - len(merged["ids"])
+            results = collection.get(**kwargs)
+            for field in merged:
+                merged[field].extend(results[field] if results.get(field) is not None else [None] * len(results["ids"]))
+        return merged
+
+    def upsert(self, ids: List[str], documents: List[str] = None, metadatas: List[Dict] = None,
+               embeddings: List[List[float]] = None):
+        groups: Dict = {}
+        for position, metadata in enumerate(metadatas or [{} for _ in ids]):
+            groups.setdefault(metadata.get(self.shard_key), []).append(position)
+
+        for value, positions in groups.items():
+            group_ids = [ids[i] for i in positions]
+            # A chunk whose key value changed must not stay behind in its old shard
+            for other_value, collection in self._snapshot().items():
+                if other_value != value:
+                    moved = collection.get(ids=group_ids, include=[])["ids"]
+                    if moved:
+                        collection.delete(ids=moved)
+            self._shard(value).upsert(
+                ids=group_ids,
+                documents=[documents[i] for i in positions] if documents is not None else None,
+                metadatas=[metadatas[i] for i in positions] if metadatas is not None else None,
+                embeddings=[embeddings[i] for i in positions] if embeddings is not None else None,
+            )
+
+    def delete(self, ids: List[str] = None, where: Dict = None):
+        for value, collection, shard_where in self._targets(where):
+            if ids:
+                collection.delete(ids=ids, where=shard_where)
+            elif shard_where is None:
+                # Everything in the shard goes
+                self.backend.drop(self.shard_name(value))
+                with self._lock:
+                    self.shards.pop(value, None)
+            else:
+                collection.delete(where=shard_where)
+
+    def reset(self):
+        """Drop every shard, staging shards included."""
+        names = {name for name in self.backend.names() if name.startswith(self.prefix)}
+        for name in names | {self.shard_name(value) for value in self.staging}:
+            self.backend.drop(name)
+        with self._lock:
+            self.shards = {}
+            self.staging = {}
+
+    def flush(self):
+        """Write out buffered changes of shards that buffer them (the NumPy store)."""
+        for collection in list(self._snapshot().values()) + list(self.staging.values()):
+            if hasattr(collection, "flush"):
+                collection.flush()
+
+    def stage(self, value):
+        """An empty staging shard for value, to fill and then publish with swap_in()."""
+        self.staging[value] = self.backend.stage(self.shard_name(value), value)
+        return self.staging[value]
+
+    def swap_in(self, value):
+        """
+        Replace the live shard for value with its staging shard. Searches in this process switch over at once;
+        other processes pick up the new shard on their next refresh and keep using the old one until then,
+        which stays in place until the shard is swapped again.
+        """
+        staged = self.staging.pop(value)
+        name = self.shard_name(value)
+        with self._lock:
+            self.shards[value] = staged
+        live = self.backend.publish(name, value, staged)
+        with self._lock:
+            self.shards[value] = live
+        logger.info("Swapped in shard %s", name)
+
+
+if __name__ == "__main__":
+    # Copy the single collection into shards by VECTOR_SHARD_KEY (default: semester); the single collection is kept
+    from src.rag.telemetry import configure_logging
+    from src.rag.embeddings import EmbeddingsManager
+    configure_logging()
+    source = EmbeddingsManager(shard_key="")
+    target = EmbeddingsManager(shard_key=os.getenv("VECTOR_SHARD_KEY") or "semester")
+    existing = source.collection.get(include=["documents", "metadatas", "embeddings"])
+    for start in range(0, len(existing["ids"]), EmbeddingsManager.SHARD_UPSERT_BATCH):
+        end = start + EmbeddingsManager.SHARD_UPSERT_BATCH
+        target.collection.upsert(ids=existing["ids"][start:end], documents=existing["documents"][start:end],
+                                 metadatas=existing["metadatas"][start:end], embeddings=existing["embeddings"][start:end])
+    target.persist()
+    print(f"Copied {len(existing['ids'])} chunks into {len(target.collection.shards)} shards by {target.shard_key}")
@@ -0,0 +1,161 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, aclosing
+from typing import Dict, Iterator, AsyncIterator
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Latencies kept per stage for the percentiles; older samples are dropped
+SAMPLES_PER_STAGE = 2048
+
+# Set to "otel" to also export spans and latency histograms through OpenTelemetry (OTLP, configured by the usual OTEL_* variables)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+
+
+def configure_logging(level: str = None):
+    """Set up logging for an entry point. LOG_LEVEL=DEBUG brings back the detailed debug output."""
+    logging.basicConfig(
+        level=(level or os.getenv("LOG_LEVEL", "INFO")).upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+class _OpenTelemetry:
+    """Spans and a latency histogram exported over OTLP. Only imported when enabled."""
+
+    def __init__(self):
+        from opentelemetry import trace, metrics
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+
+        resource = Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "jonathan-ta")})
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(tracer_provider)
+        metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())]))
+
+        self.tracer = trace.get_tracer("jonathan_ta.rag")
+        self.histogram = metrics.get_meter("jonathan_ta.rag").create_histogram(
+            "rag.stage.duration", unit="s", description="Latency of each stage of a RAG request")
+
+
+class Telemetry:
+    """
+    Per-stage latency recorder. Stages are timed with span() or record(); each keeps a
+    window of recent samples from which stats() reports p50 and p99. When OpenTelemetry
+    export is enabled, every span is also exported as a trace span and a histogram point.
+    """
+
+    def __init__(self, exporter: str = TRACING_EXPORTER):
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.otel = None
+        if exporter == "otel":
+            try:
+                self.otel = _OpenTelemetry()
+            except ImportError as e:
+                logger.warning("OpenTelemetry export requested but unavailable: %s", e)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=SAMPLES_PER_STAGE)
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+        if self.otel:
+            self.otel.histogram.record(seconds, {"stage": stage})
+
+    @contextmanager
+    def span(self, stage: str, **attributes):
+        """Time the enclosed block as one sample of the stage."""
+        if self.otel:
+            with self.otel.tracer.start_as_current_span(stage, attributes=attributes):
+                start = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+    def timed_stream(self, tokens: Iterator[str], stage: str = "llm") -> Iterator[str]:
+        """
+        Pass a token stream through, recording the time to the first non-empty token and the total stream
+        time. Both are measured from this call, so time spent waiting for the stream to start counts.
+        """
+        return self._timed_stream(tokens, stage, time.perf_counter())
+
+    def _timed_stream(self, tokens: Iterator[str], stage: str, start: float) -> Iterator[str]:
+        first = True
+        try:
+            for token in tokens:
+                if first and token:
+                    self.record(f"{stage}.first_token", time.perf_counter() - start)
+                    first = False
+                yield token
+        finally:
+            self.record(f"{stage}.stream", time.perf_counter() - start)
+
+    def atimed_stream(self, tokens: AsyncIterator[str], stage: str = "llm") -> AsyncIterator[str]:
+        """Async version of timed_stream."""
+        return self._atimed_stream(tokens, stage, time.perf_counter())
+
+    async def _atimed_stream(self, tokens: AsyncIterator[str], stage: str, start: float) -> AsyncIterator[str]:
+        first = True
+        try:
+            # Closing the timed stream closes the one it wraps
+            async with aclosing(tokens):
+                async for token in tokens:
+                    if first and token:
+                        self.record(f"{stage}.first_token", time.perf_counter() - start)
+                        first = False
+                    yield token
+        finally:
+            self.record(f"{stage}.stream", time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Latency percentiles in milliseconds for every stage seen so far."""
+        with self._lock:
+            snapshot = {stage: (np.asarray(samples), self.counts[stage]) for stage, samples in self.samples.items()}
+        return {
+            stage: {
+                "count": count,
+                "p50_ms": float(np.percentile(samples, 50) * 1e3),
+                "p99_ms": float(np.percentile(samples, 99) * 1e3),
+                "mean_ms": float(samples.mean() * 1e3),
+            }
+            for stage, (samples, count) in sorted(snapshot.items())
+        }
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """The telemetry recorder shared by everything in this process."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+        return _telemetry
@@ -0,0 +1,353 @@
+import os
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Callable
+import numpy as np
+from src.rag.metadata_filter import matches_where
+
+logger = logging.getLogger(__name__)
+
+# Metadata fields stored as integer-coded columns so filters become vectorized comparisons
+CODED_FIELDS = ["semester", "assignment_type", "assignment", "filter_key"]
+
+# Generations kept on disk: the published one and the one before it, which readers
+# in other processes may still be loading when a new one is published
+KEEP_GENERATIONS = 2
+GENERATION_FILES = ("vectors.{}.npy", "columns.{}.npz", "records.{}.json")
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class _StoreState:
+    """Immutable snapshot of the store. Writers build a new one, so readers never need a lock."""
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 columns: Dict[str, np.ndarray], vocab: Dict[str, List[str]]):
+        self.vectors = vectors
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.columns = columns
+        self.vocab = vocab
+        self.vocab_index = {field: {value: code for code, value in enumerate(values)} for field, values in vocab.items()}
+        self.id_index = {chunk_id: position for position, chunk_id in enumerate(ids)}
+
+    @classmethod
+    def empty(cls) -> "_StoreState":
+        return cls(np.zeros((0, 0), dtype=np.float32), [], [], [],
+                   {field: np.zeros(0, dtype=np.int32) for field in CODED_FIELDS},
+                   {field: [] for field in CODED_FIELDS})
+
+
+class NumpyVectorStore:
+    """
+    Flat vector index for small corpora, usable in place of a Chroma collection by EmbeddingsManager.
+
+    L2-normalized float32 vectors live in a memory-mapped .npy file and the routed metadata fields
+    are integer-coded columns, so a filtered query is one masked matrix-vector product plus argpartition.
+    Files are written as numbered generations and published through manifest.json; other processes
+    map the same files read-only and pick up a new generation when the manifest changes.
+    Distances are cosine distances (1 - cosine similarity).
+    """
+
+    def __init__(self, store_dir: str, embedding_function: Callable[[List[str]], List[List[float]]] = None):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.store_dir / "manifest.json"
+        self.lock_path = self.store_dir / "manifest.lock"
+        self.embedding_function = embedding_function
+        self.generation = 0
+        self.dirty = False
+        self._manifest_mtime = None
+        self._write_lock = threading.Lock()
+        self._pending = {}  # id -> (vector, document, metadata) upserted since the last merge
+        self._state = _StoreState.empty()
+        self._load()
+
+    def _load(self, retry: bool = True):
+        if not self.manifest_path.exists():
+            return
+        try:
+            self._load_generation()
+        except FileNotFoundError:
+            # A writer published and cleaned up generations while this one was being read
+            if not retry:
+                raise
+            self._load(retry=False)
+
+    def _load_generation(self):
+        mtime = self.manifest_path.stat().st_mtime_ns
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        generation = manifest["generation"]
+        vectors = np.load(self.store_dir / f"vectors.{generation}.npy", mmap_mode="r")
+        with np.load(self.store_dir / f"columns.{generation}.npz") as columns_file:
+            columns = {field: columns_file[field] for field in CODED_FIELDS}
+        with open(self.store_dir / f"records.{generation}.json", "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self._state = _StoreState(vectors, records["ids"], records["documents"], records["metadatas"], columns, records["vocab"])
+        self.generation = generation
+        self._manifest_mtime = mtime
+
+    def _maybe_reload(self):
+        """Pick up a generation published by another process. Unflushed local writes take precedence."""
+        if self.dirty:
+            return
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._manifest_mtime:
+            self._load()
+
+    def count(self) -> int:
+        self._maybe_reload()
+        return len(self._current().ids)
+
+    def _mask(self, state: _StoreState, where: Dict) -> np.ndarray:
+        """Evaluate a where-clause over all rows at once. Returns None when there is no filter."""
+        if not where:
+            return None
+        masks = []
+        for key, condition in where.items():
+            if key == "$and":
+                masks.append(np.logical_and.reduce([self._mask(state, clause) for clause in condition]))
+            elif key == "$or":
+                masks.append(np.logical_or.reduce([self._mask(state, clause) for clause in condition]))
+            elif key in state.columns:
+                column, codes = state.columns[key], state.vocab_index[key]
+                operations = condition if isinstance(condition, dict) else {"$eq": condition}
+                for operator, operand in operations.items():
+                    if operator in ("$eq", "$ne"):
+                        match = column == codes.get(operand, -1)
+                        masks.append(match if operator == "$eq" else ~match)
+                    elif operator in ("$in", "$nin"):
+                        match = np.isin(column, [codes.get(value, -1) for value in operand])
+                        masks.append(match if operator == "$in" else ~match)
+                    else:
+                        raise ValueError(f"Unsupported where operator: {operator}")
+            else:
+                # Fields without an integer column fall back to checking each record
+                masks.append(np.fromiter((matches_where(metadata, {key: condition}) for metadata in state.metadatas),
+                                         dtype=bool, count=len(state.ids)))
+        return np.logical_and.reduce(masks)
+
+    def query(self, query_embeddings: List[List[float]] = None, query_texts: List[str] = None,
+              n_results: int = 10, where: Dict = None, include: List[str] = None) -> Dict:
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        self._maybe_reload()
+        state = self._current()
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        queries = l2_normalize(np.asarray(query_embeddings, dtype=np.float32))
+        if not state.ids:
+            for key in results:
+                results[key] = [[] for _ in queries]
+            return results
+
+        scores = state.vectors @ queries.T  # (rows, queries)
+        mask = self._mask(state, where)
+        candidates = len(state.ids)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            candidates = int(mask.sum())
+        k = min(n_results, candidates)
+
+        for column in scores.T:
+            if k == 0:
+                top = np.zeros(0, dtype=np.int64)
+            else:
+                top = np.argpartition(-column, k - 1)[:k]
+                top = top[np.argsort(-column[top])]
+            results["ids"].append([state.ids[i] for i in top])
+            results["documents"].append([state.documents[i] for i in top])
+            results["metadatas"].append([state.metadatas[i] for i in top])
+            results["distances"].append((1.0 - column[top]).tolist())
+        return results
+
+    def get(self, ids: List[str] = None, where: Dict = None, include: List[str] = None, limit: int = None) -> Dict:
+        self._maybe_reload()
+        state = self._current()
+        positions = range(len(state.ids)) if ids is None else [state.id_index[i] for i in ids if i in state.id_index]
+        mask = self._mask(state, where)
+        positions = [i for i in positions if mask is None or mask[i]][:limit]
+        results = {
+            "ids": [state.ids[i] for i in positions],
+            "documents": [state.documents[i] for i in positions],
+            "metadatas": [state.metadatas[i] for i in positions],
+        }
+        if include and "embeddings" in include:
+            # The stored, L2-normalized vectors
+            results["embeddings"] = np.asarray(state.vectors[positions])
+        return results
+
+    def upsert(self, ids: List[str], documents: List[str] = None, metadatas: List[Dict] = None,
+               embeddings: List[List[float]] = None):
+        """Buffer the rows; they are merged into the store once, on the next read, delete or flush."""
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{} for _ in ids]
+        new_vectors = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._write_lock:
+            for chunk_id, vector, document, metadata in zip(ids, new_vectors, documents, metadatas):
+                self._pending[chunk_id] = (vector, document, metadata)
+            self.dirty = True
+
+    def _current(self) -> _StoreState:
+        """The state to read, with buffered upserts merged in."""
+        if self._pending:
+            with self._write_lock:
+                self._merge_pending()
+        return self._state
+
+    def _merge_pending(self):
+        """Merge buffered upserts into a new state, copying the existing rows once. Called with the write lock held."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        state = self._state
+        all_ids, all_documents, all_metadatas = list(state.ids), list(state.documents), list(state.metadatas)
+        vocab = {field: list(values) for field, values in state.vocab.items()}
+        vocab_index = {field: dict(codes) for field, codes in state.vocab_index.items()}
+        columns = {field: list(state.columns[field]) for field in CODED_FIELDS}
+
+        updated, appended = [], []
+        for chunk_id, (vector, document, metadata) in pending.items():
+            codes = []
+            for field in CODED_FIELDS:
+                value = metadata.get(field)
+                if value not in vocab_index[field]:
+                    vocab_index[field][value] = len(vocab[field])
+                    vocab[field].append(value)
+                codes.append(vocab_index[field][value])
+
+            position = state.id_index.get(chunk_id)
+            if position is None:
+                all_ids.append(chunk_id)
+                all_documents.append(document)
+                all_metadatas.append(metadata)
+                for field, code in zip(CODED_FIELDS, codes):
+                    columns[field].append(code)
+                appended.append(vector)
+            else:
+                all_documents[position], all_metadatas[position] = document, metadata
+                for field, code in zip(CODED_FIELDS, codes):
+                    columns[field][position] = code
+                updated.append((position, vector))
+
+        dim = len(next(iter(pending.values()))[0])
+        vectors = np.empty((len(all_ids), dim), dtype=np.float32)
+        if state.ids:
+            vectors[:len(state.ids)] = state.vectors
+        for position, vector in updated:
+            vectors[position] = vector
+        if appended:
+            vectors[len(state.ids):] = np.stack(appended)
+        self._state = _StoreState(vectors, all_ids, all_documents, all_metadatas,
+                                  {field: np.asarray(values, dtype=np.int32) for field, values in columns.items()}, vocab)
+
+    def delete(self, ids: List[str] = None, where: Dict = None):
+        with self._write_lock:
+            self._maybe_reload()
+            self._merge_pending()
+            state = self._state
+            remove = np.zeros(len(state.ids), dtype=bool)
+            if ids:
+                remove[[state.id_index[i] for i in ids if i in state.id_index]] = True
+            if where:
+                remove |= self._mask(state, where)
+            if not remove.any():
+                return
+            keep = np.flatnonzero(~remove)
+            self._state = _StoreState(np.array(state.vectors[keep]),
+                                      [state.ids[i] for i in keep],
+                                      [state.documents[i] for i in keep],
+                                      [state.metadatas[i] for i in keep],
+                                      {field: state.columns[field][keep] for field in CODED_FIELDS}, state.vocab)
+            self.dirty = True
+
+    def reset(self):
+        with self._write_lock:
+            self._pending = {}
+            self._state = _StoreState.empty()
+            self.dirty = True
+        self.flush()
+
+    def flush(self):
+        """
+        Write the current state as a new generation and publish it through the manifest. The generation
+        number is picked under a file lock from the manifest on disk, so writers in different processes
+        never write the same generation's files.
+        """
+        with self._write_lock, self._file_lock():
+            if not self.dirty:
+                return
+            self._merge_pending()
+            state = self._state
+            published = self._published_generation()
+            if published > self.generation:
+                logger.warning("Generation %s of %s was written by another process since this one loaded; "
+                               "replacing it with this process's state", published, self.store_dir)
+            generation = max(self.generation, published) + 1
+            vectors_path = self.store_dir / f"vectors.{generation}.npy"
+            np.save(vectors_path, np.ascontiguousarray(state.vectors, dtype=np.float32))
+            np.savez(self.store_dir / f"columns.{generation}.npz", **state.columns)
+            with open(self.store_dir / f"records.{generation}.json", "w", encoding="utf-8") as f:
+                json.dump({"ids": state.ids, "documents": state.documents,
+                           "metadatas": state.metadatas, "vocab": state.vocab}, f)
+
+            tmp_path = self.manifest_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"generation": generation, "count": len(state.ids),
+                           "dim": int(state.vectors.shape[1]) if len(state.ids) else 0}, f)
+            os.replace(tmp_path, self.manifest_path)
+
+            self._collect_generations(generation)
+            self.generation = generation
+            self.dirty = False
+            self._manifest_mtime = self.manifest_path.stat().st_mtime_ns
+            # Serve the freshly written file through the page cache like every other reader
+            self._state = _StoreState(np.load(vectors_path, mmap_mode="r"), state.ids, state.documents,
+                                      state.metadatas, state.columns, state.vocab)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the store directory, shared with writers in other processes."""
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _published_generation(self) -> int:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)["generation"]
+        except FileNotFoundError:
+            return 0
+
+    def _collect_generations(self, published: int):
+        """
+        Delete the files of generations older than the last KEEP_GENERATIONS. Readers that saw an
+        older manifest still find the previous generation; processes that map even older files keep
+        their open file handles, and a reader that loses the race retries with the new manifest.
+        """
+        for pattern in GENERATION_FILES:
+            for path in self.store_dir.glob(pattern.format("*")):
+                try:
+                    generation = int(path.name.split(".")[1])
+                except ValueError:
+                    continue
+                if generation <= published - KEEP_GENERATIONS:
+                    path.unlink(missing_ok=True)
@@ -0,0 +1,173 @@
+import os
+import logging
+import sys
+import json
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Dict, AsyncIterator, Optional
+from urllib.parse import quote
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel, Field
+from src.rag.retriever import RAGHandler
+from src.rag.scheduler import get_scheduler, current_session
+from src.rag.telemetry import configure_logging, get_telemetry
+from src.web.pdf_pages import extract_pages
+from dotenv import load_dotenv
+
+load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
+
+WEB_DIR = Path(__file__).resolve().parent
+STATIC_DIR = WEB_DIR / "static"
+ROOT_DIR = WEB_DIR.parents[1]
+
+# Threads available for retrieval, which runs in-process and blocks while it searches the vector store
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", "32"))
+# Seconds between checks for a client that went away mid-answer; checking on every token costs a receive per token
+DISCONNECT_CHECK_INTERVAL = 0.5
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    question: str = Field(min_length=1)
+    history: List[ChatMessage] = []
+    session_id: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One handler per process: its OpenAI clients and vector store are shared by every request
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS))
+    app.state.rag = RAGHandler()
+    # Start serving right away; the first questions wait only for whatever warm-up has not finished yet
+    app.state.rag.start_warm_up()
+    yield
+    await app.state.rag.aclose()
+
+
+app = FastAPI(title="Jonathan - CSSci course assistant", lifespan=lifespan)
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+templates = Jinja2Templates(directory=WEB_DIR / "templates")
+
+
+def format_event(event: str, data) -> str:
+    """Encode one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def get_source_url(file_path: str) -> str:
+    """URL of a source document on the /static mount, or None if it lives outside the static directory."""
+    path = Path(file_path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    try:
+        relative_path = path.resolve().relative_to(STATIC_DIR)
+    except ValueError:
+        return None
+    return f"/static/{quote(relative_path.as_posix())}"
+
+
+def get_sources(contexts: List[Dict]) -> List[Dict]:
+    """
+    One entry per distinct source passage, in retrieval order. When a chunk's pages are known the
+    entry links to just those pages, extracted into a small PDF, and separately to the whole document.
+    """
+    sources, seen = [], set()
+    for context in contexts:
+        file_path = context.get("file_path")
+        metadata = context.get("metadata") or {}
+        pages = (metadata.get("page_start"), metadata.get("page_end") or metadata.get("page_start"))
+        if not file_path or (file_path, pages) in seen:
+            continue
+        seen.add((file_path, pages))
+        document_url = get_source_url(file_path)
+        page_path = extract_pages(file_path, *pages) if pages[0] and file_path.endswith(".pdf") else None
+        sources.append({
+            "name": os.path.basename(file_path),
+            "pages": list(pages) if page_path else None,
+            "url": get_source_url(str(page_path)) if page_path else document_url,
+            "document_url": document_url,
+        })
+    return sources
+
+
+async def stream_chat(rag: RAGHandler, request: Request, question: str, history: List[Dict],
+                      session_id: str, queue_key: str = None) -> AsyncIterator[str]:
+    if queue_key:
+        current_session.set(queue_key)
+    response = None
+    try:
+        response = await rag.agenerate_response(question, history + [{"role": "user", "content": question}],
+                                                session_id=session_id)
+        checked = time.monotonic()
+        async for token in response:
+            if time.monotonic() - checked >= DISCONNECT_CHECK_INTERVAL:
+                if await request.is_disconnected():
+                    logger.debug("Client disconnected, stopping stream")
+                    return
+                checked = time.monotonic()
+            if token:
+                yield format_event("token", token)
+        # Extracting page ranges reads the PDFs, so keep it off the event loop
+        yield format_event("sources", await asyncio.to_thread(get_sources, response.contexts))
+        yield format_event("done", {})
+    except Exception:
+        logger.exception("Error generating response")
+        yield format_event("error", "Sorry, I encountered an error. Please try again.")
+    finally:
+        # On disconnect or cancellation this cancels the upstream completion and frees its llm slot
+        if response is not None:
+            await response.aclose()
+
+
+@app.get("/")
+async def index(request: Request):
+    return templates.TemplateResponse("index.html", {"request": request})
+
+
+@app.post("/chat")
+async def chat(request: Request, chat_request: ChatRequest):
+    """Answer a question, streaming the tokens as Server-Sent Events followed by the sources and a done event."""
+    # The full history is passed on; the session's conversation memory decides how much of it reaches the prompt
+    history = [message.model_dump() for message in chat_request.history]
+    # Requests are queued fairly per session; clients without a session id are grouped by address for queueing
+    # only, and get no conversation memory, since everyone behind one proxy would share it
+    session_id = chat_request.session_id
+    queue_key = session_id or (request.client.host if request.client else None)
+    return StreamingResponse(
+        stream_chat(request.app.state.rag, request, chat_request.question, history, session_id, queue_key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Latency percentiles of every stage of the requests served by this worker, and the scheduler's queues."""
+    return {"stages": get_telemetry().stats(), "scheduler": get_scheduler().stats()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "src.web.api:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="uvloop",
+        http="httptools",
+    )
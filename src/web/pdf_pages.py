@@ -0,0 +1,65 @@
+import os
+import logging
+import hashlib
+import threading
+from pathlib import Path
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+ROOT_DIR = Path(__file__).resolve().parents[2]
+# Extracted page ranges are cached here, so both web apps serve them from their static routes
+PAGES_DIR = STATIC_DIR / "pages"
+
+
+def resolve_path(file_path: str) -> Path:
+    path = Path(file_path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    return path.resolve()
+
+
+def page_range_path(file_path: str, page_start: int, page_end: int) -> Path:
+    """Cache location of a page range of a PDF, mirroring the document's place in the static directory."""
+    source = resolve_path(file_path)
+    try:
+        folder = PAGES_DIR / source.parent.relative_to(STATIC_DIR)
+    except ValueError:
+        # Documents outside the static directory are keyed by a hash of their path
+        folder = PAGES_DIR / hashlib.sha256(str(source.parent).encode("utf-8")).hexdigest()[:16]
+    suffix = f"p{page_start}" if page_start == page_end else f"p{page_start}-{page_end}"
+    return folder / f"{source.stem}.{suffix}.pdf"
+
+
+def extract_pages(file_path: str, page_start: int, page_end: int = None) -> Path:
+    """
+    Write pages page_start..page_end (1-based, inclusive) of a PDF to a small PDF of their own and return its path.
+    The file is reused until the source document changes. Returns None if the pages cannot be extracted.
+    """
+    page_end = page_end or page_start
+    source = resolve_path(file_path)
+    target = page_range_path(file_path, page_start, page_end)
+    try:
+        if target.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+            return target
+
+        reader = PyPDF2.PdfReader(str(source))
+        first, last = max(1, page_start), min(page_end, len(reader.pages))
+        if first > last:
+            return None
+        writer = PyPDF2.PdfWriter()
+        for page_number in range(first, last + 1):
+            writer.add_page(reader.pages[page_number - 1])
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Unique temporary name, since several requests may extract the same pages at once
+        tmp_path = target.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            writer.write(f)
+        os.replace(tmp_path, target)
+        logger.debug("Extracted pages %s-%s of %s: %s bytes instead of %s", first, last, source.name, target.stat().st_size, source.stat().st_size)
+        return target
+    except Exception as e:
+        logger.error("Error extracting pages %s-%s of %s: %s", page_start, page_end, file_path, e)
+        return None
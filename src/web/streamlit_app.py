@@ -1,4 +1,5 @@
 import os
+import logging
 
 __import__('pysqlite3')
 import sys
@@ -6,18 +7,31 @@ sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 import streamlit as st
 from src.rag.retriever import RAGHandler
+from src.web.pdf_pages import extract_pages
+from src.rag.telemetry import configure_logging
 import base64
+import uuid
 from pathlib import Path
+from urllib.parse import quote
 from dotenv import load_dotenv
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
 
 # Initialize RAG Handler
 @st.cache_resource
 def get_rag_handler():
-    return RAGHandler()
+    # Created cheaply so the first page renders at once; the vector store and API connections warm up meanwhile
+    rag_handler = RAGHandler()
+    rag_handler.start_warm_up()
+    return rag_handler
 
 def initialize_session_state():
+    if "session_id" not in st.session_state:
+        # Identifies this browser session to the shared request scheduler
+        st.session_state.session_id = str(uuid.uuid4())
     if "messages" not in st.session_state:
         welcome_message = """
         👋 Hello! I'm Jonathan, your CSSci course assistant. Ask me anything about your courses, assignments, or deadlines!
@@ -35,26 +49,85 @@ def initialize_session_state():
             {"role": "assistant", "content": welcome_message}
         ]
 
+# Files in this directory are served by Streamlit at app/static/ (server.enableStaticServing in .streamlit/config.toml)
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _encode_pdf(file_path: str, mtime: float) -> str:
+    """Base64-encode a PDF once per path and modification time."""
+    with open(file_path, "rb") as f:
+        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
+    return f"data:application/pdf;base64,{base64_pdf}"
+
 def get_pdf_data(file_path: str) -> str:
     """Convert PDF to base64 string"""
     try:
-        with open(file_path, "rb") as f:
-            pdf_data = f.read()
-            base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-            return f"data:application/pdf;base64,{base64_pdf}"
+        return _encode_pdf(file_path, os.path.getmtime(file_path))
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
         return None
 
+def get_pdf_url(file_path: str) -> str:
+    """
+    URL of a PDF on the static route, so the browser fetches it once (with range requests) and caches it.
+    The mtime is added as a version parameter, which makes the server send long-lived caching headers.
+    Falls back to an inline data URI for files outside the static directory.
+    """
+    path = Path(file_path)
+    if not path.is_absolute():
+        path = ROOT_DIR / path
+    try:
+        relative_path = path.resolve().relative_to(STATIC_DIR)
+        return f"app/static/{quote(relative_path.as_posix())}?v={int(path.stat().st_mtime)}"
+    except (ValueError, OSError):
+        return get_pdf_data(file_path)
+
 def get_pdf_link(file_path: str) -> str:
     """Generate a download link for PDF"""
     if file_path and file_path.endswith('.pdf'):
-        pdf_data = get_pdf_data(file_path)
-        if pdf_data:
+        pdf_url = get_pdf_url(file_path)
+        if pdf_url:
             filename = os.path.basename(file_path)
-            return f'<a href="{pdf_data}" download="{filename}" style="text-decoration:none;color:#2E8BC0;padding:0.5em 1em;border:1px solid #2E8BC0;border-radius:5px;background-color:white;">📥 Download PDF</a>'
+            return f'<a href="{pdf_url}" download="{filename}" style="text-decoration:none;color:#2E8BC0;padding:0.5em 1em;border:1px solid #2E8BC0;border-radius:5px;background-color:white;">📥 Download PDF</a>'
     return None
 
+def get_page_range(doc: dict):
+    """(first, last) page a retrieved chunk came from, or None for chunks indexed without page numbers."""
+    metadata = doc.get("metadata") or {}
+    if metadata.get("page_start"):
+        return int(metadata["page_start"]), int(metadata.get("page_end") or metadata["page_start"])
+    return None
+
+def render_pdf_viewer(container, file_path: str, page_range=None):
+    """
+    Show a PDF preview and download button inside an expander of the given container.
+    With a page range only those pages are previewed, extracted into a small PDF of their own.
+    """
+    preview_path = extract_pages(file_path, *page_range) if page_range else None
+    if preview_path:
+        pages = f"page {page_range[0]}" if page_range[0] == page_range[1] else f"pages {page_range[0]}-{page_range[1]}"
+        label = f"📄 View Relevant Passage ({os.path.basename(file_path)}, {pages})"
+    else:
+        preview_path = file_path
+        label = "📄 View Relevant Document"
+
+    with container.expander(label, expanded=False):
+        # Show PDF preview
+        preview_url = get_pdf_url(str(preview_path))
+        if preview_url:
+            st.markdown(
+                f'<iframe src="{preview_url}" loading="lazy" width="100%" height="600px" style="border: none;"></iframe>',
+                unsafe_allow_html=True
+            )
+            # Add download button for the whole document below the preview
+            pdf_url = get_pdf_url(file_path)
+            filename = os.path.basename(file_path)
+            st.markdown(
+                f'<a href="{pdf_url}" download="{filename}" style="text-decoration:none;color:#2E8BC0;padding:0.5em 1em;border:1px solid #2E8BC0;border-radius:5px;background-color:white;display:inline-block;margin-top:10px;">📥 Download PDF</a>',
+                unsafe_allow_html=True
+            )
+
 def display_source_documents(message, idx):
     if "source_docs" in message:
         st.divider()
@@ -62,21 +135,7 @@ def display_source_documents(message, idx):
             if doc and doc.get("file_path"):
                 file_path = doc.get("file_path")
                 if file_path and file_path.endswith('.pdf'):
-                    # Create an expander for the PDF viewer
-                    with st.expander("📄 View Relevant Document", expanded=False):
-                        # Show PDF preview
-                        pdf_data = get_pdf_data(file_path)
-                        if pdf_data:
-                            st.markdown(
-                                f'<iframe src="{pdf_data}" width="100%" height="600px" style="border: none;"></iframe>',
-                                unsafe_allow_html=True
-                            )
-                            # Add download button below the PDF
-                            filename = os.path.basename(file_path)
-                            st.markdown(
-                                f'<a href="{pdf_data}" download="{filename}" style="text-decoration:none;color:#2E8BC0;padding:0.5em 1em;border:1px solid #2E8BC0;border-radius:5px;background-color:white;display:inline-block;margin-top:10px;">📥 Download PDF</a>',
-                                unsafe_allow_html=True
-                            )
+                    render_pdf_viewer(st, file_path, get_page_range(doc))
 
 def handle_user_input(rag_handler):
     if prompt := st.chat_input("Ask your question here..."):
@@ -89,35 +148,22 @@ def handle_user_input(rag_handler):
             full_response = ""
             
             # Stream the response
-            for chunk in rag_handler.generate_response(prompt, st.session_state.messages):
+            rag_response = rag_handler.generate_response(prompt, st.session_state.messages, session_id=st.session_state.session_id)
+            for chunk in rag_response:
                 if chunk:
                     full_response += chunk
                     message_placeholder.markdown(full_response + "▌")
             
             message_placeholder.markdown(full_response)
             
-            # Add source documents if available
-            contexts = rag_handler._get_relevant_context(prompt)
+            # Add source documents if available, reusing the contexts retrieved for the answer
+            contexts = rag_response.contexts
             if contexts and len(contexts) > 0:
                 most_relevant_doc = contexts[0]
                 if most_relevant_doc.get("file_path"):
                     response.divider()
                     response.markdown("**Relevant Document:**")
-                    # Create an expander for the PDF viewer
-                    with response.expander("📄 View Relevant Document", expanded=False):
-                        # Show PDF preview
-                        pdf_data = get_pdf_data(most_relevant_doc["file_path"])
-                        if pdf_data:
-                            st.markdown(
-                                f'<iframe src="{pdf_data}" width="100%" height="600px" style="border: none;"></iframe>',
-                                unsafe_allow_html=True
-                            )
-                            # Add download button below the PDF
-                            filename = os.path.basename(most_relevant_doc["file_path"])
-                            st.markdown(
-                                f'<a href="{pdf_data}" download="{filename}" style="text-decoration:none;color:#2E8BC0;padding:0.5em 1em;border:1px solid #2E8BC0;border-radius:5px;background-color:white;display:inline-block;margin-top:10px;">📥 Download PDF</a>',
-                                unsafe_allow_html=True
-                            )
+                    render_pdf_viewer(response, most_relevant_doc["file_path"], get_page_range(most_relevant_doc))
             
             st.session_state.messages.append({
                 "role": "assistant", 
@@ -127,7 +173,7 @@ def handle_user_input(rag_handler):
             
         except Exception as e:
             st.error(f"Error: {str(e)}")
-            print(f"Full error details: {str(e)}")  # For debugging
+            logger.exception("Error generating response")
     
 def main():
     st.set_page_config(